@@ -0,0 +1,495 @@
+"""
+This module contains the benchmarks of the crypto, I/O and deletion hot paths.
+
+The benchmarks run on a synthetic corpus created in a temporary folder (many tiny files, some medium
+files and one huge file), every benchmark is repeated and the best time is kept. The results can be saved
+as JSON and compared with a baseline saved by a previous run.
+The startup benchmarks (startup.*) run a cheap call of every command of the CLI (e.g. encrypting a tiny file)
+in a new interpreter with -X importtime and measure the cold start time and the time spent importing modules.
+"""
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import pycryptex
+from pycryptex.crypto import common, compression, keys, stream
+from pycryptex.crypto.aes import AESCryptex, pbkdf2_params
+from pycryptex.crypto.rsa import RSACryptex
+from pycryptex.internal import utils, pipeline
+
+MB = 1024 * 1024
+PASSWORD = "pycryptex-bench"
+# name, number of files and size of every file of the corpus (with scale = 1)
+CORPUS = (
+    ("tiny", 2000, 512),
+    ("medium", 32, MB),
+    ("huge", 1, 128 * MB),
+)
+
+# list of (name, function) of the benchmarks, see the benchmark decorator
+BENCHMARKS = []
+
+
+def benchmark(name: str):
+    """
+    Decorator to register a benchmark. The function receives the corpus and returns a tuple of
+    (func to measure, bytes processed, files processed, setup func called before every repetition or None).
+    """
+
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+
+    return register
+
+
+class Corpus:
+    """
+    Synthetic files used by the benchmarks.
+    """
+
+    def __init__(self, folder: str, scale: float = 1.0):
+        self.folder = folder
+        self.sets = {}
+        block = os.urandom(MB)
+        for name, count, size in CORPUS:
+            set_folder = os.path.join(folder, name)
+            os.mkdir(set_folder)
+            size = max(1, int(size * scale))
+            files = []
+            for i in range(max(1, int(count * scale))):
+                file = os.path.join(set_folder, f"{name}{i}.bin")
+                write_random_file(file, size, block)
+                files.append(file)
+            self.sets[name] = (files, size)
+        # RSA keys used by the benchmarks
+        self.keys_folder = os.path.join(folder, "keys")
+        os.mkdir(self.keys_folder)
+        RSACryptex.create_keys(self.keys_folder)
+        self.public_key = os.path.join(self.keys_folder, "pycryptex_key.pub")
+        self.private_key = os.path.join(self.keys_folder, "pycryptex_key")
+        # (public key, private key) of every key type, used to compare them
+        self.keys = {"rsa": (self.public_key, self.private_key)}
+        for key_type, cryptex_class in keys.KEY_TYPES.items():
+            if key_type not in self.keys:
+                key_folder = os.path.join(self.keys_folder, key_type)
+                os.mkdir(key_folder)
+                cryptex_class.create_keys(key_folder)
+                self.keys[key_type] = (os.path.join(key_folder, "pycryptex_key.pub"),
+                                       os.path.join(key_folder, "pycryptex_key"))
+
+    def files(self, name: str) -> list:
+        return self.sets[name][0]
+
+    def size(self, name: str) -> int:
+        files, size = self.sets[name]
+        return len(files) * size
+
+
+def write_random_file(file: str, size: int, block: bytes):
+    """
+    Write a file of size bytes repeating the random block passed as argument.
+    """
+    with open(file, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def _measure(func, repeat: int, setup=None) -> float:
+    """
+    Return the best time of func over repeat executions.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        run_time = time.perf_counter() - start_time
+        best = run_time if best is None else min(best, run_time)
+    return best
+
+
+@benchmark("aes.encrypt_data")
+def _aes_encrypt_data(corpus: Corpus):
+    data = open(corpus.files("medium")[0], "rb").read()
+    aes = AESCryptex()
+    return lambda: aes.encrypt_data(data, PASSWORD), len(data), 1, None
+
+
+@benchmark("aes.decrypt_data")
+def _aes_decrypt_data(corpus: Corpus):
+    data = open(corpus.files("medium")[0], "rb").read()
+    aes = AESCryptex()
+    enc_data = aes.encrypt_data(data, PASSWORD)
+    return lambda: aes.decrypt_data(enc_data, PASSWORD), len(data), 1, None
+
+
+@benchmark("rsa.encrypt_data")
+def _rsa_encrypt_data(corpus: Corpus):
+    data = open(corpus.files("medium")[0], "rb").read()
+    rsa = RSACryptex()
+    return lambda: rsa.encrypt_data(data, corpus.public_key), len(data), 1, None
+
+
+@benchmark("rsa.decrypt_data")
+def _rsa_decrypt_data(corpus: Corpus):
+    data = open(corpus.files("medium")[0], "rb").read()
+    enc_data = RSACryptex().encrypt_data(data, corpus.public_key)
+    rsa = RSACryptex()
+    return lambda: rsa.decrypt_data(enc_data, corpus.private_key), len(data), 1, None
+
+
+def _suite_benchmark(suite: int, is_encrypt: bool):
+    """
+    Create the benchmark of the encryption/decryption in memory (AES) with a cipher suite.
+    """
+
+    def create(corpus: Corpus):
+        data = open(corpus.files("medium")[0], "rb").read()
+        aes = AESCryptex(suite=suite)
+        if is_encrypt:
+            return lambda: aes.encrypt_data(data, PASSWORD), len(data), 1, None
+        enc_data = aes.encrypt_data(data, PASSWORD)
+        return lambda: aes.decrypt_data(enc_data, PASSWORD), len(data), 1, None
+
+    return create
+
+
+for _suite_name, _suite in stream.SUITES.items():
+    benchmark(f"suite.{_suite_name}.encrypt")(_suite_benchmark(_suite, True))
+    benchmark(f"suite.{_suite_name}.decrypt")(_suite_benchmark(_suite, False))
+
+
+def text_data(size: int) -> bytes:
+    """
+    Return size bytes of JSON log lines, the kind of data that compresses well.
+    """
+    lines = []
+    total, i = 0, 0
+    while total < size:
+        line = b'{"time": %d, "level": "info", "request": %d, "message": "request served in %d ms"}\n' % (
+            1600000000 + i, i * 7919 % 100003, i % 997)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines)[:size]
+
+
+def _compression_benchmark(algorithm: int, compressible: bool):
+    """
+    Create the benchmark of the encryption in memory (AES) with compression: of text (compressible) or of random
+    data (only the sample is compressed, it measures the cost of the detection).
+    """
+
+    def create(corpus: Corpus):
+        data = open(corpus.files("medium")[0], "rb").read()
+        if compressible:
+            data = text_data(len(data))
+        aes = AESCryptex(compression=algorithm)
+        return lambda: aes.encrypt_data(data, PASSWORD), len(data), 1, None
+
+    return create
+
+
+for _compression_name, _compression in compression.COMPRESSIONS.items():
+    if _compression == compression.COMPRESSION_ZSTD and importlib.util.find_spec("zstandard") is None:
+        continue
+    benchmark(f"compression.{_compression_name}.text")(_compression_benchmark(_compression, True))
+    benchmark(f"compression.{_compression_name}.random")(_compression_benchmark(_compression, False))
+
+
+def _keys_create_benchmark(key_type: str):
+    """
+    Create the benchmark of the creation of a key pair (create-keys).
+    """
+
+    def create(corpus: Corpus):
+        folder = os.path.join(corpus.folder, f"create-keys-{key_type}")
+        os.makedirs(folder, exist_ok=True)
+        return lambda: keys.KEY_TYPES[key_type].create_keys(folder), 0, 1, None
+
+    return create
+
+
+def _keys_decrypt_benchmark(key_type: str):
+    """
+    Create the benchmark of the decryption in memory of the tiny files, every one with its own session key: the
+    private key operation that unwraps the session key is paid for every file (the cache is cleared before
+    every repetition). The encrypted size of the files shows the overhead of the wrapped keys.
+    """
+
+    def create(corpus: Corpus):
+        public_key, private_key = corpus.keys[key_type]
+        files = corpus.files("tiny")
+        enc_data = [keys.new_cryptex(key_type).encrypt_data(open(f, "rb").read(), public_key) for f in files]
+        cryptex = keys.new_cryptex(key_type)
+
+        def run():
+            for data in enc_data:
+                cryptex.decrypt_data(data, private_key)
+        return run, sum(len(data) for data in enc_data), len(files), cryptex.session_keys.clear
+
+    return create
+
+
+for _key_type in keys.KEY_TYPES:
+    benchmark(f"keys.{_key_type}.create")(_keys_create_benchmark(_key_type))
+    benchmark(f"keys.{_key_type}.decrypt_tiny")(_keys_decrypt_benchmark(_key_type))
+
+
+def _files_benchmark(name: str, is_encrypt: bool):
+    """
+    Create the benchmark of common.encrypt_file/decrypt_file (RSA) over a set of files of the corpus.
+    """
+
+    def create(corpus: Corpus):
+        files = corpus.files(name)
+        rsa = RSACryptex()
+        if is_encrypt:
+            def run():
+                for f in files:
+                    common.encrypt_file(f, rsa.encrypt_stream, public_key=corpus.public_key)
+        else:
+            # the files are encrypted with a different object, rsa has to load the private key
+            enc_rsa = RSACryptex()
+            enc_files = [common.encrypt_file(f, enc_rsa.encrypt_stream, public_key=corpus.public_key)[0]
+                         for f in files]
+
+            def run():
+                for f in enc_files:
+                    common.decrypt_file(f, rsa.decrypt_stream, private_key=corpus.private_key)
+        return run, corpus.size(name), len(files), None
+
+    return create
+
+
+def _pipeline_benchmark(name: str, is_encrypt: bool):
+    """
+    Create the benchmark of the pipelined engine (RSA) over a set of files of the corpus.
+    """
+
+    def create(corpus: Corpus):
+        files = corpus.files(name)
+        if is_encrypt:
+            def run():
+                pipeline.process_files(files, RSACryptex(), True, remove=False, public_key=corpus.public_key)
+        else:
+            rsa = RSACryptex()
+            enc_files = [common.encrypt_file(f, rsa.encrypt_stream, public_key=corpus.public_key)[0]
+                         for f in files]
+
+            def run():
+                pipeline.process_files(enc_files, RSACryptex(), False, remove=False, private_key=corpus.private_key)
+        return run, corpus.size(name), len(files), None
+
+    return create
+
+
+for _set_name, _, _ in CORPUS:
+    benchmark(f"common.encrypt_file.{_set_name}")(_files_benchmark(_set_name, True))
+    benchmark(f"common.decrypt_file.{_set_name}")(_files_benchmark(_set_name, False))
+    benchmark(f"pipeline.encrypt_files.{_set_name}")(_pipeline_benchmark(_set_name, True))
+    benchmark(f"pipeline.decrypt_files.{_set_name}")(_pipeline_benchmark(_set_name, False))
+
+
+@benchmark("utils.secure_delete")
+def _secure_delete(corpus: Corpus):
+    file = os.path.join(corpus.folder, "to_delete.bin")
+    size = corpus.size("huge")
+    block = os.urandom(MB)
+    return lambda: utils.secure_delete(file), size, 1, lambda: write_random_file(file, size, block)
+
+
+# configuration of the startup benchmarks: a light key derivation, the AES commands measure the startup, not PBKDF2
+STARTUP_CONFIG = """[config]
+private-key = ""
+public-key = ""
+secure-deletion = false
+pbkdf2-iterations = 1000
+"""
+
+
+def startup_commands(folder: str) -> list:
+    """
+    Create into folder the files used by the startup benchmarks and return the list of (name, CLI arguments,
+    arguments of measure_startup). Every command makes a real cheap call (e.g. encrypt or decrypt a tiny file),
+    so the modules it imports are measured; the commands without a cheap call that leaves the home folder
+    untouched (startup.<command>.help) only show their help.
+    """
+    from pycryptex.main import cli
+    os.makedirs(os.path.join(folder, ".pycryptex"))
+    with open(os.path.join(folder, ".pycryptex", "pycryptex.toml"), "w") as f:
+        f.write(STARTUP_CONFIG)
+    RSACryptex.create_keys(folder)
+    public_key = os.path.join(folder, "pycryptex_key.pub")
+    private_key = os.path.join(folder, "pycryptex_key")
+    data = os.urandom(512)
+    clear_file = os.path.join(folder, "tiny.txt")
+    rsa_file = os.path.join(folder, "tiny-rsa.txt.pycpx")
+    aes_file = os.path.join(folder, "tiny-aes.txt.pycpx")
+    with open(clear_file, "wb") as f:
+        f.write(data)
+    with open(rsa_file, "wb") as f:
+        f.write(RSACryptex().encrypt_data(data, public_key))
+    with open(aes_file, "wb") as f:
+        f.write(AESCryptex(kdf=pbkdf2_params(1000)).encrypt_data(data, PASSWORD))
+    calls = {
+        "agent": (["agent", "status"], {}),
+        "cat": (["cat", "--privkey", private_key, rsa_file], {}),
+        "decrypt": (["decrypt", "--keep", "--privkey", private_key, rsa_file], {"output": rsa_file[:-6]}),
+        "encrypt": (["encrypt", "--keep", "--pubkey", public_key, clear_file], {"output": clear_file + ".pycpx"}),
+        "show-config": (["show-config"], {}),
+        "verify": (["verify", "--privkey", private_key, rsa_file], {}),
+    }
+    # the password is read from the standard input only without a terminal (see measure_startup)
+    if os.name != "nt":
+        calls["decrypt-aes"] = (["decrypt-aes", "--keep", aes_file], {"input": f"{PASSWORD}\n",
+                                                                      "output": aes_file[:-6]})
+        calls["encrypt-aes"] = (["encrypt-aes", "--keep", clear_file], {"input": f"{PASSWORD}\n{PASSWORD}\n",
+                                                                        "output": clear_file + ".pycpx"})
+    # --version reads the version from the metadata of the installed package, it fails from a source tree
+    commands = [("startup.version", ["--version"], {"check": False}), ("startup.help", ["--help"], {})]
+    for name in sorted(cli.commands):
+        if name in calls:
+            commands.append((f"startup.{name}", *calls[name]))
+        else:
+            commands.append((f"startup.{name}.help", [name, "--help"], {}))
+    return commands
+
+
+def measure_startup(args: list, repeat: int, home: str, input: str = None, output: str = None,
+                    check: bool = True) -> dict:
+    """
+    Run the CLI with args in a new interpreter and return the best wall time and the time spent importing
+    modules (as reported by python -X importtime) of that run, in seconds.
+
+    :param args: arguments of the CLI
+    :param repeat: number of runs, the best one is kept
+    :param home: home folder of the runs (with the config file created by startup_commands)
+    :param input: (optional) standard input of the runs (e.g. the password)
+    :param output: (optional) file created by the command, removed before every run
+    :param check: True to raise RuntimeError if the command fails (its measure would be meaningless)
+    """
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    env.pop("PYCRYPTEX_AGENT_SOCK", None)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(pycryptex.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (package_root, env.get("PYTHONPATH")) if p)
+    command = [sys.executable, "-X", "importtime", "-c",
+               "import sys; from pycryptex.main import cli; cli(sys.argv[1:])"]
+    best = None
+    for _ in range(repeat):
+        if output is not None and os.path.exists(output):
+            os.remove(output)
+        start_time = time.perf_counter()
+        # a new session has no terminal, the password is read from the standard input
+        completed = subprocess.run(command + args, env=env, input=None if input is None else input.encode(),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=home,
+                                   start_new_session=os.name != "nt")
+        run_time = time.perf_counter() - start_time
+        if check and completed.returncode != 0:
+            raise RuntimeError(f"pycryptex {' '.join(args)} failed with exit code {completed.returncode}")
+        if best is None or run_time < best["seconds"]:
+            import_us = 0
+            for line in completed.stderr.decode("utf-8", "replace").splitlines():
+                # import time: self [us] | cumulative | imported package
+                if line.startswith("import time:") and "|" in line:
+                    value = line[len("import time:"):].split("|")[0].strip()
+                    if value.isdigit():
+                        import_us += int(value)
+            best = {"seconds": run_time, "import_seconds": import_us / 1000000}
+    return best
+
+
+def run(scale: float = 1.0, repeat: int = 3, only: str = None, progress=None) -> dict:
+    """
+    Run the benchmarks.
+
+    :param scale: factor applied to the number and size of the files of the corpus
+    :param repeat: number of repetitions of every benchmark, the best time is kept
+    :param only: (optional) run only the benchmarks whose name starts with this prefix
+    :param progress: (optional) function called with the name of every benchmark before running it
+    :return: dictionary with the environment and the results (seconds, MB/s and files/s of every benchmark,
+             seconds and import seconds of the startup benchmarks)
+    """
+    if pycryptex.config_params is None:
+        pycryptex.config_params = pycryptex.Config()
+    results = {}
+    benchmarks = [(name, create) for name, create in BENCHMARKS if not only or name.startswith(only)]
+    if benchmarks:
+        folder = tempfile.mkdtemp(prefix="pycryptex-bench-")
+        try:
+            corpus = Corpus(folder, scale)
+            for name, create in benchmarks:
+                if progress is not None:
+                    progress(name)
+                func, size, files, setup = create(corpus)
+                seconds = _measure(func, repeat, setup)
+                results[name] = {"seconds": seconds, "files_s": files / seconds}
+                # the benchmarks without bytes processed (e.g. keys.*.create) are compared by seconds
+                if size:
+                    results[name]["mb_s"] = size / MB / seconds
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    if not only or "startup.".startswith(only) or only.startswith("startup."):
+        folder = tempfile.mkdtemp(prefix="pycryptex-bench-")
+        try:
+            for name, args, kwargs in startup_commands(folder):
+                if only and not name.startswith(only):
+                    continue
+                if progress is not None:
+                    progress(name)
+                results[name] = measure_startup(args, repeat, folder, **kwargs)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return {
+        "pycryptex": pycryptex.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 10.0) -> list:
+    """
+    Compare the results with a baseline.
+
+    :param results: results returned by run
+    :param baseline: results of a previous run
+    :param tolerance: slowdown (in percentage) over which a benchmark is considered a regression
+    :return: list of (name, baseline value, current value, change in percentage, True if it is a regression, unit)
+             for the benchmarks present in both. The value is MB/s, or milliseconds for the benchmarks without
+             bytes processed (startup.*, keys.*.create)
+    """
+    rows = []
+    for name, current in results["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        if current.get("mb_s") and base.get("mb_s"):
+            change = (current["mb_s"] - base["mb_s"]) / base["mb_s"] * 100
+            rows.append((name, base["mb_s"], current["mb_s"], change, change < -tolerance, "MB/s"))
+        elif current.get("seconds") and base.get("seconds"):
+            # a longer time is a slowdown
+            change = (base["seconds"] - current["seconds"]) / base["seconds"] * 100
+            rows.append((name, base["seconds"] * 1000, current["seconds"] * 1000, change, change < -tolerance, "ms"))
+    return rows
+
+
+def save(results: dict, file: str):
+    with open(file, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load(file: str) -> dict:
+    with open(file, "r") as f:
+        return json.load(f)
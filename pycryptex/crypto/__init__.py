@@ -0,0 +1,10 @@
+__all__ = ["EncryptingWriter", "DecryptingReader"]
+
+
+def __getattr__(name):
+    # the file objects are imported on first use: importing pycryptex.crypto.stream (or any other submodule)
+    # doesn't load fileobj and all the crypto modules it depends on
+    if name in __all__:
+        from pycryptex.crypto import fileobj
+        return getattr(fileobj, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
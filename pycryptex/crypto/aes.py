@@ -1,56 +1,267 @@
+import io
+import struct
+from collections import OrderedDict
 from Crypto.Random import get_random_bytes
-from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Protocol.KDF import PBKDF2, scrypt
+from Crypto.Hash import SHA1, SHA256
 from Crypto.Cipher import AES
+from pycryptex.crypto import stream
+from pycryptex.crypto.compression import COMPRESSION_NONE
+from pycryptex.internal import metrics
+
+# key derivation functions, saved into the file header with their parameters
+KDF_PBKDF2 = 1
+KDF_SCRYPT = 2
+_PBKDF2_PARAMS = struct.Struct(">BBI")  # kdf, hash (1 = SHA1, 2 = SHA256), iterations
+_SCRYPT_PARAMS = struct.Struct(">BBBB")  # kdf, log2 of N, r, p
+_PBKDF2_HASHES = {1: SHA1, 2: SHA256}
+# upper limits accepted reading a file header: the headers aren't trusted, a crafted file must not be able to
+# keep the CPU busy for minutes or to allocate gigabytes of memory before the password is even checked
+MAX_PBKDF2_ITERATIONS = 5000000
+MAX_SCRYPT_COST = 20
+MAX_SCRYPT_R = 32
+MAX_SCRYPT_P = 16
+# memory used by scrypt (128 * N * r bytes)
+MAX_SCRYPT_MEMORY = 2 ** 30
+
+DEFAULT_PBKDF2_ITERATIONS = 600000
+DEFAULT_SCRYPT_COST = 17
+# number of derived keys kept in memory by an AESCryptex
+DERIVED_KEYS_CACHE_SIZE = 32
+
+
+def pbkdf2_params(iterations: int = DEFAULT_PBKDF2_ITERATIONS, hash_id: int = 2) -> bytes:
+    """
+    Return the parameters of PBKDF2 (with HMAC-SHA256 by default) as saved into the file header.
+    """
+    if not 1 <= iterations <= MAX_PBKDF2_ITERATIONS:
+        raise ValueError(f"PBKDF2 iterations must be between 1 and {MAX_PBKDF2_ITERATIONS}")
+    return _PBKDF2_PARAMS.pack(KDF_PBKDF2, hash_id, iterations)
+
+
+def scrypt_params(cost: int = DEFAULT_SCRYPT_COST, r: int = 8, p: int = 1) -> bytes:
+    """
+    Return the parameters of scrypt as saved into the file header, cost is log2 of N (e.g. 17 means N = 2^17).
+    """
+    if not 1 <= cost <= MAX_SCRYPT_COST:
+        raise ValueError(f"scrypt cost must be between 1 and {MAX_SCRYPT_COST}")
+    if not _scrypt_bounded(cost, r, p):
+        raise ValueError(f"scrypt r must be between 1 and {MAX_SCRYPT_R}, p between 1 and {MAX_SCRYPT_P} and the "
+                         f"memory used at most {MAX_SCRYPT_MEMORY} bytes")
+    return _SCRYPT_PARAMS.pack(KDF_SCRYPT, cost, r, p)
+
+
+def _scrypt_bounded(cost: int, r: int, p: int) -> bool:
+    return 1 <= cost <= MAX_SCRYPT_COST and 1 <= r <= MAX_SCRYPT_R and 1 <= p <= MAX_SCRYPT_P and \
+        128 * r * 2 ** cost <= MAX_SCRYPT_MEMORY
+
+
+# the key derivation used by the older versions of pycryptex: PBKDF2 with HMAC-SHA1 and 1000 iterations
+LEGACY_KDF = pbkdf2_params(1000, hash_id=1)
+DEFAULT_KDF = pbkdf2_params()
+
+
+def kdf_from_config(config: dict) -> bytes:
+    """
+    Return the key derivation parameters set in the [config] section of the pycryptex.toml file:
+    - kdf: "pbkdf2" or "scrypt"
+    - pbkdf2-iterations: number of iterations of PBKDF2
+    - scrypt-cost: log2 of the N parameter of scrypt
+    """
+    kdf = config.get('kdf', 'pbkdf2')
+    if kdf == 'pbkdf2':
+        return pbkdf2_params(int(config.get('pbkdf2-iterations', DEFAULT_PBKDF2_ITERATIONS)))
+    if kdf == 'scrypt':
+        return scrypt_params(int(config.get('scrypt-cost', DEFAULT_SCRYPT_COST)))
+    raise ValueError(f"unknown key derivation function '{kdf}', use 'pbkdf2' or 'scrypt'")
+
+
+def derive_key(pwd: str, salt: bytes, kdf: bytes = LEGACY_KDF) -> bytes:
+    """
+    Generate the AES key from the password and the salt.
+
+    :param pwd: password
+    :param salt: salt
+    :param kdf: key derivation function and its parameters (see pbkdf2_params and scrypt_params)
+    :return: the key of 32 bytes
+    """
+    kdf = bytes(kdf)
+    if kdf[:1] == bytes((KDF_PBKDF2,)) and len(kdf) == _PBKDF2_PARAMS.size:
+        _, hash_id, iterations = _PBKDF2_PARAMS.unpack(kdf)
+        if hash_id in _PBKDF2_HASHES and 1 <= iterations <= MAX_PBKDF2_ITERATIONS:
+            return PBKDF2(pwd, salt, dkLen=32, count=iterations, hmac_hash_module=_PBKDF2_HASHES[hash_id])
+    elif kdf[:1] == bytes((KDF_SCRYPT,)) and len(kdf) == _SCRYPT_PARAMS.size:
+        _, cost, r, p = _SCRYPT_PARAMS.unpack(kdf)
+        if _scrypt_bounded(cost, r, p):
+            return scrypt(pwd, salt, 32, N=2 ** cost, r=r, p=p)
+    raise ValueError("unsupported key derivation function in the file header")
 
 
 class AESCryptex:
-    def __init__(self):
+    def __init__(self, kdf: bytes = DEFAULT_KDF, cache_size: int = DERIVED_KEYS_CACHE_SIZE,
+                 suite: int = stream.DEFAULT_SUITE, compression: int = COMPRESSION_NONE):
+        # key and salt used for encryption
         self.key: bytes = None
         self.salt: bytes = None
+        # key derivation function used for encryption (see kdf_from_config)
+        self.kdf = kdf
+        # AEAD cipher used for encryption (see stream.SUITES), decryption reads it from the file header
+        self.suite = suite
+        # compression of the content before encryption (see compression.COMPRESSIONS), used only if a sample
+        # of the file compresses
+        self.compression = compression
+        # (optional) pycryptex agent that derives the keys with the password it keeps in memory
+        self.agent = None
+        # LRU cache of the derived keys indexed by salt and key derivation parameters
+        self.derived_keys = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-    def encrypt_data(self, clear_data: bytes, pwd: str) -> bytes:
+    def encrypt_stream(self, reader, writer, pwd: str) -> int:
         """
-        This example do the following:
-        - generate a salt
-        - encrypt the clear_data
+        Encrypt the reader content into the writer using the chunked .pycpx format:
+        - generate a salt (only the first time, the key is reused for the next files)
+        - write the header containing the salt and the key derivation parameters
+        - encrypt the reader content segment by segment (compressed before, if the compression is set and a
+          sample of the content compresses)
 
-        :param clear_data: list of bytes to encrypt
+        :param reader: binary stream with the clear data
+        :param writer: binary stream where to write the encrypted data
         :param pwd: password to encrypt
-        :return: encrypted bytes
+        :return: number of clear bytes encrypted
+        """
+        key, header = self.new_stream(pwd)
+        return stream.encrypt(key, header, reader, writer, self.compression)
+
+    def create_stream(self, writer, pwd: str, flags: int = 0) -> stream.SegmentWriter:
+        """
+        Return a binary stream that encrypts the data written into the writer (see encrypt_stream),
+        the encryption is completed closing the returned stream.
+
+        :param writer: binary stream where to write the encrypted data
+        :param pwd: password to encrypt
+        :param flags: flags saved into the header (e.g. stream.FLAG_ARCHIVE)
+        :return: a writable binary stream
+        """
+        key, header = self.new_stream(pwd, flags)
+        # the content of a stream can't be sampled, it is compressed if the compression is set
+        header.compression = self.compression
+        return stream.SegmentWriter(key, header, writer)
+
+    def new_stream(self, pwd: str, flags: int = 0) -> (bytes, stream.Header):
+        """
+        Return the key and the header of a new encrypted stream (see encrypt_stream).
         """
         if self.salt is None:
             self.salt = get_random_bytes(32)
-            self.key = PBKDF2(pwd, self.salt, dkLen=32)  # the key that you can encrypt with
-        cipher_aes = AES.new(self.key, AES.MODE_EAX)  # EAX mode
-        # Encrypt and digest to get the ciphered data and tag
-        ciphered_data, tag = cipher_aes.encrypt_and_digest(clear_data)
+            self.key = self._derive_key(pwd, self.salt, self.kdf)
+        return self.key, stream.Header(stream.KIND_AES, [self.salt, self.kdf], suite=self.suite, flags=flags)
+
+    def decrypt_stream(self, reader, writer, pwd: str) -> int:
+        """
+        Decrypt the reader content into the writer. Files created with the chunked format are decrypted
+        segment by segment, files created with older versions of pycryptex are read in memory.
 
-        encbytes_out = bytearray()
-        for x in (self.salt, cipher_aes.nonce, tag, ciphered_data):
-            encbytes_out.extend(x)
-        return bytes(encbytes_out)
+        :param reader: binary stream with the encrypted data
+        :param writer: binary stream where to write the decrypted data
+        :param pwd: password to decrypt
+        :return: number of clear bytes decrypted
+        """
+        header, head = stream.read_header(reader)
+        if header is None:
+            clear_data = self.decrypt_data(head + reader.read(), pwd)
+            writer.write(clear_data)
+            return len(clear_data)
+        return stream.decrypt(self.stream_key(header, pwd), header, reader, writer)
+
+    def open_stream(self, reader, pwd: str) -> (stream.Header, io.BufferedIOBase):
+        """
+        Return the header and a binary stream that reads the decrypted content of the reader. The header is
+        None for the files created with older versions of pycryptex (they are decrypted in memory).
+
+        :param reader: binary stream with the encrypted data
+        :param pwd: password to decrypt
+        :return: (header, readable binary stream)
+        """
+        header, head = stream.read_header(reader)
+        if header is None:
+            return None, io.BytesIO(self.decrypt_data(head + reader.read(), pwd))
+        return header, io.BufferedReader(stream.open_reader(self.stream_key(header, pwd), header, reader))
+
+    def stream_key(self, header: stream.Header, pwd: str) -> bytes:
+        """
+        Return the key of an encrypted stream deriving it from the password and the header parameters.
+        """
+        if header.kind != stream.KIND_AES or len(header.slots) not in (1, 2):
+            raise ValueError("the file has not been encrypted with a password")
+        # the first files in the chunked format have only the salt and use the old key derivation
+        kdf = header.slots[1] if len(header.slots) == 2 else LEGACY_KDF
+        return self._derive_key(pwd, header.slots[0], kdf)
+
+    def encrypt_data(self, clear_data: bytes, pwd: str) -> bytes:
+        """
+        Encrypt the clear_data in memory (see encrypt_stream).
+
+        :param clear_data: list of bytes to encrypt
+        :param pwd: password to encrypt
+        :return: encrypted bytes
+        """
+        enc_data = io.BytesIO()
+        self.encrypt_stream(io.BytesIO(clear_data), enc_data, pwd)
+        return enc_data.getvalue()
 
     def decrypt_data(self, enc_data: bytes, pwd: str) -> bytes:
         """
-        This example do the following:
-        - retrieve the salt
-        - decrypt the clear_data
+        Decrypt the enc_data in memory. Data created with older versions of pycryptex are made by:
+        - salt
+        - nonce
+        - tag
+        - encrypted bytes
 
         :param enc_data: list of bytes to decrypt
         :param pwd: password to encrypt
         :return: decrypted bytes
         """
-        if self.salt is None:
-            self.salt = enc_data[:32]
-            self.key = PBKDF2(pwd, self.salt, dkLen=32)  # the key that you can decrypt with
-        # salt = enc_data[:32]
+        if stream.is_stream(enc_data):
+            clear_data = io.BytesIO()
+            self.decrypt_stream(io.BytesIO(enc_data), clear_data, pwd)
+            return clear_data.getvalue()
+        # views on enc_data, the encrypted bytes are not copied
+        enc_data = memoryview(enc_data)
+        key = self._derive_key(pwd, bytes(enc_data[:32]), LEGACY_KDF)
         nonce = enc_data[32:48]
         tag = enc_data[48:64]
         ciphered_data = enc_data[64:]
-        # generate the key
-        # key = PBKDF2(pwd, salt, dkLen=32)  # the key that you can encrypt with
 
-        cipher = AES.new(self.key, AES.MODE_EAX, nonce)
+        cipher = AES.new(key, AES.MODE_EAX, nonce)
         original_data = cipher.decrypt_and_verify(ciphered_data, tag)
         return original_data
 
+    def _derive_key(self, pwd: str, salt: bytes, kdf: bytes) -> bytes:
+        """
+        Generate the key from the password. Every distinct salt is derived only once, the derived keys
+        are kept in a LRU cache.
+        """
+        cache_key = (bytes(salt), bytes(kdf))
+        key = self.derived_keys.get(cache_key)
+        if key is not None:
+            self.derived_keys.move_to_end(cache_key)
+            self.cache_hits += 1
+            return key
+        self.cache_misses += 1
+        with metrics.phase("kdf"):
+            if self.agent is not None:
+                key = self.agent.derive(salt, kdf)
+            else:
+                key = derive_key(pwd, salt, kdf)
+        self.derived_keys[cache_key] = key
+        if len(self.derived_keys) > self.cache_size:
+            self.derived_keys.popitem(last=False)
+        return key
+
+    def cache_stats(self) -> dict:
+        """
+        Return the hits and misses of the derived keys cache.
+        """
+        return {"hits": self.cache_hits, "misses": self.cache_misses}
@@ -0,0 +1,126 @@
+"""
+This module encrypts a whole folder into a single .pycpx container: the folder is streamed as a tar
+archive (paths, permissions and mtimes included) into one encrypted stream, with a single key and
+without creating an encrypted file for every file of the folder.
+
+The header of the container has the stream.FLAG_ARCHIVE flag, decrypting it the folder is extracted
+next to the container.
+"""
+import os
+import tarfile
+from pycryptex.crypto import stream
+from pycryptex.crypto.common import remove_file, replace_durably, PARTIAL_SUFFIX
+
+
+def is_archive(file: str) -> bool:
+    """
+    Return True if the file is a container created by encrypt_folder (only the header is read).
+    """
+    with open(file, 'rb') as reader:
+        header, _ = stream.read_header(reader)
+    return header is not None and bool(header.flags & stream.FLAG_ARCHIVE)
+
+
+def encrypt_folder(folder: str, func, remove=False, **kwargs) -> str:
+    """
+    Encrypt the folder into a single file named as the folder plus .pycpx.
+
+    :param folder: folder to encrypt
+    :param func: function that returns a stream encrypting into a writer (e.g. RSACryptex.create_stream)
+    :param remove: bool to specify if remove the original folder
+    :return: the name of the encrypted file
+    """
+    folder = os.path.normpath(folder)
+    enc_filename = folder + ".pycpx"
+    # written with a temporary name, renamed once completed
+    partial = enc_filename + PARTIAL_SUFFIX
+    try:
+        with open(partial, 'wb') as writer:
+            with func(writer, flags=stream.FLAG_ARCHIVE, **kwargs) as enc_writer:
+                with tarfile.open(fileobj=enc_writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    tar.add(folder, arcname=os.path.basename(folder))
+            # the folder is removed only once the archive is on disk
+            replace_durably(writer, partial, enc_filename)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if remove:
+        remove_tree(folder)
+    return enc_filename
+
+
+def decrypt_archive(file: str, func, remove=False, **kwargs) -> str:
+    """
+    Decrypt a container created by encrypt_folder extracting the folder in the directory of the file.
+    The segments are authenticated before being extracted, an error stops the extraction.
+
+    :param file: encrypted file to decrypt
+    :param func: function that returns the header and the decrypted stream of a reader (e.g. RSACryptex.open_stream)
+    :param remove: bool to specify if remove the encrypted file
+    :return: the folder that has been extracted
+    """
+    dest = os.path.dirname(os.path.abspath(file))
+    roots = []
+    with open(file, 'rb') as reader:
+        header, clear_reader = func(reader, **kwargs)
+        if header is None or not header.flags & stream.FLAG_ARCHIVE:
+            raise ValueError(f"{file} is not an encrypted folder")
+        with tarfile.open(fileobj=clear_reader, mode="r|") as tar:
+            members = _checked_members(tar, dest, roots)
+            if hasattr(tarfile, 'fully_trusted_filter'):
+                # the members are already checked, keep all the permission bits
+                tar.extractall(dest, members=members, filter='fully_trusted')
+            else:
+                tar.extractall(dest, members=members)
+    if remove:
+        os.remove(file)
+    return os.path.join(dest, roots[0]) if roots else dest
+
+
+def _checked_members(tar: tarfile.TarFile, dest: str, roots: list):
+    """
+    Yield the members of the archive refusing the ones that would be written outside dest
+    (absolute paths, .. and links pointing outside) and the special files. The first directory
+    of the paths is appended to roots.
+    """
+    dest = os.path.realpath(dest)
+    for member in tar:
+        if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+            raise ValueError(f"{member.name}: unsupported file type in the archive")
+        path = _inside(dest, member.name)
+        if member.issym():
+            _inside(dest, os.path.join(os.path.dirname(path), member.linkname), member.name)
+        elif member.islnk():
+            _inside(dest, member.linkname, member.name)
+        if not roots:
+            roots.append(member.name.split('/')[0])
+        yield member
+
+
+def _inside(dest: str, name: str, member: str = None) -> str:
+    path = os.path.realpath(os.path.join(dest, name))
+    if os.path.commonpath((dest, path)) != dest:
+        raise ValueError(f"{member or name}: the path is outside the destination folder")
+    return path
+
+
+def remove_tree(folder: str):
+    """
+    Remove the folder and its content, the files are removed as set into the configuration
+    (see common.remove_file), the symbolic links are removed without touching their target.
+    """
+    for root, dirs, files in os.walk(folder, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.remove(path)
+            else:
+                remove_file(path)
+        for name in dirs:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.remove(path)
+            else:
+                os.rmdir(path)
+    os.rmdir(folder)
@@ -2,32 +2,33 @@
 This module contains some common function used by the crypto modules.
 """
 import os
+import time
 import pycryptex
+from pycryptex.internal import metrics
 from pycryptex.internal.utils import secure_delete, read_config
 
+# suffix of the files being written, they are renamed to their final name only once completed
+PARTIAL_SUFFIX = ".pycryptex-part"
+
 
 def encrypt_file(file: str, func, remove=False, **kwargs) -> (str, bool):
     """
-    Encrypt the file and create a new file appending .enc.
+    Encrypt the file and create a new file appending .pycpx.
 
     :param file: file to encrypt
-    :param public_key: RSA key used for encryption
+    :param func: function that encrypts a reader into a writer (e.g. RSACryptex.encrypt_stream)
     :param remove: bool to specify if remove original file
-    :return: None
+    :return: the name of the encrypted file and True if the file has been encrypted
     """
-    # if the file name ends with .enc, return ""
-    if file.endswith(".pycpx"):
+    # if the file name ends with .pycpx (or it is a file left by an interrupted run), return ""
+    if file.endswith((".pycpx", PARTIAL_SUFFIX)):
         return file, False
-    with open(file, 'rb') as byte_reader:
-        # Read all bytes
-        clear_bytes = byte_reader.read(-1)
-    # call the func to encrypt and convert the byte arrays into bytes to write on disk
-    enc_bytes_list = func(clear_bytes, **kwargs)
+    start_time = time.perf_counter()
     enc_filename = "".join((file, ".pycpx"))
-    with open(enc_filename, "wb") as f:
-        f.write(enc_bytes_list)
+    _stream_file(file, enc_filename, func, "encrypt", **kwargs)
     if remove:
         remove_file(file)
+    metrics.file_done(time.perf_counter() - start_time)
     return enc_filename, True
 
 
@@ -36,24 +37,131 @@ def decrypt_file(file: str, func, remove=False, **kwargs) -> (str, bool):
     Decrypt the file passed as argument and create a new file removing the .enc extension.
 
     :param file: encrypted file to decrypt
-    :param private_key: RSA private key used for decryption
+    :param func: function that decrypts a reader into a writer (e.g. RSACryptex.decrypt_stream)
     :param remove: bool to specify if remove the encrypted file
     :return: the name of the file that has been decrypted
     """
-    # if the file name ends with .enc, return ""
+    # if the file name doesn't end with .pycpx, return ""
     if not file.endswith(".pycpx"):
         return file, False
-    with open(file, 'rb') as byte_reader:
-        # Read all bytes
-        enc_bytes = byte_reader.read(-1)
-    clear_bytes_list = func(enc_bytes, **kwargs)
-    with open(file[:-6], "wb") as f:
-        f.write(clear_bytes_list)
+    start_time = time.perf_counter()
+    _stream_file(file, file[:-6], func, "decrypt", **kwargs)
     if remove:
-        os.remove(file)
+        with metrics.phase("delete"):
+            os.remove(file)
+    metrics.file_done(time.perf_counter() - start_time)
     return file[:-6], True
 
 
+class _NullWriter:
+    """
+    Binary stream that discards the data written.
+    """
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+def verify_file(file: str, func, **kwargs) -> (str, bool):
+    """
+    Decrypt the file discarding the decrypted data: every segment is authenticated and an exception is raised
+    if the file is not authentic, it is truncated or the key is wrong. Nothing is written on disk.
+
+    :param file: file to verify
+    :param func: function that decrypts a reader into a writer (e.g. RSACryptex.decrypt_stream)
+    :param kwargs: arguments passed to func
+    :return: the file and True if it has been verified (False if it is not an encrypted file)
+    """
+    if not file.endswith(".pycpx"):
+        return file, False
+    start_time = time.perf_counter()
+    with open(file, 'rb') as reader:
+        if hasattr(os, "posix_fadvise"):
+            # the file is read once from the start to the end, the kernel can read ahead more
+            os.posix_fadvise(reader.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # the time spent reading (and unwrapping the key) is subtracted from the verify phase
+        with metrics.phase("verify") as measure:
+            measure.nbytes = func(metrics.TimedReader(reader) if metrics.enabled else reader, _NullWriter(),
+                                  **kwargs)
+    metrics.file_done(time.perf_counter() - start_time)
+    return file, True
+
+
+def _stream_file(src: str, dst: str, func, phase_name: str, **kwargs):
+    """
+    Call func reading from src and writing into a temporary file renamed to dst once completed: dst is never
+    partially written, even if the process is killed. In case of errors the temporary file is removed.
+    """
+    partial = dst + PARTIAL_SUFFIX
+    with open(src, 'rb') as reader:
+        try:
+            with open(partial, 'wb') as writer:
+                _run(reader, writer, func, phase_name, **kwargs)
+                with metrics.phase("write"):
+                    replace_durably(writer, partial, dst)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+
+def replace_durably(writer, partial: str, dst: str):
+    """
+    Flush the writer of the partial file on disk, close it and rename it to dst, then flush the folder: when it
+    returns dst is complete on disk even after a crash or a power loss, so the source can be removed.
+    """
+    writer.flush()
+    os.fsync(writer.fileno())
+    writer.close()
+    os.replace(partial, dst)
+    fsync_dir(os.path.dirname(dst))
+
+
+def fsync_dir(folder: str):
+    """
+    Flush the entries of the folder (e.g. a file renamed into it) on disk. Windows doesn't open folders, there
+    the rename is flushed by the file system.
+    """
+    if os.name == 'nt':
+        return
+    fd = os.open(folder or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def process_stream(reader, writer, func, phase_name: str, **kwargs) -> int:
+    """
+    Encrypt or decrypt the reader into the writer (e.g. the standard input into the standard output), the
+    streams don't need to be seekable and the memory used doesn't depend on the size of the content.
+
+    :param reader: binary stream to read
+    :param writer: binary stream where to write, flushed at the end
+    :param func: function that encrypts/decrypts a reader into a writer (e.g. RSACryptex.encrypt_stream)
+    :param phase_name: "encrypt" or "decrypt", phase of the metrics
+    :param kwargs: arguments passed to func
+    :return: number of clear bytes processed
+    """
+    start_time = time.perf_counter()
+    size = _run(reader, writer, func, phase_name, **kwargs)
+    writer.flush()
+    metrics.file_done(time.perf_counter() - start_time)
+    return size
+
+
+def _run(reader, writer, func, phase_name: str, **kwargs) -> int:
+    """
+    Call func with reader and writer. With the metrics enabled the time spent by func is split in read,
+    write, the nested phases (e.g. kdf, rsa-unwrap) and phase_name (the crypto work).
+    """
+    if not metrics.enabled:
+        return func(reader, writer, **kwargs)
+    with metrics.phase(phase_name) as measure:
+        measure.nbytes = func(metrics.TimedReader(reader), metrics.TimedWriter(writer), **kwargs) or 0
+    return measure.nbytes
+
+
 def remove_file(file: str):
     """
     Remove the file passed as argument in secure way or normal way depending
@@ -66,6 +174,8 @@ def remove_file(file: str):
         if pycryptex.config_file['config']['secure-deletion']:
             secure_delete(file, pycryptex.config_file['config']['secure-deletion-passes'])
         else:
-            os.remove(file)
+            with metrics.phase("delete"):
+                os.remove(file)
     except KeyError:
-        os.remove(file)
+        with metrics.phase("delete"):
+            os.remove(file)
@@ -0,0 +1,147 @@
+"""
+This module contains the optional compression stage of the .pycpx files: the content is compressed before being
+split into segments and encrypted, the algorithm is saved into the flags of the header (see stream.Header).
+zlib and lzma come with Python, zstd needs the zstandard package.
+
+Data that are already compressed (images, videos, archives...) would only waste CPU, so before compressing a
+file a sample of its first segment is compressed with the fastest zlib level: if it doesn't shrink enough the
+file is encrypted without compression.
+"""
+import io
+import lzma
+import zlib
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_ZSTD = 3
+# names of the algorithms, used by the CLI (--compress) and by the config file (compression)
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB, "lzma": COMPRESSION_LZMA,
+                "zstd": COMPRESSION_ZSTD}
+# bytes of the sample compressed to detect the data that don't compress (zlib is slow on random data)
+SAMPLE_SIZE = 16 * 1024
+# the sample has to be compressed at least to this ratio to compress the file
+MAX_SAMPLE_RATIO = 0.9
+# maximum size of the chunks returned by a decompressor, a small compressed block can expand a lot
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+
+def compression_from_name(name: str) -> int:
+    """
+    Return the compression algorithm with the name passed as argument (see COMPRESSIONS).
+    """
+    compression = COMPRESSIONS.get(name.lower())
+    if compression is None:
+        raise ValueError(f"unknown compression '{name}', use one of: {', '.join(COMPRESSIONS)}")
+    if compression == COMPRESSION_ZSTD:
+        _zstandard()
+    return compression
+
+
+def compression_from_config(config: dict) -> int:
+    """
+    Return the compression algorithm set in the [config] section of the pycryptex.toml file (compression).
+    """
+    return compression_from_name(config.get('compression', 'none'))
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def compressible(sample) -> bool:
+    """
+    Return True if the sample (e.g. the first segment of a file) shrinks enough to be worth compressing.
+    Only its last SAMPLE_SIZE bytes are compressed: the first ones are often metadata that compress even when
+    the content doesn't (e.g. the EXIF data of a JPEG).
+    """
+    sample = memoryview(sample)[-SAMPLE_SIZE:]
+    return len(sample) > 0 and len(zlib.compress(sample, 1)) <= len(sample) * MAX_SAMPLE_RATIO
+
+
+def compressor(compression: int):
+    """
+    Return a new compressor object (with the compress and flush methods) of the algorithm.
+    """
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compressobj(6)
+    if compression == COMPRESSION_LZMA:
+        return lzma.LZMACompressor(preset=6)
+    if compression == COMPRESSION_ZSTD:
+        return _zstandard().ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"unsupported compression {compression}")
+
+
+class Decompressor:
+    """
+    Streaming decompressor of an algorithm, the data are returned in chunks of at most
+    DECOMPRESS_CHUNK_SIZE bytes (zlib and lzma), so the memory used doesn't depend on the compression ratio.
+    """
+
+    def __init__(self, compression: int):
+        self.compression = compression
+        if compression == COMPRESSION_ZLIB:
+            self._decompressor = zlib.decompressobj()
+        elif compression == COMPRESSION_LZMA:
+            self._decompressor = lzma.LZMADecompressor()
+        elif compression == COMPRESSION_ZSTD:
+            self._decompressor = _zstandard().ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError(f"unsupported compression {compression}")
+
+    def decompress(self, data):
+        """
+        Generator that yields the decompressed chunks of data.
+        """
+        if self.compression == COMPRESSION_ZLIB:
+            while data:
+                chunk = self._decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                data = self._decompressor.unconsumed_tail
+        elif self.compression == COMPRESSION_LZMA:
+            chunk = self._decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            while True:
+                if chunk:
+                    yield chunk
+                if self._decompressor.eof or self._decompressor.needs_input:
+                    return
+                chunk = self._decompressor.decompress(b"", DECOMPRESS_CHUNK_SIZE)
+        else:
+            chunk = self._decompressor.decompress(data)
+            if chunk:
+                yield chunk
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Readable binary stream that decompresses the data read from the raw stream (not seekable).
+    """
+
+    def __init__(self, raw, compression: int, read_size: int = 64 * 1024):
+        super().__init__()
+        self.raw = raw
+        self._chunks = self._decompress(Decompressor(compression), read_size)
+        self._chunk = memoryview(b"")
+
+    def _decompress(self, decompressor: Decompressor, read_size: int):
+        for data in iter(lambda: self.raw.read(read_size), b""):
+            yield from decompressor.decompress(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
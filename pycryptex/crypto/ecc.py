@@ -0,0 +1,137 @@
+"""
+This module is useful to encrypt and decrypt using ECC keys (NIST P-256) as a faster alternative to RSA.
+
+The session key of the files is protected with an ephemeral ECDH (ECIES): for every recipient a new ephemeral
+key pair is generated, the shared secret with the public key of the recipient is derived with HKDF-SHA256 into
+a key that encrypts the session key with AES-GCM. The slot saved into the header is made by:
+
+    ephemeral public point (uncompressed, 65 bytes) | encrypted session key (32 bytes) | tag (16 bytes)
+
+The slot is 113 bytes instead of the 256 bytes of a RSA-2048 key, and decrypting it costs a single scalar
+multiplication instead of a RSA private key operation. The segments are encrypted as the RSA files (see stream.py).
+"""
+import os
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC
+from Crypto.Util.number import long_to_bytes, bytes_to_long
+from pycryptex.crypto import stream
+from pycryptex.crypto.rsa import RSACryptex
+
+CURVE = "P-256"
+# size in bytes of the coordinates of a point
+_COORDINATE_SIZE = 32
+_POINT_SIZE = 1 + 2 * _COORDINATE_SIZE
+SLOT_SIZE = _POINT_SIZE + 32 + stream.TAG_SIZE
+# context of the HKDF derivation, it binds the derived key to its use
+_HKDF_CONTEXT = b"pycryptex ecies session key"
+# the key derived is used only once (the ephemeral key is new for every slot), the nonce can be constant
+_NONCE = bytes(12)
+
+
+def _encode_point(point) -> bytes:
+    return b"\x04" + long_to_bytes(int(point.x), _COORDINATE_SIZE) + long_to_bytes(int(point.y), _COORDINATE_SIZE)
+
+
+def _decode_point(data: bytes) -> ECC.EccKey:
+    if len(data) != _POINT_SIZE or data[0] != 4:
+        raise ValueError("invalid ephemeral public key")
+    # construct checks that the point belongs to the curve
+    return ECC.construct(curve=CURVE, point_x=bytes_to_long(data[1:1 + _COORDINATE_SIZE]),
+                         point_y=bytes_to_long(data[1 + _COORDINATE_SIZE:]))
+
+
+def _derive_key(ephemeral_point: bytes, recipient_point: bytes, shared_point) -> bytes:
+    shared_secret = long_to_bytes(int(shared_point.x), _COORDINATE_SIZE)
+    return HKDF(shared_secret, 32, ephemeral_point + recipient_point, SHA256, context=_HKDF_CONTEXT)
+
+
+class ECIES:
+    """
+    Encrypt/decrypt the session keys with an ECC key, with the same interface of a PKCS1_OAEP cipher.
+
+    :param key: ECC public key (to encrypt) or private key (to decrypt and encrypt)
+    """
+
+    def __init__(self, key: ECC.EccKey):
+        if key.curve not in ("NIST P-256", "p256", "P-256", "prime256v1", "secp256r1"):
+            raise ValueError(f"unsupported curve {key.curve}, the ECC keys must be {CURVE}")
+        self.key = key
+        self._point = _encode_point(key.pointQ)
+
+    @classmethod
+    def new(cls, key: ECC.EccKey):
+        return cls(key)
+
+    def encrypt(self, session_key: bytes) -> bytes:
+        """
+        Return the slot with the session key encrypted for the key.
+        """
+        ephemeral = ECC.generate(curve=CURVE)
+        ephemeral_point = _encode_point(ephemeral.pointQ)
+        key = _derive_key(ephemeral_point, self._point, self.key.pointQ * ephemeral.d)
+        ciphertext, tag = AES.new(key, AES.MODE_GCM, nonce=_NONCE).encrypt_and_digest(session_key)
+        return ephemeral_point + ciphertext + tag
+
+    def decrypt(self, slot: bytes) -> bytes:
+        """
+        Return the session key of a slot, ValueError if the slot has not been encrypted for the key.
+        """
+        if not self.key.has_private():
+            raise ValueError("a private key is needed to decrypt")
+        slot = bytes(slot)
+        if len(slot) != SLOT_SIZE:
+            raise ValueError("invalid size of the encrypted session key")
+        ephemeral_point = slot[:_POINT_SIZE]
+        key = _derive_key(ephemeral_point, self._point, _decode_point(ephemeral_point).pointQ * self.key.d)
+        return AES.new(key, AES.MODE_GCM, nonce=_NONCE).decrypt_and_verify(slot[_POINT_SIZE:-stream.TAG_SIZE],
+                                                                          slot[-stream.TAG_SIZE:])
+
+
+class ECCCryptex(RSACryptex):
+    """
+    Crypto object of the ECC keys, the files are encrypted and decrypted as with RSACryptex (same chunked format,
+    cache of the session keys, agent...), only the session keys are protected with ECIES.
+    """
+    KIND = stream.KIND_ECC
+    KEY_TYPE = "ecc"
+    SESSION_KEY_CIPHER = ECIES
+
+    def _wrap_session_key(self, public_key: str, session_key: bytes) -> bytes:
+        return ECIES.new(ECC.import_key(open(public_key).read())).encrypt(session_key)
+
+    def _private_key_size(self, private_key: str, passprhase=None) -> int:
+        # all the slots have the same size, the key is not loaded to know it
+        return SLOT_SIZE
+
+    def _load_private_key(self, private_key: str, passprhase=None):
+        if self.recipient_key is None:
+            self.use_private_key(ECC.import_key(open(private_key).read(), passphrase=passprhase))
+
+    def decrypt_data(self, enc_data: bytes, private_key: str, passprhase=None) -> bytes:
+        """
+        Decrypt data in memory (see decrypt_stream), the ECC keys exist only with the chunked format.
+        """
+        if not stream.is_stream(enc_data):
+            raise ValueError("the data have not been encrypted with an ECC key")
+        return super().decrypt_data(enc_data, private_key, passprhase)
+
+    @classmethod
+    def create_keys(cls, folder: str, passprhase=None):
+        """
+        Create a P-256 public key and private key pair
+        :param folder: directory where to create the pycryptex_key and pycryptex_key.pub files
+        :return: None
+        """
+        key = ECC.generate(curve=CURVE)
+        if passprhase:
+            private_key = key.export_key(format="PEM", passphrase=passprhase, use_pkcs8=True,
+                                         protection="scryptAndAES128-CBC")
+        else:
+            private_key = key.export_key(format="PEM")
+
+        with open(os.path.join(folder, "pycryptex_key"), "w") as file_out:
+            file_out.write(private_key)
+        with open(os.path.join(folder, "pycryptex_key.pub"), "w") as file_out:
+            file_out.write(key.public_key().export_key(format="PEM"))
@@ -0,0 +1,147 @@
+"""
+This module contains the public stream API of pycryptex: file objects that encrypt the data written into
+any binary stream (file, socket, S3 body, gzip stream...) or decrypt the data read from it, segment by
+segment and without keeping the whole content in memory. The encrypted streams are .pycpx files, so they
+can be decrypted with the CLI (and the files encrypted by the CLI can be read).
+
+    with open("report.pdf.pycpx", "wb") as f, EncryptingWriter(f, password="secret") as enc:
+        enc.write(data)
+
+    with open("report.pdf.pycpx", "rb") as f, DecryptingReader(f, password="secret") as dec:
+        data = dec.read()
+"""
+import io
+from pycryptex.crypto import keys, stream
+from pycryptex.crypto.compression import COMPRESSION_NONE, compression_from_name
+from pycryptex.crypto.aes import AESCryptex
+
+
+def _engine(cryptex, password, key, key_name: str, suite: int = stream.DEFAULT_SUITE,
+            compression: int = COMPRESSION_NONE, passphrase: str = None):
+    if (password is None) == (key is None):
+        raise ValueError(f"specify one of password or {key_name}")
+    if cryptex is None:
+        if password is not None:
+            cryptex = AESCryptex(suite=suite, compression=compression)
+        elif key_name == "public_key":
+            # RSACryptex or ECCCryptex by the type of the keys
+            cryptex = keys.new_cryptex(keys.public_keys_type([key] if isinstance(key, str) else key), suite=suite,
+                                       compression=compression)
+        else:
+            cryptex = keys.private_key_cryptex(key, passphrase)
+    return cryptex
+
+
+class EncryptingWriter(io.BufferedIOBase):
+    """
+    Writable binary stream that encrypts the data written into raw, with a password (AES) or a RSA/ECC
+    public key. The encryption is completed by close, raw is closed only with close_raw.
+
+    :param raw: binary stream where to write the encrypted data
+    :param password: password to encrypt
+    :param public_key: path of the RSA or ECC public key to encrypt
+    :param cryptex: (optional) AESCryptex, RSACryptex or ECCCryptex to use, reusing it the key is derived (or the
+                    session key encrypted) only once for all the streams
+    :param close_raw: bool to specify if close raw closing the stream
+    :param cipher: (optional) AEAD cipher, one of stream.SUITES names (used only if cryptex is not passed)
+    :param compression: (optional) compression of the data before encryption, one of compression.COMPRESSIONS
+                        names (used only if cryptex is not passed)
+    """
+
+    def __init__(self, raw, password: str = None, public_key: str = None, cryptex=None, close_raw: bool = False,
+                 cipher: str = "eax", compression: str = "none"):
+        super().__init__()
+        self.raw = raw
+        self.close_raw = close_raw
+        self.cryptex = _engine(cryptex, password, public_key, "public_key", stream.suite_from_name(cipher),
+                               compression_from_name(compression))
+        if password is not None:
+            self._writer = self.cryptex.create_stream(raw, pwd=password)
+        else:
+            self._writer = self.cryptex.create_stream(raw, public_key=public_key)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to a closed file")
+        return self._writer.write(data)
+
+    def flush(self):
+        # only the full segments can be written, the last one is written by close
+        if not self.closed:
+            self.raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._writer.close()
+            self.raw.flush()
+        finally:
+            super().close()
+            if self.close_raw:
+                self.raw.close()
+
+
+class DecryptingReader(io.BufferedIOBase):
+    """
+    Readable binary stream that decrypts the data read from raw, with a password (AES) or a RSA/ECC private key.
+    Every segment is authenticated before being returned: ValueError is raised reading data that are not
+    authentic or truncated. When raw is seekable the reader is seekable too (unless the content is compressed),
+    and only the segments covering the bytes read are decrypted. Files created with older versions of pycryptex are
+    decrypted in memory.
+
+    :param raw: binary stream with the encrypted data (read from the current position)
+    :param password: password to decrypt
+    :param private_key: path of the RSA or ECC private key to decrypt
+    :param passphrase: (optional) passphrase of the private key
+    :param cryptex: (optional) AESCryptex, RSACryptex or ECCCryptex to use, reusing it the decrypted keys are cached
+    :param close_raw: bool to specify if close raw closing the stream
+    """
+
+    def __init__(self, raw, password: str = None, private_key: str = None, passphrase: str = None, cryptex=None,
+                 close_raw: bool = False):
+        super().__init__()
+        self.raw = raw
+        self.close_raw = close_raw
+        self.cryptex = _engine(cryptex, password, private_key, "private_key", passphrase=passphrase)
+        if password is not None:
+            self.header, self._reader = self.cryptex.open_stream(raw, pwd=password)
+        else:
+            self.header, self._reader = self.cryptex.open_stream(raw, private_key=private_key, passprhase=passphrase)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._reader.seekable()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._reader.read(size)
+
+    def read1(self, size: int = -1) -> bytes:
+        return self._reader.read1(size)
+
+    def readinto(self, buffer) -> int:
+        return self._reader.readinto(buffer)
+
+    def readinto1(self, buffer) -> int:
+        return self._reader.readinto1(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._reader.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._reader.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._reader.close()
+        finally:
+            super().close()
+            if self.close_raw:
+                self.raw.close()
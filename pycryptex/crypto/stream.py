@@ -0,0 +1,697 @@
+"""
+This module contains the chunked (streaming) .pycpx file format.
+
+A file is made by a header followed by a list of fixed size segments:
+
+    magic "PYCPX" | version | kind | suite | flags | segment size | salt | slots count
+    slot length | slot bytes  (repeated slots count times, e.g. the RSA wrapped session key of every
+                               recipient or the AES salt)
+    segment 0:  ciphertext (segment size bytes) | tag
+    ...
+    segment N:  ciphertext (<= segment size bytes) | tag
+
+Every segment is encrypted on its own with a nonce made by the segment index and a flag that marks
+the last segment, using a key derived from the file key and the salt of the header. In this way
+segments can't be reordered, dropped or truncated without failing the tag check, and the header
+is authenticated as associated data of every segment.
+Encryption and decryption read and write one segment at time, the memory used doesn't depend on
+the size of the file. The sequential functions (encrypt, decrypt, SegmentWriter) don't copy the data
+more than needed: big regular files are memory mapped, the other streams are read into preallocated
+buffers, and the segments are encrypted/decrypted directly into a reused output buffer.
+With the compression flags set (see compression.py) the segments contain the compressed content.
+"""
+import io
+import mmap
+import os
+import stat
+import struct
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Random import get_random_bytes
+from pycryptex.crypto.compression import COMPRESSION_NONE, COMPRESSIONS, Decompressor, DecompressingReader, \
+    compressible, compressor
+from pycryptex.internal import metrics
+
+MAGIC = b"PYCPX"
+VERSION = 1
+# kind of key used to protect the file key
+KIND_RSA = 1
+KIND_AES = 2
+KIND_ECC = 3
+# AEAD cipher used for the segments
+SUITE_EAX = 1
+SUITE_GCM = 2
+SUITE_CHACHA20_POLY1305 = 3
+# names of the suites, used by the CLI (--cipher) and by the config file (cipher)
+SUITES = {"eax": SUITE_EAX, "gcm": SUITE_GCM, "chacha20-poly1305": SUITE_CHACHA20_POLY1305}
+DEFAULT_SUITE = SUITE_EAX
+# flags: the content is a tar archive of a folder
+FLAG_ARCHIVE = 0x01
+# flags: bits of the compression algorithm of the content (see compression.COMPRESSIONS)
+FLAG_COMPRESSION_MASK = 0x0E
+_COMPRESSION_SHIFT = 1
+TAG_SIZE = 16
+SALT_SIZE = 16
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+MAX_SEGMENTS = 2 ** 32
+# the slots count is saved in a byte
+MAX_SLOTS = 255
+# files shorter than this are read, mapping them in memory costs more than copying them
+MMAP_MIN_SIZE = 1024 * 1024
+# bytes of a file mapped in memory at time
+MMAP_WINDOW_SIZE = 16 * 1024 * 1024
+
+# magic, version, kind, suite, flags, segment size, salt, slots count
+_FIXED_HEADER = struct.Struct(">5sBBBBI16sB")
+_SLOT_LENGTH = struct.Struct(">H")
+# 7 bytes of zeros, segment index, last segment flag
+_NONCE = struct.Struct(">7xIB")
+
+
+class Header:
+    """
+    Header of a chunked .pycpx file.
+    """
+
+    def __init__(self, kind: int, slots: list, suite: int = DEFAULT_SUITE, flags: int = 0,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE, salt: bytes = None):
+        self.kind = kind
+        self.slots = slots
+        self.suite = suite
+        self.flags = flags
+        self.segment_size = segment_size
+        self.salt = salt if salt is not None else get_random_bytes(SALT_SIZE)
+        # packed bytes of the header, used as associated data of the segments
+        self.raw: bytes = None
+
+    @property
+    def compression(self) -> int:
+        """
+        Compression algorithm of the content (see compression.COMPRESSIONS).
+        """
+        return (self.flags & FLAG_COMPRESSION_MASK) >> _COMPRESSION_SHIFT
+
+    @compression.setter
+    def compression(self, value: int):
+        self.flags = (self.flags & ~FLAG_COMPRESSION_MASK) | (value << _COMPRESSION_SHIFT)
+        self.raw = None
+
+    def pack(self) -> bytes:
+        """
+        Return the header as bytes ready to be written on disk.
+        """
+        if self.raw is None:
+            parts = [_FIXED_HEADER.pack(MAGIC, VERSION, self.kind, self.suite, self.flags, self.segment_size,
+                                        self.salt, len(self.slots))]
+            for slot in self.slots:
+                parts.append(_SLOT_LENGTH.pack(len(slot)))
+                parts.append(bytes(slot))
+            self.raw = b"".join(parts)
+        return self.raw
+
+    def __len__(self):
+        return len(self.pack())
+
+
+def is_stream(data: bytes) -> bool:
+    """
+    Return True if the bytes passed as argument start with the chunked format magic.
+    """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def read_exact(reader, size: int) -> bytes:
+    """
+    Read from reader until size bytes are read or the end of the stream is reached.
+    """
+    parts = []
+    while size > 0:
+        data = reader.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+def readinto_exact(reader, buffer) -> int:
+    """
+    Read from reader into buffer until it is full or the end of the stream is reached.
+
+    :return: number of bytes read
+    """
+    view = memoryview(buffer)
+    readinto = getattr(reader, "readinto", None)
+    total = 0
+    while total < len(view):
+        if readinto is not None:
+            count = readinto(view[total:])
+        else:
+            data = reader.read(len(view) - total)
+            count = len(data)
+            view[total:total + count] = data
+        if not count:
+            break
+        total += count
+    return total
+
+
+def read_header(reader) -> (Header, bytes):
+    """
+    Read the header from the reader.
+
+    :param reader: binary stream positioned at the beginning of the file
+    :return: the header and the bytes read. The header is None if the file is not in the chunked
+             format (a file created with an older version of pycryptex), in this case the bytes read
+             have to be considered part of the file content
+    """
+    head = read_exact(reader, _FIXED_HEADER.size)
+    if not is_stream(head):
+        return None, head
+    if len(head) < _FIXED_HEADER.size:
+        raise ValueError("the file header is truncated")
+    _, version, kind, suite, flags, segment_size, salt, count = _FIXED_HEADER.unpack(head)
+    if version != VERSION:
+        raise ValueError(f"unsupported file format version {version}")
+    if segment_size == 0:
+        raise ValueError("invalid segment size in the file header")
+    if suite not in SUITES.values():
+        raise ValueError(f"unsupported cipher suite {suite}, the file has been created by a newer pycryptex")
+    if (flags & FLAG_COMPRESSION_MASK) >> _COMPRESSION_SHIFT not in COMPRESSIONS.values():
+        raise ValueError("unsupported compression, the file has been created by a newer pycryptex")
+    parts = [head]
+    slots = []
+    for _ in range(count):
+        raw_length = read_exact(reader, _SLOT_LENGTH.size)
+        if len(raw_length) < _SLOT_LENGTH.size:
+            raise ValueError("the file header is truncated")
+        length, = _SLOT_LENGTH.unpack(raw_length)
+        slot = read_exact(reader, length)
+        if len(slot) < length:
+            raise ValueError("the file header is truncated")
+        parts.append(raw_length)
+        parts.append(slot)
+        slots.append(slot)
+    header = Header(kind, slots, suite=suite, flags=flags, segment_size=segment_size, salt=salt)
+    header.raw = b"".join(parts)
+    return header, header.raw
+
+
+def _mapped_range(reader) -> (int, int, int):
+    """
+    Return (file descriptor, start, end) of the content of reader from its position to the end if it can be
+    mapped in memory, None if reader is not a big enough regular file.
+    """
+    # the file under the wrapper of --stats is mapped as without it, the stats measure the same code path
+    if isinstance(reader, metrics.TimedReader):
+        reader = reader.raw
+    if not isinstance(reader, (io.BufferedReader, io.FileIO)):
+        return None
+    try:
+        fd = reader.fileno()
+        file_stat = os.fstat(fd)
+        position = reader.tell()
+    except (OSError, ValueError):
+        return None
+    if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size - position < max(MMAP_MIN_SIZE, 1):
+        return None
+    return fd, position, file_stat.st_size
+
+
+def _iter_mapped(fd: int, start: int, end: int, size: int, phase_name: str = "read"):
+    """
+    Generator that yields (chunk, last) mapping the file in memory a window at time, so the memory used
+    doesn't depend on the file size. A window is unmapped together with the last view on it. Mapping the
+    windows is measured into the phase phase_name (the pages are then read by the code that uses the chunks).
+    """
+    window = max(1, MMAP_WINDOW_SIZE // size) * size
+    while start < end:
+        length = min(window, end - start)
+        # the offset of the map has to be a multiple of the allocation granularity
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        with metrics.phase(phase_name, length):
+            mapped = mmap.mmap(fd, start - offset + length, access=mmap.ACCESS_READ, offset=offset)
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)[start - offset:]
+        for position in range(0, length, size):
+            yield view[position:position + size], start + position + size >= end
+        start += length
+
+
+def iter_blocks(reader, size: int):
+    """
+    Generator that yields (chunk, last) as read_segments, but without allocating a new buffer for every
+    chunk: the chunks are views of the file mapped in memory (big regular files) or of two buffers used
+    in turn, so every chunk is valid only until the next one is requested.
+    """
+    mapped_range = _mapped_range(reader)
+    if mapped_range is not None:
+        yield from _iter_mapped(*mapped_range, size,
+                                reader.name if isinstance(reader, metrics.TimedReader) else "read")
+        # the reader is moved to the end, as if the content had been read
+        reader.seek(0, io.SEEK_END)
+        return
+    chunk = read_exact(reader, size)
+    if len(chunk) < size:
+        # small content, read in a single chunk without allocating the buffers
+        yield chunk, True
+        return
+    buffers = [memoryview(bytearray(size)), memoryview(bytearray(size))]
+    count = readinto_exact(reader, buffers[0])
+    yield chunk, count == 0
+    while count:
+        # a short chunk is always the last one, a full chunk is the last if nothing follows
+        next_count = readinto_exact(reader, buffers[1]) if count == size else 0
+        last = next_count == 0
+        yield buffers[0][:count], last
+        if last:
+            return
+        buffers.reverse()
+        count = next_count
+
+
+def segment_key(file_key: bytes, header: Header) -> bytes:
+    """
+    Derive the key used to encrypt the segments of a single file.
+    """
+    return HKDF(file_key, 32, header.salt, SHA256, context=b"pycryptex segment key")
+
+
+def suite_from_name(name: str) -> int:
+    """
+    Return the cipher suite with the name passed as argument (see SUITES).
+    """
+    suite = SUITES.get(name.lower())
+    if suite is None:
+        raise ValueError(f"unknown cipher '{name}', use one of: {', '.join(SUITES)}")
+    return suite
+
+
+def suite_from_config(config: dict) -> int:
+    """
+    Return the cipher suite set in the [config] section of the pycryptex.toml file (cipher, default "eax").
+    """
+    return suite_from_name(config.get('cipher', 'eax'))
+
+
+def _new_cipher(key: bytes, header: Header, index: int, last: bool):
+    if index >= MAX_SEGMENTS:
+        raise ValueError("the file is too large for the segment size in use")
+    # all the suites use a 96 bits nonce and a 128 bits tag
+    nonce = _NONCE.pack(index, last)
+    if header.suite == SUITE_EAX:
+        cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
+    elif header.suite == SUITE_GCM:
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    elif header.suite == SUITE_CHACHA20_POLY1305:
+        cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    else:
+        raise ValueError(f"unsupported cipher suite {header.suite}")
+    cipher.update(header.pack())
+    return cipher
+
+
+def seal_segment(key: bytes, header: Header, index: int, data: bytes, last: bool) -> (bytes, bytes):
+    """
+    Encrypt a single segment.
+
+    :param key: segment key (see segment_key)
+    :param header: header of the file
+    :param index: position of the segment in the file
+    :param data: clear bytes of the segment
+    :param last: True if it is the last segment of the file
+    :return: encrypted bytes and tag
+    """
+    return _new_cipher(key, header, index, last).encrypt_and_digest(data)
+
+
+def open_segment(key: bytes, header: Header, index: int, data: bytes, tag: bytes, last: bool) -> bytes:
+    """
+    Decrypt and verify a single segment, raise ValueError if the segment is not authentic.
+    """
+    return _new_cipher(key, header, index, last).decrypt_and_verify(data, tag)
+
+
+def seal_into(key: bytes, header: Header, index: int, data, last: bool, output) -> int:
+    """
+    Encrypt a single segment as stored into the file (encrypted bytes followed by the tag) into output,
+    without allocating new buffers (see seal_segment).
+
+    :param output: writable buffer of at least len(data) + TAG_SIZE bytes
+    :return: number of bytes written into output
+    """
+    size = len(data)
+    output = memoryview(output)
+    cipher = _new_cipher(key, header, index, last)
+    cipher.encrypt(data, output=output[:size])
+    output[size:size + TAG_SIZE] = cipher.digest()
+    return size + TAG_SIZE
+
+
+def open_into(key: bytes, header: Header, index: int, block, last: bool, output) -> int:
+    """
+    Decrypt and verify a segment as stored into the file into output, raise ValueError if the segment is
+    not authentic (see open_block).
+
+    :param output: writable buffer of at least len(block) - TAG_SIZE bytes
+    :return: number of bytes written into output
+    """
+    if len(block) < TAG_SIZE:
+        raise ValueError("the encrypted file is truncated")
+    block = memoryview(block)
+    size = len(block) - TAG_SIZE
+    cipher = _new_cipher(key, header, index, last)
+    cipher.decrypt(block[:size], output=memoryview(output)[:size])
+    cipher.verify(block[size:])
+    return size
+
+
+def read_segments(reader, size: int):
+    """
+    Generator that yields (chunk, last) reading the reader in chunks of size bytes, last is True for the
+    last chunk (it can be shorter, or empty if the reader is empty).
+    """
+    chunk = read_exact(reader, size)
+    while True:
+        # a short chunk is always the last one, a full chunk is the last if nothing follows
+        next_chunk = read_exact(reader, size) if len(chunk) == size else b""
+        last = len(next_chunk) == 0
+        yield chunk, last
+        if last:
+            return
+        chunk = next_chunk
+
+
+class _Prefixed(io.RawIOBase):
+    """
+    Readable binary stream returning the bytes of prefix and then the content of raw.
+    """
+
+    def __init__(self, prefix: bytes, raw):
+        super().__init__()
+        self._prefix = memoryview(prefix)
+        self.raw = raw
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._prefix:
+            return readinto_exact(self.raw, buffer)
+        size = min(len(buffer), len(self._prefix))
+        buffer[:size] = self._prefix[:size]
+        self._prefix = self._prefix[size:]
+        return size
+
+
+class CompressedBlocks:
+    """
+    Iterable of (chunk, last) as read_segments, with the compressed content of the reader split into chunks
+    of size bytes. clear_size is the number of clear bytes read.
+    """
+
+    def __init__(self, reader, compression: int, size: int, read_size: int = 1024 * 1024):
+        self.reader = reader
+        self.compression = compression
+        self.size = size
+        self.read_size = read_size
+        self.clear_size = 0
+
+    def __iter__(self):
+        engine = compressor(self.compression)
+        pending = bytearray()
+        while True:
+            data = self.reader.read(self.read_size)
+            self.clear_size += len(data)
+            pending += engine.compress(data) if data else engine.flush()
+            # a full chunk is kept until more data arrive, only then it's sure it isn't the last one
+            while len(pending) > self.size:
+                yield bytes(pending[:self.size]), False
+                del pending[:self.size]
+            if not data:
+                yield bytes(pending), True
+                return
+
+
+def compressed_blocks(header: Header, reader, compression: int) -> (CompressedBlocks, object):
+    """
+    Sample the first segment of the reader and, if it is compressible, set the compression of the header.
+
+    :return: the CompressedBlocks of the content (None if compression is COMPRESSION_NONE or the sample doesn't
+             compress) and the reader to use to read the content without compression (the sample is put back)
+    """
+    if not compression:
+        return None, reader
+    sample = read_exact(reader, header.segment_size)
+    if compressible(sample):
+        header.compression = compression
+        return CompressedBlocks(_Prefixed(sample, reader), compression, header.segment_size), None
+    # the readers made only by read() (e.g. sockets, HTTP bodies) are not seekable
+    if getattr(reader, "seekable", lambda: False)():
+        reader.seek(-len(sample), io.SEEK_CUR)
+        return None, reader
+    return None, _Prefixed(sample, reader)
+
+
+def encrypt(file_key: bytes, header: Header, reader, writer, compression: int = COMPRESSION_NONE) -> int:
+    """
+    Write the header and then the encrypted segments of the reader content into the writer.
+
+    :param file_key: key used to derive the segment key
+    :param header: header of the file
+    :param reader: binary stream with the clear data
+    :param writer: binary stream where to write
+    :param compression: compression algorithm, the content is compressed only if a sample of it compresses
+                        (see compressed_blocks)
+    :return: number of clear bytes encrypted
+    """
+    blocks, reader = compressed_blocks(header, reader, compression)
+    key = segment_key(file_key, header)
+    writer.write(header.pack())
+    output = None
+    total = 0
+    for index, (chunk, last) in enumerate(blocks if blocks is not None else iter_blocks(reader, header.segment_size)):
+        if output is None:
+            # the first chunk is the longest one
+            output = memoryview(bytearray(len(chunk) + TAG_SIZE))
+        writer.write(output[:seal_into(key, header, index, chunk, last, output)])
+        total += len(chunk)
+    return blocks.clear_size if blocks is not None else total
+
+
+def iter_decrypt(file_key: bytes, header: Header, reader):
+    """
+    Generator that yields the decrypted segments read from the reader. The reader has to be positioned
+    right after the header.
+    Raise ValueError if a segment is not authentic or the file is truncated.
+    """
+    key = segment_key(file_key, header)
+    decompressor = Decompressor(header.compression) if header.compression else None
+    for index, (block, last) in enumerate(read_segments(reader, header.segment_size + TAG_SIZE)):
+        if decompressor is None:
+            yield open_block(key, header, index, block, last)
+        else:
+            yield from decompressor.decompress(open_block(key, header, index, block, last))
+
+
+def open_block(key: bytes, header: Header, index: int, block: bytes, last: bool) -> bytes:
+    """
+    Decrypt and verify a segment as stored into the file (encrypted bytes followed by the tag).
+    """
+    if len(block) < TAG_SIZE:
+        raise ValueError("the encrypted file is truncated")
+    block = memoryview(block)
+    return open_segment(key, header, index, block[:-TAG_SIZE], block[-TAG_SIZE:], last)
+
+
+def decrypt(file_key: bytes, header: Header, reader, writer) -> int:
+    """
+    Decrypt the segments read from the reader (positioned right after the header) into the writer.
+
+    :return: number of clear bytes written
+    """
+    key = segment_key(file_key, header)
+    decompressor = Decompressor(header.compression) if header.compression else None
+    output = None
+    total = 0
+    for index, (block, last) in enumerate(iter_blocks(reader, header.segment_size + TAG_SIZE)):
+        if output is None:
+            # the first block is the longest one
+            output = memoryview(bytearray(max(len(block) - TAG_SIZE, 0)))
+        size = open_into(key, header, index, block, last, output)
+        if decompressor is None:
+            writer.write(output[:size])
+            total += size
+            continue
+        for chunk in decompressor.decompress(output[:size]):
+            writer.write(chunk)
+            total += len(chunk)
+    return total
+
+
+def open_reader(file_key: bytes, header: Header, raw) -> io.RawIOBase:
+    """
+    Return a readable binary stream with the clear content of raw (positioned right after the header):
+    a SegmentReader, wrapped by a decompressing reader (not seekable) if the content is compressed.
+    """
+    reader = SegmentReader(file_key, header, raw)
+    if header.compression:
+        return DecompressingReader(reader, header.compression, header.segment_size)
+    return reader
+
+
+class SegmentWriter(io.RawIOBase):
+    """
+    Writable binary stream that encrypts the data written into the raw stream. The data are collected
+    until a segment is full, the last segment is written by close (the raw stream is not closed).
+    If the header has a compression algorithm the data are compressed before (without sampling them).
+    """
+
+    def __init__(self, file_key: bytes, header: Header, raw):
+        super().__init__()
+        self.raw = raw
+        self.header = header
+        self._key = segment_key(file_key, header)
+        self._buffer = bytearray()
+        self._output = memoryview(bytearray(header.segment_size + TAG_SIZE))
+        self._index = 0
+        self._compressor = compressor(header.compression) if header.compression else None
+        raw.write(header.pack())
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to a closed file")
+        if self._compressor is None:
+            self._write(memoryview(data).cast("B"))
+        else:
+            self._write(memoryview(self._compressor.compress(data)))
+        return memoryview(data).nbytes
+
+    def _write(self, view: memoryview):
+        size = self.header.segment_size
+        while view:
+            # a full segment is kept until more data arrive, only then it's sure it isn't the last one
+            if len(self._buffer) == size:
+                self._seal(self._buffer, False)
+                self._buffer.clear()
+            if not self._buffer and len(view) > size:
+                # the full segments of data are encrypted without copying them into the buffer
+                self._seal(view[:size], False)
+                view = view[size:]
+                continue
+            count = min(size - len(self._buffer), len(view))
+            self._buffer += view[:count]
+            view = view[count:]
+
+    def _seal(self, data, last: bool):
+        self.raw.write(self._output[:seal_into(self._key, self.header, self._index, data, last, self._output)])
+        self._index += 1
+
+    def close(self):
+        if not self.closed:
+            if self._compressor is not None:
+                self._write(memoryview(self._compressor.flush()))
+            self._seal(self._buffer, True)
+            self._buffer = bytearray()
+        super().close()
+
+
+class SegmentReader(io.RawIOBase):
+    """
+    Readable binary stream that decrypts the segments read from the raw stream (positioned right after
+    the header). Raise ValueError reading a segment that is not authentic.
+    When the raw stream is seekable the reader is seekable too: the segments have a fixed size, so only
+    the segments covering the bytes read are read, authenticated and decrypted.
+    """
+
+    def __init__(self, file_key: bytes, header: Header, raw):
+        super().__init__()
+        self.header = header
+        self.raw = raw
+        self._key = segment_key(file_key, header)
+        self._seekable = getattr(raw, "seekable", lambda: False)()
+        # position of the first segment into the raw stream and number of segments (only if seekable)
+        self._start = raw.tell() if self._seekable else 0
+        self._count = None
+        # segments read sequentially, used when the raw stream is not seekable
+        self._segments = None if self._seekable else enumerate(read_segments(raw, header.segment_size + TAG_SIZE))
+        # last segment decrypted
+        self._index = -1
+        self._segment = b""
+        # position into the clear content
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._seekable
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if not self._seekable:
+            raise io.UnsupportedOperation("the encrypted stream is not seekable")
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def size(self) -> int:
+        """
+        Return the size of the clear content (only if the raw stream is seekable).
+        """
+        self._count_segments()
+        end = self.raw.seek(0, io.SEEK_END)
+        return end - self._start - self._count * TAG_SIZE
+
+    def _count_segments(self):
+        if self._count is None:
+            enc_size = self.raw.seek(0, io.SEEK_END) - self._start
+            block_size = self.header.segment_size + TAG_SIZE
+            self._count = max(1, -(-enc_size // block_size))
+
+    def _load(self, index: int) -> bool:
+        """
+        Decrypt the segment index, return False if the segment doesn't exist.
+        """
+        if index == self._index:
+            return True
+        block_size = self.header.segment_size + TAG_SIZE
+        if self._seekable:
+            self._count_segments()
+            if index >= self._count:
+                return False
+            self.raw.seek(self._start + index * block_size)
+            block = read_exact(self.raw, block_size)
+            self._segment = open_block(self._key, self.header, index, block, index == self._count - 1)
+        else:
+            if index < self._index:
+                raise io.UnsupportedOperation("the encrypted stream is not seekable")
+            while self._index < index:
+                item = next(self._segments, None)
+                if item is None:
+                    return False
+                self._index, (block, last) = item
+                self._segment = open_block(self._key, self.header, self._index, block, last)
+        self._index = index
+        return True
+
+    def readinto(self, buffer) -> int:
+        index, offset = divmod(self._position, self.header.segment_size)
+        if not self._load(index) or offset >= len(self._segment):
+            return 0
+        size = min(len(buffer), len(self._segment) - offset)
+        buffer[:size] = self._segment[offset:offset + size]
+        self._position += size
+        return size
@@ -0,0 +1,274 @@
+"""
+This module contains the pycryptex agent, a process that keeps in memory the unlocked private keys and the
+AES password (with the derived keys) for a limited time, as ssh-agent does.
+
+The agent listens on a Unix socket readable only by the user. The commands send a request for every
+operation as a JSON line and receive a JSON line as a response:
+- status: list of the keys loaded and if the password is present
+- add-key / add-password: unlock a private key or save the AES password
+- unwrap: decrypt a RSA/ECC encrypted session key with a private key loaded into the agent
+- derive: derive the AES key for a salt and a key derivation function using the password saved into the agent
+- lock: forget all the keys and the password
+- stop: stop the agent
+"""
+import base64
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from pycryptex.internal import utils
+
+ENV_SOCKET = "PYCRYPTEX_AGENT_SOCK"
+DEFAULT_TTL = 3600
+MAX_DERIVED_KEYS = 1024
+
+
+def socket_path() -> str:
+    """
+    Return the path of the agent socket: $PYCRYPTEX_AGENT_SOCK or $HOME/.pycryptex/agent.sock.
+    """
+    return os.environ.get(ENV_SOCKET) or os.path.join(utils.get_home(), '.pycryptex', 'agent.sock')
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _decode(data: str) -> bytes:
+    return base64.b64decode(data.encode("ascii"))
+
+
+class Agent:
+    """
+    Secrets held by the agent. Every secret expires ttl seconds after it has been added.
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key path -> (key mtime, cipher (PKCS1_OAEP or ECIES), size of the session keys, key type, expiry)
+        self.keys = {}
+        # (password, expiry)
+        self.password = None
+        # (salt, key derivation parameters) -> derived key
+        self.derived_keys = {}
+        self.stopped = threading.Event()
+        threading.Thread(target=self._purge_loop, daemon=True).start()
+
+    def _purge_loop(self):
+        while not self.stopped.wait(min(self.ttl, 30)):
+            self.purge()
+
+    def purge(self):
+        """
+        Remove the expired secrets.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for path in [p for p, (_, _, _, _, expiry) in self.keys.items() if expiry <= now]:
+                del self.keys[path]
+            if self.password is not None and self.password[1] <= now:
+                self.password = None
+                self.derived_keys.clear()
+
+    def dispatch(self, request: dict) -> dict:
+        method = getattr(self, "op_" + str(request.get("op", "")).replace("-", "_"), None)
+        if method is None:
+            return {"ok": False, "error": f"unknown operation {request.get('op')}"}
+        self.purge()
+        return method(request)
+
+    def op_status(self, request: dict) -> dict:
+        with self.lock:
+            return {"ok": True, "keys": {path: size for path, (_, _, size, _, _) in self.keys.items()},
+                    "types": {path: key_type for path, (_, _, _, key_type, _) in self.keys.items()},
+                    "password": self.password is not None, "ttl": self.ttl}
+
+    def op_add_key(self, request: dict) -> dict:
+        from Crypto.PublicKey import RSA
+        from Crypto.Cipher import PKCS1_OAEP
+        from pycryptex.crypto import ecc, keys
+        path = os.path.realpath(request["key"])
+        key = keys.import_key_file(path, passphrase=request.get("passphrase"))
+        if isinstance(key, RSA.RsaKey):
+            entry = (PKCS1_OAEP.new(key), key.size_in_bytes(), "rsa")
+        else:
+            entry = (ecc.ECIES.new(key), ecc.SLOT_SIZE, "ecc")
+        with self.lock:
+            self.keys[path] = (os.stat(path).st_mtime_ns, *entry, time.monotonic() + self.ttl)
+        return {"ok": True}
+
+    def op_unwrap(self, request: dict) -> dict:
+        path = os.path.realpath(request["key"])
+        with self.lock:
+            entry = self.keys.get(path)
+            # a key changed on disk is not valid anymore
+            if entry is not None and entry[0] != os.stat(path).st_mtime_ns:
+                del self.keys[path]
+                entry = None
+            if entry is None:
+                return {"ok": False, "error": f"the key {path} is not loaded into the agent"}
+            return {"ok": True, "data": _encode(entry[1].decrypt(_decode(request["data"])))}
+
+    def op_add_password(self, request: dict) -> dict:
+        with self.lock:
+            self.password = (request["password"], time.monotonic() + self.ttl)
+            self.derived_keys.clear()
+        return {"ok": True}
+
+    def op_derive(self, request: dict) -> dict:
+        from pycryptex.crypto.aes import derive_key
+        salt = _decode(request["salt"])
+        kdf = _decode(request["kdf"])
+        with self.lock:
+            if self.password is None:
+                return {"ok": False, "error": "the password is not saved into the agent"}
+            key = self.derived_keys.get((salt, kdf))
+            password = self.password[0]
+        if key is None:
+            key = derive_key(password, salt, kdf)
+            with self.lock:
+                if len(self.derived_keys) >= MAX_DERIVED_KEYS:
+                    del self.derived_keys[next(iter(self.derived_keys))]
+                self.derived_keys[(salt, kdf)] = key
+        return {"ok": True, "data": _encode(key)}
+
+    def op_lock(self, request: dict) -> dict:
+        with self.lock:
+            self.keys.clear()
+            self.password = None
+            self.derived_keys.clear()
+        return {"ok": True}
+
+    def op_stop(self, request: dict) -> dict:
+        self.op_lock(request)
+        self.stopped.set()
+        return {"ok": True}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": f"{e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            if self.server.agent.stopped.is_set():
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, ttl: int = DEFAULT_TTL):
+        if os.path.exists(path):
+            if connect(path) is not None:
+                raise Exception(f"an agent is already running on {path}")
+            # socket left by an agent that is not running anymore
+            os.remove(path)
+        self.agent = Agent(ttl)
+        # the socket can be used only by the user
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        self.agent.stopped.set()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class AgentClient:
+    """
+    Client of the agent, the connection is opened at the first request. The client can be passed
+    to other processes (e.g. the workers of --jobs), every process opens its own connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._sock = None
+        self._file = None
+        self._key_sizes = None
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def request(self, op: str, **kwargs) -> dict:
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.path)
+            self._file = self._sock.makefile("rwb")
+        kwargs["op"] = op
+        self._file.write(json.dumps(kwargs).encode("utf-8") + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise Exception("the agent closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise Exception(f"agent: {response['error']}")
+        return response
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+
+    def status(self) -> dict:
+        return self.request("status")
+
+    def has_key(self, key: str) -> bool:
+        return os.path.realpath(key) in self.status()["keys"]
+
+    def key_size(self, key: str) -> int:
+        if self._key_sizes is None:
+            self._key_sizes = self.status()["keys"]
+        return self._key_sizes[os.path.realpath(key)]
+
+    def key_type(self, key: str) -> str:
+        # agents started by older versions load only RSA keys
+        return self.status().get("types", {}).get(os.path.realpath(key), "rsa")
+
+    def has_password(self) -> bool:
+        return self.status()["password"]
+
+    def add_key(self, key: str, passphrase: str = None):
+        self.request("add-key", key=key, passphrase=passphrase)
+
+    def add_password(self, password: str):
+        self.request("add-password", password=password)
+
+    def unwrap(self, key: str, enc_session_key: bytes) -> bytes:
+        return _decode(self.request("unwrap", key=key, data=_encode(enc_session_key))["data"])
+
+    def derive(self, salt: bytes, kdf: bytes) -> bytes:
+        return _decode(self.request("derive", salt=_encode(salt), kdf=_encode(kdf))["data"])
+
+
+def connect(path: str = None) -> AgentClient:
+    """
+    Return a client connected to the agent, None if the agent is not running.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    client = AgentClient(path)
+    try:
+        client.status()
+    except (OSError, ValueError):
+        client.close()
+        return None
+    return client
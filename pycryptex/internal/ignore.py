@@ -0,0 +1,161 @@
+"""
+This module contains the rules that select the files of a folder: include/exclude globs, size limits and the
+.pycryptexignore file at the root of the folder. The globs are compiled once into a few regular expressions,
+the excluded folders are pruned by the scanner without listing them.
+
+The globs follow the .gitignore conventions (without negation):
+- "*" and "?" don't match "/", "**" matches any number of folders (e.g. "docs/**/*.tmp")
+- a glob without "/" matches the name of files and folders at any level (e.g. "*.log", "node_modules")
+- a glob with "/" matches the path relative to the folder from its root (e.g. "docs/*.tmp" matches "docs/a.tmp"
+  and not "docs/old/a.tmp" or "x/docs/a.tmp", a leading "/" is ignored)
+- a glob ending with "/" matches only folders (e.g. ".git/", "build/")
+The encrypted files are matched with the name of the clear file (without .pycpx), so the same rules work for
+encryption and decryption. The size limits instead are checked against the size of the files found: when
+decrypting it is the size of the encrypted files (the original size is not saved into them).
+"""
+import os
+import re
+
+IGNORE_NAME = ".pycryptexignore"
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str) -> int:
+    """
+    Return the number of bytes of a size as "512", "100K", "1.5M" or "2G" (powers of 1024), None for None or "".
+    """
+    if value is None or value == "":
+        return None
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"invalid size '{value}', use a number of bytes optionally followed by K, M, G or T")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def read_ignore_file(path: str) -> list:
+    """
+    Return the globs of an ignore file, one per line (empty lines and lines starting with # are skipped).
+    """
+    with open(path, 'r') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def translate(glob: str) -> str:
+    """
+    Return the regular expression matching the whole path of the glob: "*" and "?" don't match "/", "**/" matches
+    zero or more folders, a trailing "/**" everything inside a folder and "[...]" a set of characters.
+    """
+    parts = []
+    i, n = 0, len(glob)
+    while i < n:
+        char = glob[i]
+        if glob.startswith("**", i):
+            if glob.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+            else:
+                parts.append(".*")
+                i += 2
+            continue
+        i += 1
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            end = glob.find("]", i + 1 if glob[i:i + 1] in ("!", "]") else i)
+            if end < 0:
+                parts.append(re.escape(char))
+                continue
+            chars = glob[i:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith("^"):
+                chars = "\\" + chars
+            parts.append(f"(?!/)[{chars}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts) + r"\Z"
+
+
+def _compile(globs: list):
+    """
+    Return a regular expression matching any of the globs, None if there are no globs.
+    """
+    if not globs:
+        return None
+    return re.compile("|".join(f"(?:{translate(glob)})" for glob in globs))
+
+
+class Rules:
+    """
+    Rules to select the files of a folder.
+
+    :param folder: root folder, the .pycryptexignore file is read from it
+    :param include: globs of the files to process (all the files if empty)
+    :param exclude: globs of the files and folders to skip
+    :param min_size: (optional) files smaller than min_size bytes are skipped
+    :param max_size: (optional) files bigger than max_size bytes are skipped
+    """
+
+    def __init__(self, folder: str, include=(), exclude=(), min_size: int = None, max_size: int = None):
+        self.folder = folder
+        self.min_size = min_size
+        self.max_size = max_size
+        exclude = list(exclude)
+        # the ignore file is never encrypted, its rules are needed to decrypt too
+        self.ignore_file = os.path.isfile(os.path.join(folder, IGNORE_NAME))
+        if self.ignore_file:
+            exclude += read_ignore_file(os.path.join(folder, IGNORE_NAME))
+        names, paths, dir_names, dir_paths = [], [], [], []
+        for glob in exclude:
+            only_dirs = glob.endswith("/")
+            glob = glob.strip("/")
+            if not glob:
+                continue
+            if "/" in glob:
+                (dir_paths if only_dirs else paths).append(glob)
+            else:
+                (dir_names if only_dirs else names).append(glob)
+        # the globs matching files and folders are used for both
+        self._names = _compile(names)
+        self._paths = _compile(paths)
+        self._dir_names = _compile(dir_names + names)
+        self._dir_paths = _compile(dir_paths + paths)
+        self._include_names = _compile([glob for glob in include if "/" not in glob.strip("/")])
+        self._include_paths = _compile([glob.strip("/") for glob in include if "/" in glob.strip("/")])
+        self.include = bool(include)
+        # without rules the scanner doesn't call them
+        self.active = bool(self.ignore_file or exclude or include or min_size is not None or max_size is not None)
+
+    def skip_dir(self, rel_path: str, name: str) -> bool:
+        """
+        Return True if the folder (path relative to the root folder with "/" separators and name) has to be pruned.
+        """
+        return bool((self._dir_names is not None and self._dir_names.match(name)) or
+                    (self._dir_paths is not None and self._dir_paths.match(rel_path)))
+
+    def skip_file(self, entry: os.DirEntry, rel_path: str) -> bool:
+        """
+        Return True if the file (its entry and its path relative to the root folder) has to be skipped.
+        The file is stat'ed only if there are size limits and the globs don't exclude it.
+        """
+        name = entry.name
+        if rel_path == IGNORE_NAME:
+            return True
+        if name.endswith(".pycpx"):
+            name, rel_path = name[:-6], rel_path[:-6]
+        if (self._names is not None and self._names.match(name)) or \
+                (self._paths is not None and self._paths.match(rel_path)):
+            return True
+        if self.include and not ((self._include_names is not None and self._include_names.match(name)) or
+                                 (self._include_paths is not None and self._include_paths.match(rel_path))):
+            return True
+        if self.min_size is not None or self.max_size is not None:
+            size = entry.stat().st_size
+            if (self.min_size is not None and size < self.min_size) or \
+                    (self.max_size is not None and size > self.max_size):
+                return True
+        return False
@@ -0,0 +1,110 @@
+"""
+This module contains the journal of the folder jobs: a file at the root of the folder where every file
+encrypted or decrypted is appended as soon as it is completed. If the job is interrupted (crash, kill, power
+loss) the journal is left on disk and the next run with --resume skips the files already completed.
+The journal is removed when the job completes without errors.
+
+The journal is in JSON lines: the first line is the header with the operation, the next ones are the paths
+(relative to the folder) of the completed files. A line truncated by a crash is ignored.
+"""
+import hashlib
+import json
+import os
+
+JOURNAL_NAME = ".pycryptex-journal"
+JOURNAL_VERSION = 1
+
+
+def operation(func, key_files=()) -> str:
+    """
+    Return the name of the operation of a folder job: the class and method of the crypto object (e.g.
+    "ECCCryptex.encrypt_stream") followed by the fingerprints (SHA-256 of the content) of the key files,
+    so a journal can't be resumed with another engine or other keys.
+
+    :param func: bound method of the crypto object that processes the files
+    :param key_files: paths of the public/private keys used (none for the password of AESCryptex)
+    """
+    name = f"{type(func.__self__).__name__}.{func.__name__}"
+    fingerprints = []
+    for key_file in key_files:
+        with open(key_file, 'rb') as f:
+            fingerprints.append(hashlib.sha256(f.read()).hexdigest()[:16])
+    return ":".join([name] + sorted(fingerprints))
+
+
+class Journal:
+    """
+    Files completed by a folder job, indexed by their path relative to the folder.
+
+    :param folder: folder of the job
+    :param operation: name of the operation (see the operation function), a journal written by a different
+                      operation can't be resumed
+    :param resume: True to skip the files completed by the interrupted run, False to start from scratch
+    """
+
+    def __init__(self, folder: str, operation: str, resume: bool = False):
+        self.folder = folder
+        self.path = os.path.join(folder, JOURNAL_NAME)
+        self.operation = operation
+        # relative paths of the files completed by the previous runs
+        self.files = set()
+        # True if a journal of an interrupted run has been found
+        self.interrupted = os.path.exists(self.path)
+        if resume and self.interrupted:
+            self._load()
+        self._file = open(self.path, 'a' if self.files else 'w')
+        if not self.files:
+            self._append({"version": JOURNAL_VERSION, "operation": operation})
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            lines = f.read().split("\n")
+        if len(lines) < 2:
+            # killed while writing the header, no file has been completed
+            return
+        header = json.loads(lines[0])
+        if header.get("version") != JOURNAL_VERSION:
+            raise ValueError(f"unsupported version of the journal {self.path}")
+        if header.get("operation") != self.operation:
+            raise ValueError(f"the journal {self.path} has been written by a different operation "
+                             f"({header.get('operation')}), run without --resume to start from scratch")
+        # the last line is empty, or truncated if the run has been killed while writing it
+        for line in lines[1:-1]:
+            self.files.add(json.loads(line))
+        if lines[-1]:
+            # the truncated line is removed, the next records are appended after the last complete one
+            with open(self.path, 'w') as f:
+                f.write("\n".join(lines[:-1]) + "\n")
+
+    def _append(self, value):
+        # flushed at every record: a killed process loses nothing (no fsync, a power loss can lose the last ones)
+        self._file.write(json.dumps(value) + "\n")
+        self._file.flush()
+
+    def ignored(self, path: str) -> bool:
+        """
+        Return True for the files that are not processed: the journal itself.
+        """
+        return os.path.abspath(path) == os.path.abspath(self.path)
+
+    def done(self, path: str) -> bool:
+        """
+        Return True if the file has been completed by the interrupted run.
+        """
+        return bool(self.files) and os.path.relpath(path, self.folder) in self.files
+
+    def record(self, path: str):
+        """
+        Append a completed file to the journal.
+        """
+        key = os.path.relpath(path, self.folder)
+        self.files.add(key)
+        self._append(key)
+
+    def close(self, completed: bool):
+        """
+        Close the journal, removing it if the job has been completed without errors.
+        """
+        self._file.close()
+        if completed:
+            os.remove(self.path)
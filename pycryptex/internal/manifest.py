@@ -0,0 +1,92 @@
+"""
+This module contains the manifest used by the --sync mode: a JSON file at the root of the folder with the
+size, the mtime and (optionally) the SHA-256 of every file at the time it has been encrypted. The files
+that are not changed since the last run are recognized with the stat of the file, without reading it.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = ".pycryptex-manifest.json"
+MANIFEST_VERSION = 1
+_HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """
+    Return the SHA-256 of the file content as hex string.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Files encrypted by the previous runs, indexed by their path relative to the folder.
+    """
+
+    def __init__(self, folder: str, checksum: bool = False):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        # save the SHA-256 of the files, to skip the files touched without changing the content
+        self.checksum = checksum
+        # relative path -> [size, mtime in ns, SHA-256 or None]
+        self.files = {}
+        # entries of the files to encrypt, saved by update once the encryption has been completed
+        self.pending = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                content = json.load(f)
+            if content.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported version of the manifest {self.path}")
+            self.files = content["files"]
+
+    def ignored(self, path: str) -> bool:
+        """
+        Return True for the files that are not synced: the manifest itself and the encrypted files.
+        """
+        return path.endswith(".pycpx") or os.path.abspath(path) in (os.path.abspath(self.path),
+                                                                    os.path.abspath(self.path) + ".tmp")
+
+    def changed(self, entry: os.DirEntry) -> bool:
+        """
+        Return True if the file has to be encrypted: it is new, changed since the last run or its encrypted
+        file doesn't exist anymore. When the size or the mtime are changed but the content is the same
+        (only with checksum) the entry is updated without encrypting the file again.
+        """
+        key = os.path.relpath(entry.path, self.folder)
+        stat = entry.stat()
+        current = self.files.get(key)
+        if current is not None and current[0] == stat.st_size and current[1] == stat.st_mtime_ns \
+                and os.path.exists(entry.path + ".pycpx"):
+            return False
+        digest = file_digest(entry.path) if self.checksum else None
+        if current is not None and digest is not None and current[2] == digest \
+                and os.path.exists(entry.path + ".pycpx"):
+            self.files[key] = [stat.st_size, stat.st_mtime_ns, digest]
+            return False
+        # the stat is taken before the encryption, a file changed meanwhile is encrypted again at the next run
+        self.pending[entry.path] = (key, [stat.st_size, stat.st_mtime_ns, digest])
+        return True
+
+    def update(self, errors: list):
+        """
+        Add to the manifest the files encrypted, except the ones in errors (list of (file, error message)).
+        """
+        failed = {f for f, _ in errors}
+        for path, (key, value) in self.pending.items():
+            if path not in failed:
+                self.files[key] = value
+        self.pending.clear()
+
+    def save(self):
+        """
+        Write the manifest, the old one is replaced only when the new one is completely written.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,208 @@
+"""
+This module collects the metrics of a command (enabled by --stats): the duration, the bytes and the number
+of calls of every phase (walk, read, write, kdf, rsa, crypto, delete...) and the latency of every file.
+
+The metrics are disabled by default and recording them costs only a check of the flag. The workers of
+--jobs collect their own metrics, sent back to the main process with the results (see drain and merge).
+The phases are exclusive: the time of the phases nested into another one (e.g. kdf or read during encrypt) is
+subtracted from it, so the same time is never counted twice.
+"""
+import math
+import threading
+import time
+
+enabled = False
+_lock = threading.Lock()
+# phase name -> [seconds, calls, bytes]
+_phases = {}
+# seconds spent for every file
+_latencies = []
+# stack of the phases running in the thread, every item is the time spent by the phases nested into it
+_local = threading.local()
+
+
+def enable(value: bool = True):
+    global enabled
+    enabled = value
+
+
+def reset():
+    with _lock:
+        _phases.clear()
+        _latencies.clear()
+
+
+def add(name: str, seconds: float, nbytes: int = 0, calls: int = 1):
+    """
+    Add a measure to the phase name.
+    """
+    if not enabled:
+        return
+    with _lock:
+        phase_data = _phases.get(name)
+        if phase_data is None:
+            _phases[name] = [seconds, calls, nbytes]
+        else:
+            phase_data[0] += seconds
+            phase_data[1] += calls
+            phase_data[2] += nbytes
+
+
+def _nested(seconds: float):
+    """
+    Add the duration of a nested measure to the phase that contains it (if any) in the current thread.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1] += seconds
+
+
+def file_done(seconds: float):
+    """
+    Add the latency of a file completed.
+    """
+    if enabled:
+        with _lock:
+            _latencies.append(seconds)
+
+
+class phase:
+    """
+    Context manager that adds its duration to the phase name, the bytes processed can be set
+    on the object (e.g. measure.nbytes = written).
+    """
+
+    __slots__ = ("name", "nbytes", "start")
+
+    def __init__(self, name: str, nbytes: int = 0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = None
+        if enabled:
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+            stack.append(0.0)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            seconds = time.perf_counter() - self.start
+            nested = _local.stack.pop()
+            add(self.name, seconds - nested, self.nbytes)
+            _nested(seconds)
+
+
+class TimedReader:
+    """
+    Wrapper of a binary stream that adds the time spent reading to the phase "read".
+    """
+
+    def __init__(self, raw, name: str = "read"):
+        self.raw = raw
+        self.name = name
+        # seconds spent reading
+        self.seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        data = self.raw.read(size)
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        add(self.name, seconds, len(data))
+        _nested(seconds)
+        return data
+
+    def readinto(self, buffer) -> int:
+        start = time.perf_counter()
+        count = self.raw.readinto(buffer)
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        add(self.name, seconds, count or 0)
+        _nested(seconds)
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class TimedWriter:
+    """
+    Wrapper of a binary stream that adds the time spent writing to the phase "write".
+    """
+
+    def __init__(self, raw, name: str = "write"):
+        self.raw = raw
+        self.name = name
+        self.seconds = 0.0
+
+    def write(self, data) -> int:
+        start = time.perf_counter()
+        written = self.raw.write(data)
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        add(self.name, seconds, len(data))
+        _nested(seconds)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def drain() -> dict:
+    """
+    Return the metrics collected and reset them.
+    """
+    with _lock:
+        data = {"phases": {name: list(values) for name, values in _phases.items()}, "latencies": list(_latencies)}
+        _phases.clear()
+        _latencies.clear()
+    return data
+
+
+def merge(data: dict):
+    """
+    Add the metrics returned by drain (e.g. by a worker process).
+    """
+    with _lock:
+        for name, (seconds, calls, nbytes) in data["phases"].items():
+            phase_data = _phases.setdefault(name, [0.0, 0, 0])
+            phase_data[0] += seconds
+            phase_data[1] += calls
+            phase_data[2] += nbytes
+        _latencies.extend(data["latencies"])
+
+
+def _percentile(values: list, percent: float) -> float:
+    # nearest rank of the sorted values
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def report(wall_seconds: float = None) -> dict:
+    """
+    Return the metrics as a dictionary ready to be saved as JSON: for every phase seconds, calls, bytes and
+    MB/s, for the files count, files/s and the latency percentiles in milliseconds.
+    """
+    with _lock:
+        phases = {name: list(values) for name, values in _phases.items()}
+        latencies = sorted(_latencies)
+    result = {"wall_seconds": wall_seconds, "phases": {}, "files": {"count": len(latencies)}}
+    for name, (seconds, calls, nbytes) in sorted(phases.items()):
+        result["phases"][name] = {
+            "seconds": seconds,
+            "calls": calls,
+            "bytes": nbytes,
+            "mb_s": nbytes / 1024 / 1024 / seconds if nbytes and seconds > 0 else None,
+        }
+    if latencies:
+        result["files"]["files_s"] = len(latencies) / wall_seconds if wall_seconds else None
+        result["files"]["latency_ms"] = {
+            "p50": _percentile(latencies, 50) * 1000,
+            "p90": _percentile(latencies, 90) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+            "max": latencies[-1] * 1000,
+        }
+    return result
@@ -0,0 +1,112 @@
+"""
+This module runs the encryption/decryption of a list of files in the current process or spreading
+them over a pool of processes.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pycryptex
+from pycryptex.crypto import common
+from pycryptex.internal import metrics
+
+# state of the process that works on the files, set by _init_worker
+_worker = {}
+
+
+def _init_worker(func, is_encrypt: bool, remove: bool, kwargs: dict, config_params, config_file: dict,
+                 metrics_enabled: bool = False, verify: bool = False):
+    """
+    Initialize a worker: func is the bound method of a crypto object (e.g. RSACryptex.encrypt_stream), every
+    worker receives its own copy of the object, so the key is loaded or derived only once per worker.
+    """
+    pycryptex.config_params = config_params
+    pycryptex.config_file = config_file
+    metrics.enable(metrics_enabled)
+    _worker.update(func=func, is_encrypt=is_encrypt, remove=remove, kwargs=kwargs, verify=verify)
+
+
+def _process_file(file: str) -> (str, str, int, dict, dict):
+    """
+    Encrypt, decrypt or verify a single file.
+    :return: the file, the error message (None if the file has been processed successfully), the pid of the
+             worker, the cache statistics of its crypto object (None if the object doesn't have a cache) and
+             the metrics collected (None if the metrics are disabled)
+    """
+    error = None
+    try:
+        if _worker['verify']:
+            common.verify_file(file, _worker['func'], **_worker['kwargs'])
+        elif _worker['is_encrypt']:
+            common.encrypt_file(file, _worker['func'], remove=_worker['remove'], **_worker['kwargs'])
+        else:
+            common.decrypt_file(file, _worker['func'], remove=_worker['remove'], **_worker['kwargs'])
+    except Exception as e:
+        error = f"{e} ({type(e).__name__})"
+    cryptex = getattr(_worker['func'], '__self__', None)
+    stats = cryptex.cache_stats() if hasattr(cryptex, 'cache_stats') else None
+    return file, error, os.getpid(), stats, metrics.drain() if metrics.enabled else None
+
+
+def process_files(files, func, is_encrypt: bool, remove: bool, jobs: int = 1, progress=None, stats: dict = None,
+                  verify: bool = False, completed=None, **kwargs) -> list:
+    """
+    Encrypt or decrypt all the files. An error on a file doesn't stop the others.
+
+    :param files: iterable of file paths
+    :param func: function that encrypts/decrypts a reader into a writer (e.g. RSACryptex.encrypt_stream)
+    :param is_encrypt: True to encrypt, False to decrypt
+    :param remove: bool to specify if remove the original files
+    :param jobs: number of processes to use, 1 works in the current process, 0 uses all the CPUs
+    :param progress: (optional) function called with the number of files processed every time files are completed
+    :param stats: (optional) dictionary filled with the cache statistics (e.g. hits and misses) summed over the workers
+    :param verify: True to verify the encrypted files with func (a decryption function), without writing them
+    :param completed: (optional) function called with every file processed successfully (e.g. Journal.record)
+    :param kwargs: arguments passed to func
+    :return: list of (file, error message) for the files that failed
+    """
+    init_args = (func, is_encrypt, remove, kwargs, pycryptex.config_params, pycryptex.config_file, metrics.enabled,
+                 verify)
+    errors = []
+    # last cache statistics received from every worker
+    worker_stats = {}
+
+    def collect(results):
+        for file, error, pid, cache_stats, file_metrics in results:
+            if error is not None:
+                errors.append((file, error))
+            elif completed is not None:
+                completed(file)
+            if cache_stats is not None:
+                worker_stats[pid] = cache_stats
+            if file_metrics is not None:
+                metrics.merge(file_metrics)
+        if progress is not None:
+            progress(len(results))
+
+    if jobs == 1:
+        _init_worker(*init_args)
+        for file in files:
+            collect([_process_file(file)])
+        _sum_stats(worker_stats, stats)
+        return errors
+
+    jobs = jobs or os.cpu_count()
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=init_args) as executor:
+        # keep a bounded number of files in flight, the list of files can be very long
+        pending = set()
+        for file in files:
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect([f.result() for f in done])
+            pending.add(executor.submit(_process_file, file))
+        if pending:
+            collect([f.result() for f in wait(pending).done])
+    _sum_stats(worker_stats, stats)
+    return errors
+
+
+def _sum_stats(worker_stats: dict, stats: dict):
+    if stats is None:
+        return
+    for cache_stats in worker_stats.values():
+        for name, value in cache_stats.items():
+            stats[name] = stats.get(name, 0) + value
@@ -0,0 +1,226 @@
+"""
+This module contains the pipelined engine: reading, encryption/decryption and writing of the files overlap
+in three stages connected by bounded queues, so the disk keeps working while the CPU runs AES:
+- a reader thread reads the files segment by segment ahead of the crypto stage (read-ahead)
+- a pool of crypto threads seals/opens the segments (pycryptodome releases the GIL in its C primitives)
+- a writer thread writes the segments in order, closes the files and removes the original ones (write-behind)
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pycryptex.crypto import common, stream
+from pycryptex.crypto.compression import Decompressor
+from pycryptex.internal import metrics
+
+# number of segments read and not yet encrypted/decrypted
+DEFAULT_READ_AHEAD = 32
+# number of segments encrypted/decrypted and not yet written
+DEFAULT_WRITE_BEHIND = 64
+
+# marker put into the queue when all the files have been read
+_END = object()
+
+
+class _File:
+    """
+    State of a file going through the pipeline.
+    """
+
+    def __init__(self, src: str, dst: str):
+        self.src = src
+        self.dst = dst
+        self.start_time = time.perf_counter()
+        # bytes written before the segments (the header of the encrypted file)
+        self.prefix = b""
+        self.writer = None
+        self.error = None
+        # (optional) decompressor of the decrypted segments, used by the writer thread
+        self.decompressor = None
+
+
+def _completed(parts: tuple) -> Future:
+    future = Future()
+    future.set_result(parts)
+    return future
+
+
+def _failed(error: Exception) -> Future:
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def _seal(key: bytes, header: stream.Header, index: int, chunk: bytes, last: bool) -> tuple:
+    with metrics.phase("encrypt", len(chunk)):
+        return stream.seal_segment(key, header, index, chunk, last)
+
+
+def _open(key: bytes, header: stream.Header, index: int, block: bytes, last: bool) -> tuple:
+    with metrics.phase("decrypt", len(block) - stream.TAG_SIZE):
+        return stream.open_block(key, header, index, block, last),
+
+
+class Pipeline:
+    """
+    Encrypt or decrypt a list of files with the three stages.
+
+    :param cryptex: crypto object (RSACryptex or AESCryptex), it's used only by the reader thread
+    :param is_encrypt: True to encrypt, False to decrypt
+    :param remove: bool to specify if remove the original files
+    :param read_ahead: number of segments read and not yet encrypted/decrypted
+    :param write_behind: number of segments encrypted/decrypted and not yet written
+    :param threads: number of crypto threads, 0 to use all the CPUs
+    :param progress: (optional) function called with 1 every time a file is completed
+    :param completed: (optional) function called with every file processed successfully (e.g. Journal.record)
+    :param kwargs: arguments of the crypto object methods (e.g. public_key)
+    """
+
+    def __init__(self, cryptex, is_encrypt: bool, remove: bool, read_ahead: int = DEFAULT_READ_AHEAD,
+                 write_behind: int = DEFAULT_WRITE_BEHIND, threads: int = 0, progress=None, completed=None, **kwargs):
+        self.cryptex = cryptex
+        self.is_encrypt = is_encrypt
+        self.remove = remove
+        self.threads = threads or os.cpu_count()
+        self.progress = progress
+        self.completed = completed
+        self.kwargs = kwargs
+        self._read_slots = threading.Semaphore(max(1, read_ahead))
+        # segments in order of file and position: the ones in the crypto stage plus the ones to write
+        self._queue = queue.Queue(max(1, read_ahead) + max(1, write_behind))
+        self._executor = None
+        self._error = None
+        self.errors = []
+
+    def run(self, files) -> list:
+        """
+        Process the files, an error on a file doesn't stop the others.
+
+        :param files: iterable of file paths
+        :return: list of (file, error message) for the files that failed
+        """
+        reader = threading.Thread(target=self._read, args=(files,), daemon=True)
+        writer = threading.Thread(target=self._write, daemon=True)
+        with ThreadPoolExecutor(self.threads) as self._executor:
+            reader.start()
+            writer.start()
+            reader.join()
+            writer.join()
+        if self._error is not None:
+            raise self._error
+        return self.errors
+
+    def _submit(self, func, *args) -> Future:
+        self._read_slots.acquire()
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._read_slots.release())
+        return future
+
+    def _read(self, files):
+        try:
+            for src in files:
+                # same rules of common.encrypt_file and common.decrypt_file
+                if src.endswith(".pycpx") == self.is_encrypt or src.endswith(common.PARTIAL_SUFFIX):
+                    continue
+                state = _File(src, src + ".pycpx" if self.is_encrypt else src[:-6])
+                try:
+                    with open(src, 'rb') as reader:
+                        last_item = self._read_file(state, metrics.TimedReader(reader) if metrics.enabled else reader)
+                except Exception as e:
+                    last_item = (state, _failed(e), True)
+                # the last segment is queued once the file is closed, then the writer can remove it
+                if last_item is not None:
+                    self._queue.put(last_item)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._queue.put(_END)
+
+    def _read_file(self, state: _File, reader) -> tuple:
+        """
+        Queue the segments of a file, except the last one that is returned.
+        """
+        blocks = None
+        if self.is_encrypt:
+            file_key, header = self.cryptex.new_stream(**self.kwargs)
+            # the compression is decided (and saved into the header) sampling the file
+            blocks, reader = stream.compressed_blocks(header, reader, self.cryptex.compression)
+            state.prefix = header.pack()
+            func, size = _seal, header.segment_size
+        else:
+            header, head = stream.read_header(reader)
+            if header is None:
+                # file created with older versions of pycryptex, decrypted in memory
+                return state, _completed((self.cryptex.decrypt_data(head + reader.read(), **self.kwargs),)), True
+            file_key = self.cryptex.stream_key(header, **self.kwargs)
+            func, size = _open, header.segment_size + stream.TAG_SIZE
+            if header.compression:
+                state.decompressor = Decompressor(header.compression)
+        key = stream.segment_key(file_key, header)
+        for index, (chunk, last) in enumerate(blocks if blocks is not None else stream.read_segments(reader, size)):
+            if state.error is not None:
+                # the writer has already failed on this file
+                return None
+            item = (state, self._submit(func, key, header, index, chunk, last), last)
+            if last:
+                return item
+            self._queue.put(item)
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            state, future, last = item
+            if state.error is not None:
+                continue
+            try:
+                parts = future.result()
+                if state.decompressor is not None:
+                    # the segments are decompressed in order, as they are written
+                    with metrics.phase("decrypt"):
+                        parts = list(state.decompressor.decompress(parts[0]))
+                with metrics.phase("write") as measure:
+                    if state.writer is None:
+                        # written with a temporary name, renamed once completed (see common._stream_file)
+                        state.writer = open(state.dst + common.PARTIAL_SUFFIX, 'wb')
+                        state.writer.write(state.prefix)
+                    state.writer.writelines(parts)
+                    measure.nbytes = sum(len(part) for part in parts)
+                    if last:
+                        # the original file is removed only once the new one is on disk
+                        common.replace_durably(state.writer, state.dst + common.PARTIAL_SUFFIX, state.dst)
+                        state.writer = None
+                if last:
+                    if self.remove:
+                        if self.is_encrypt:
+                            common.remove_file(state.src)
+                        else:
+                            with metrics.phase("delete"):
+                                os.remove(state.src)
+                    metrics.file_done(time.perf_counter() - state.start_time)
+                    if self.completed is not None:
+                        self.completed(state.src)
+            except Exception as e:
+                state.error = f"{e} ({type(e).__name__})"
+                self.errors.append((state.src, state.error))
+                if state.writer is not None:
+                    state.writer.close()
+                    state.writer = None
+                # the partial file is removed
+                if os.path.exists(state.dst + common.PARTIAL_SUFFIX):
+                    os.remove(state.dst + common.PARTIAL_SUFFIX)
+            if (last or state.error is not None) and self.progress is not None:
+                self.progress(1)
+
+
+def process_files(files, cryptex, is_encrypt: bool, remove: bool, read_ahead: int = DEFAULT_READ_AHEAD,
+                  write_behind: int = DEFAULT_WRITE_BEHIND, threads: int = 0, progress=None, completed=None,
+                  **kwargs) -> list:
+    """
+    Encrypt or decrypt all the files with the pipelined engine (see Pipeline).
+    :return: list of (file, error message) for the files that failed
+    """
+    return Pipeline(cryptex, is_encrypt, remove, read_ahead, write_behind, threads, progress, completed,
+                    **kwargs).run(files)
@@ -0,0 +1,106 @@
+"""
+This module walks a folder once with os.scandir, producing the files found while the walk is still running.
+"""
+import os
+import queue
+import threading
+import time
+from pycryptex.internal import metrics
+from pycryptex.internal.ignore import IGNORE_NAME
+from pycryptex.internal.journal import JOURNAL_NAME
+from pycryptex.internal.manifest import MANIFEST_NAME
+
+# marker put into the queue when the walk is finished
+_END = object()
+# files of pycryptex at the root of a folder, they are never returned (e.g. encrypting the manifest would break --sync)
+RESERVED_NAMES = frozenset((MANIFEST_NAME, MANIFEST_NAME + ".tmp", JOURNAL_NAME, IGNORE_NAME))
+
+
+def scan(folder: str, no_nested: bool = False, rules=None):
+    """
+    Generator that yields the os.DirEntry of every file in folder and in its nested folders (except the
+    RESERVED_NAMES at the root).
+    The type of the entries comes from the directory listing, so no additional stat is needed to
+    tell files and folders apart, and the stat() of an entry is cached on the entry itself.
+    As os.walk, the folders that can't be read are skipped and the symbolic links to folders are not followed.
+
+    :param folder: directory where to begin the walk
+    :param no_nested: True to read only the first level of the folder
+    :param rules: (optional) ignore.Rules selecting the files, the excluded folders are not listed at all
+    """
+    if rules is not None and not rules.active:
+        rules = None
+    # folders to list with their path relative to folder (used only by the rules)
+    folders = [(folder, "")]
+    while folders:
+        current, prefix = folders.pop()
+        try:
+            # the listing is completed before yielding, so the files created meanwhile in the
+            # folder (e.g. the .pycpx files) are not returned
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError:
+            if current == folder:
+                raise
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not no_nested:
+                        if rules is None:
+                            folders.append((entry.path, None))
+                        elif not rules.skip_dir(prefix + entry.name, entry.name):
+                            folders.append((entry.path, prefix + entry.name + "/"))
+                elif entry.is_file():
+                    if current == folder and entry.name in RESERVED_NAMES:
+                        continue
+                    if rules is None or not rules.skip_file(entry, prefix + entry.name):
+                        yield entry
+            except OSError:
+                continue
+
+
+class Scanner(threading.Thread):
+    """
+    Walk a folder in a background thread putting the os.DirEntry of the files into a queue.
+    Iterating on the scanner returns the entries as soon as they are found, count is the number
+    of files found until now.
+    """
+
+    def __init__(self, folder: str, no_nested: bool = False, maxsize: int = 100000, rules=None):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.no_nested = no_nested
+        self.rules = rules
+        self.queue = queue.Queue(maxsize)
+        self.count = 0
+        self.finished = False
+        self.error: Exception = None
+
+    def run(self):
+        start_time = time.perf_counter()
+        # time spent waiting for a full queue (the consumer is slower than the walk), it is not walk time
+        waited = 0.0
+        try:
+            for entry in scan(self.folder, self.no_nested, self.rules):
+                self.count += 1
+                put_time = time.perf_counter()
+                self.queue.put(entry)
+                waited += time.perf_counter() - put_time
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            metrics.add("walk", time.perf_counter() - start_time - waited, calls=self.count)
+            self.queue.put(_END)
+
+    def __iter__(self):
+        if not self.is_alive() and not self.finished:
+            self.start()
+        while True:
+            entry = self.queue.get()
+            if entry is _END:
+                break
+            yield entry
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,73 @@
+"""
+This module overwrites the content of a file before deleting it.
+
+The file is overwritten one chunk at time reusing the same buffers, the random data are produced
+by an AES-CTR keystream (with a random key) that is much faster than os.urandom, and every pass
+is flushed on disk before starting the next one.
+"""
+import os
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+BUFFER_SIZE = 1024 * 1024
+ZERO = "zero"
+RANDOM = "random"
+
+
+def strategy_passes(strategy) -> list:
+    """
+    Return the list of passes to run for the strategy set in the secure-deletion-passes config key:
+    - "zero": one pass of zeros
+    - "random": one pass of random data
+    - N (integer): N passes of random data followed by a pass of zeros
+
+    :param strategy: value of the secure-deletion-passes config key
+    :return: list of passes (ZERO or RANDOM)
+    """
+    if isinstance(strategy, str):
+        value = strategy.strip().lower()
+        if value in (ZERO, RANDOM):
+            return [value]
+        if not value.isdigit():
+            raise ValueError(f"invalid secure deletion strategy '{strategy}', use 'zero', 'random' "
+                             f"or the number of passes")
+        strategy = int(value)
+    if isinstance(strategy, bool) or not isinstance(strategy, int) or strategy < 0:
+        raise ValueError(f"invalid secure deletion strategy '{strategy}', use 'zero', 'random' "
+                         f"or the number of passes")
+    return [RANDOM] * strategy + [ZERO]
+
+
+def overwrite(path: str, passes: list, buffer_size: int = BUFFER_SIZE) -> int:
+    """
+    Overwrite the content of the file running the passes passed as argument.
+
+    :param path: file to overwrite
+    :param passes: list of passes (ZERO or RANDOM)
+    :param buffer_size: size of the chunks written on the file
+    :return: total number of bytes written
+    """
+    length = os.path.getsize(path)
+    zeros = bytes(buffer_size)
+    zeros_view = memoryview(zeros)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    written = 0
+    with open(path, "r+b") as delfile:
+        for kind in passes:
+            delfile.seek(0)
+            keystream = AES.new(get_random_bytes(32), AES.MODE_CTR) if kind == RANDOM else None
+            remaining = length
+            while remaining > 0:
+                size = min(remaining, buffer_size)
+                if keystream is None:
+                    delfile.write(zeros_view[:size])
+                else:
+                    # encrypting zeros gives the keystream, written directly into the reused buffer
+                    keystream.encrypt(zeros, output=buffer)
+                    delfile.write(view[:size])
+                remaining -= size
+            delfile.flush()
+            os.fsync(delfile.fileno())
+            written += length
+    return written
@@ -1,12 +1,13 @@
 """
 Utils module for repetitive jobs.
+The heavy modules (toml, subprocess, the crypto ones) are imported by the functions that use them,
+so the commands that don't need them start faster.
 """
 import os
 from pathlib import Path
-import subprocess
 import pycryptex
 from os import path
-import toml
+import time
 import click
 
 
@@ -48,9 +49,32 @@ private-key = ""
 public-key = ""
 # (default false) true/false to secure delete files (if activated deletion of files becomes slower)
 secure-deletion = false
-# number of passes for secure deletion. Means how many times PyCryptex write random data into the file.
+# strategy for secure deletion: "zero" (one pass of zeros), "random" (one pass of random data) or the number
+# of passes, means how many times PyCryptex write random data into the file before a final pass of zeros.
 # greater is the number you adopt major security but deletion becomes slower
 secure-deletion-passes = 1
+# key derivation function used by encrypt-aes to get the key from the password: "pbkdf2" (HMAC-SHA256) or "scrypt".
+# The function and its cost are saved into the encrypted files, so decrypt-aes always uses the right ones
+kdf = "pbkdf2"
+# number of iterations of pbkdf2, greater is the number slower (and harder to attack) is the derivation
+pbkdf2-iterations = 600000
+# cost of scrypt as log2 of its N parameter (17 means N = 131072, it uses 128 MB of memory)
+scrypt-cost = 17
+# AEAD cipher used to encrypt: "eax", "gcm" (fastest on CPUs with AES instructions) or "chacha20-poly1305"
+# (fastest on CPUs without them). The cipher is saved into the encrypted files, decryption always uses the right one
+cipher = "eax"
+# compression of the files before encryption: "none", "zlib", "lzma" (smaller, slower) or "zstd" (fast, it needs the
+# zstandard package). Files that don't compress (images, videos, archives...) are detected and not compressed
+compression = "none"
+# queues of the --pipeline engine, in segments of 64 KB: segments read ahead of the encryption and segments
+# encrypted waiting to be written. Greater values help slow disks (e.g. spinning disks) using more memory
+pipeline-read-ahead = 32
+pipeline-write-behind = 64
+# number of threads that encrypt/decrypt the segments with --pipeline, 0 to use all the CPUs
+pipeline-threads = 0
+# globs of the files and folders skipped in folder mode (added to --exclude and to the .pycryptexignore file of the
+# folder), a glob ending with "/" matches only folders that are not even listed
+exclude = [".git/", "node_modules/", "__pycache__/"]
 """)
             return True
     return False
@@ -59,6 +83,7 @@ secure-deletion-passes = 1
 def read_config():
     config_path = os.path.join(get_home(), '.pycryptex', 'pycryptex.toml')
     if path.exists(config_path):
+        import toml
         pycryptex.config_file = toml.load(config_path)
     else:
         pycryptex.config_file = {
@@ -68,6 +93,15 @@ def read_config():
                 'public-key': "",
                 'secure-deletion': False,
                 'secure-deletion-passes': 1,
+                'kdf': 'pbkdf2',
+                'pbkdf2-iterations': 600000,
+                'scrypt-cost': 17,
+                'cipher': 'eax',
+                'compression': 'none',
+                'pipeline-read-ahead': 32,
+                'pipeline-write-behind': 64,
+                'pipeline-threads': 0,
+                'exclude': [],
             }
         }
 
@@ -88,33 +122,35 @@ def show_config():
             click.style(f"● Nothing to do, file pycryptex.toml has not been created yet...", fg="white", bold=False))
 
 
-def open_pager(config, dec_bytes: bytes):
+def open_pager(config, dec_bytes):
+    """
+    Open the pager set into the configuration writing the content on its standard input.
+    :param config: Config of the command
+    :param dec_bytes: bytes or iterable of bytes chunks, the chunks are written as soon as they are produced
+                      and the iteration stops when the pager is closed
+    :return:
+    """
     # load config file first
     read_config()
     if config.verbose:
         click.echo(click.style(f"config_file loaded: {pycryptex.config_file}", fg="magenta", bold=True))
+    import subprocess
+    if isinstance(dec_bytes, (bytes, bytearray)):
+        dec_bytes = [dec_bytes]
     process = subprocess.Popen(pycryptex.config_file['config']['pager'].split(' '), shell=False, stdin=subprocess.PIPE)
-    process.communicate(dec_bytes)
-
-
-def count_file(path, no_nested: bool) -> int:
-    """
-    Count the file in a folder and its nested folders
-    :param path: directory where begins to count
-    :return: total files number
-    """
-    i = 0
-    if no_nested:
-        currentDirectory = Path(path)
-        for currentFile in currentDirectory.iterdir():
-            if currentFile.is_file():
-                i += 1
-        return i
-    else:
-        for root, d_names, f_names in os.walk(path):
-            for f in f_names:
-                i += 1
-        return i
+    try:
+        for chunk in dec_bytes:
+            process.stdin.write(chunk)
+            process.stdin.flush()
+    except BrokenPipeError:
+        # the pager has been closed before reading everything
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
 
 
 def is_valid_path(path) -> bool:
@@ -127,29 +163,24 @@ def is_valid_path(path) -> bool:
 
 def secure_delete(path, passes=1):
     """
-    Secure remove file, thanks to:
-    https://stackoverflow.com/users/2868788/phealy3330
-    to comment this article:
-    https://stackoverflow.com/questions/17455300/python-securely-remove-file
+    Secure remove file overwriting its content before the deletion.
     :param path: path to remove
-    :param passes: (default 1) number of passes
+    :param passes: (default 1) strategy to use: 'zero', 'random' or the number of random passes
+                   (followed by a pass of zeros)
     :return:
     """
     if not os.path.isfile(path):
         raise Exception(f"{path} is not a valid file, cannot securely delete!")
 
-    with open(path, "ba+", buffering=0) as delfile:
-        length = delfile.tell()
-    delfile.close()
-    with open(path, "br+", buffering=0) as delfile:
-        for i in range(passes):
-            delfile.seek(0, 0)
-            delfile.write(os.urandom(length))
-        delfile.seek(0)
-        for x in range(length):
-            delfile.write(b'\x00')
+    from pycryptex.internal import shred, metrics
+    start_time = time.perf_counter()
+    written = shred.overwrite(path, shred.strategy_passes(passes))
     # file deletion
     os.remove(path)
+    metrics.add("secure-delete", time.perf_counter() - start_time, written)
 
-    if pycryptex.config_params.verbose:
-        click.echo(click.style(f"secure deletion of {path} with {passes} passes", fg="magenta", bold=False))
\ No newline at end of file
+    if pycryptex.config_params is not None and pycryptex.config_params.verbose:
+        run_time = time.perf_counter() - start_time
+        click.echo(click.style(f"secure deletion of {path} with passes '{passes}': {written / 1024 / 1024:.2f} MB "
+                               f"written in {run_time:.4f} secs "
+                               f"({written / 1024 / 1024 / max(run_time, 1e-9):.2f} MB/s)", fg="magenta", bold=False))
@@ -1,31 +1,158 @@
+"""
+pycryptex CLI. The modules needed by a command (crypto, tqdm, toml...) are imported when the command runs,
+so the CLI starts fast for --version, --help and the light commands.
+"""
+import functools
 import os
-from pathlib import Path
 import sys
 from getpass import getpass
-from pycryptex.crypto.rsa import RSACryptex
 import pycryptex
 from os import path
 import click
-from tqdm import tqdm
 from pycryptex.internal import utils
 from pycryptex.internal.decorators import timer, debug
-from pycryptex.crypto import common
-from pycryptex.crypto.aes import AESCryptex
-
-
-
 
 
 # Decorator that will create a new instance of Config class. The instance is config and the object can be passed
 # through the commands
 pass_config = click.make_pass_decorator(pycryptex.Config, ensure=True)
 
+# cipher suites of --cipher (the names of stream.SUITES, not imported to keep the CLI startup fast)
+CIPHERS = ("eax", "gcm", "chacha20-poly1305")
+# compression algorithms of --compress (the names of compression.COMPRESSIONS)
+COMPRESSIONS = ("none", "zlib", "lzma", "zstd")
+
+
+def _size_option(ctx, param, value):
+    from pycryptex.internal.ignore import parse_size
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def pipe_streams():
+    """
+    Return the standard input and output as binary streams, used when FILE is "-" (pipe mode).
+    """
+    if click.get_current_context().find_root().params.get('stats') == '-':
+        raise Exception("--stats - can't be used with FILE - (the standard output carries the data)")
+    return sys.stdin.buffer, sys.stdout.buffer
+
+
+def ask_secret(prompt: str, pipe: bool = False) -> str:
+    """
+    Ask a passphrase on the terminal. In pipe mode the standard input carries the data, so without a terminal
+    the passphrase can't be asked (getpass would read it from the data).
+    """
+    if pipe and os.name != 'nt':
+        try:
+            open('/dev/tty').close()
+        except OSError:
+            raise Exception("no terminal to ask the passphrase, with FILE - unlock it into the agent first")
+    return getpass(prompt)
+
+
+def folder_filters(func):
+    """
+    Decorator that adds the options selecting the files of a folder, the command receives them as the
+    filters dictionary (arguments of ignore.Rules).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, include, exclude, min_size, max_size, **kwargs):
+        return func(*args, filters=dict(include=include, exclude=exclude, min_size=min_size, max_size=max_size),
+                    **kwargs)
+
+    options = [
+        click.option('--include', multiple=True, metavar='GLOB',
+                     help="(optional) in case of a folder, process only the files matching the glob (repeatable)"),
+        click.option('--exclude', multiple=True, metavar='GLOB',
+                     help="(optional) in case of a folder, skip the files and folders matching the glob (repeatable, "
+                          "\"name/\" matches only folders), added to the .pycryptexignore file of the folder"),
+        click.option('--min-size', default=None, callback=_size_option, metavar='SIZE',
+                     help="(optional) in case of a folder, skip the files smaller than SIZE (e.g. 100, 4K, 1.5M), "
+                          "decrypting it is the size of the encrypted files"),
+        click.option('--max-size', default=None, callback=_size_option, metavar='SIZE',
+                     help="(optional) in case of a folder, skip the files bigger than SIZE (e.g. 100M, 2G), "
+                          "decrypting it is the size of the encrypted files"),
+    ]
+    for option in reversed(options):
+        wrapper = option(wrapper)
+    return wrapper
+
+
+def folder_options(func):
+    """
+    Decorator that adds the options processing a folder shared by encrypt, decrypt, encrypt-aes and decrypt-aes:
+    --jobs, --pipeline and --resume.
+    """
+    options = [
+        click.option('--jobs', '-j', type=click.IntRange(min=0), default=1,
+                     help="(optional, int=1) in case FILE is a folder, number of processes to use (0 to use all the "
+                          "CPUs)"),
+        click.option('--pipeline', 'pipelined', is_flag=True, default=False,
+                     help="(optional, bool=False) in case FILE is a folder, overlap reading, encryption and writing of "
+                          "the files using threads (see the pipeline-* keys of the config file)"),
+        click.option('--resume', is_flag=True, default=False,
+                     help="(optional, bool=False) in case FILE is a folder, continue an interrupted run skipping the "
+                          "files it has already completed (read from the .pycryptex-journal file)"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def encryption_options(func):
+    """
+    Decorator that adds the options of encrypt and encrypt-aes: --archive, --sync, --checksum, --cipher and
+    --compress (see check_archive_options).
+    """
+    options = [
+        click.option('--archive', '-a', is_flag=True, default=False,
+                     help="(optional, bool=False) in case FILE is a folder, encrypt the whole folder into a single "
+                          "FILE.pycpx"),
+        click.option('--sync', is_flag=True, default=False,
+                     help="(optional, bool=False) in case FILE is a folder, keep the original files and encrypt only "
+                          "the files new or changed since the last --sync run"),
+        click.option('--checksum', is_flag=True, default=False,
+                     help="(optional, bool=False) with --sync, save the SHA-256 of the files to skip the ones touched "
+                          "without changing the content"),
+        click.option('--cipher', type=click.Choice(CIPHERS, case_sensitive=False), default=None,
+                     help="(optional, str=eax) AEAD cipher used to encrypt, the default is read from the config file "
+                          "(cipher). It is saved into the files, decryption always uses the right one"),
+        click.option('--compress', type=click.Choice(COMPRESSIONS, case_sensitive=False), default=None,
+                     help="(optional, str=none) compress the files before encryption, the default is read from the "
+                          "config file (compression). Files that don't compress (e.g. images, archives) are not "
+                          "compressed"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def check_archive_options(archive: bool, sync: bool, resume: bool, filters: dict):
+    """
+    Raise an exception if the options of encrypt/encrypt-aes can't be used together with --archive.
+    """
+    if sync and archive:
+        raise Exception("--sync can't be used with --archive")
+    if resume and archive:
+        raise Exception("--resume can't be used with --archive")
+    if archive and any(filters.values()):
+        raise Exception("--include, --exclude, --min-size and --max-size can't be used with --archive")
+
 
 @click.group()
 @click.version_option(version=None, message="pycryptex CLI application (version: %(version)s)")
 @click.option('--verbose', "-v", is_flag=True, help='bool, to specify if needed a verbose mode')
+@click.option('--stats', type=click.Path(dir_okay=False, writable=True, allow_dash=True), default=None,
+              help="(optional) write to STATS ('-' for the standard output) a JSON report with duration, bytes and "
+                   "throughput of every phase and the latency percentiles of the files")
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), default=None,
+              help="(optional) write to PROFILE the cProfile statistics of the command (the --jobs workers are "
+                   "not profiled), read them with: python -m pstats PROFILE")
 @pass_config
-def cli(config, verbose):
+def cli(config, verbose, stats, profile):
     """
     pycryptex is a CLI application to help you easily encrypt/decrypt some files or
     folders.
@@ -39,33 +166,99 @@ def cli(config, verbose):
     """
     pycryptex.config_params = config
     config.verbose = verbose
+    ctx = click.get_current_context()
+    if stats is not None:
+        start_stats(ctx, stats)
+    if profile is not None:
+        start_profile(ctx, profile)
+
+
+def start_stats(ctx, stats: str):
+    """
+    Enable the metrics, the report is written when the command ends.
+    """
+    import json
+    import time
+    from pycryptex.internal import metrics
+    metrics.reset()
+    metrics.enable()
+    start_time = time.perf_counter()
+
+    def write_report():
+        report = {"command": ctx.invoked_subcommand, **metrics.report(time.perf_counter() - start_time)}
+        metrics.enable(False)
+        content = json.dumps(report, indent=2)
+        if stats == '-':
+            click.echo(content)
+        else:
+            with open(stats, 'w') as f:
+                f.write(content + "\n")
+
+    ctx.call_on_close(write_report)
+
+
+def start_profile(ctx, profile: str):
+    """
+    Profile the command with cProfile, the statistics are written when the command ends.
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+
+    def write_profile():
+        profiler.disable()
+        profiler.dump_stats(profile)
+
+    ctx.call_on_close(write_profile)
+    profiler.enable()
 
 
 @cli.command()
 @click.argument('file', required=True)
-@click.option('--pubkey', default="", help='(optional) specify the RSA public key')
+@click.option('--pubkey', multiple=True,
+              help='(optional) specify the public key (RSA or ECC), repeat it to encrypt for many recipients (any of their '
+                   'private keys can decrypt)')
 @click.option('--keep', '-k', is_flag=True, default=False,
               help="(optional, bool=False) if specified, do not remove the original file")
 @click.option('--no-nested', is_flag=True, default=False,
               help="(optional, bool=False) in case FILE is a folder, specify it to avoid encrypting the nested folders")
+@folder_options
+@encryption_options
+@folder_filters
 @pass_config
-def encrypt(config, file, pubkey, keep, no_nested):
+def encrypt(config, file, pubkey, keep, no_nested, jobs, archive, sync, checksum, pipelined, cipher, resume,
+            compress, filters):
     """Encrypt files or folders using RSA/AES algorithms"""
-    # test first for file/folder existence
-    if not utils.is_valid_path(file):
+    from pycryptex.crypto import common, keys
+    from pycryptex.crypto.rsa import RSACryptex
+    from pycryptex.internal.manifest import Manifest
+    # test first for file/folder existence ("-" is the standard input)
+    if file != "-" and not utils.is_valid_path(file):
         return
     try:
+        check_archive_options(archive, sync, resume, filters)
         # in case of pubkey is not passed, pycryptex calculates the default path
-        pubkey = load_key(pubkey, 'public-key', 'pycryptex_key.pub')
-        rsa: RSACryptex = RSACryptex()
+        pubkeys = [load_key(key, 'public-key', 'pycryptex_key.pub') for key in pubkey or ("",)]
+        pubkey = ", ".join(pubkeys)
+        utils.read_config()
+        # the type of the public keys (RSA or ECC) selects the crypto object
+        rsa: RSACryptex = keys.new_cryptex(keys.public_keys_type(pubkeys), suite=cipher_suite(cipher),
+                                           compression=compression_algorithm(compress))
         # check if the file param is a file or a dir
-        if os.path.isdir(file):
-            encrypt_decrypt_folder(rsa.encrypt_data, True, folder=file, keep=keep, no_nested=no_nested,
-                                   public_key=pubkey)
+        if file == "-":
+            # pipe mode: the standard input is encrypted on the standard output, the messages go to stderr
+            common.process_stream(*pipe_streams(), rsa.encrypt_stream, "encrypt", public_key=pubkeys)
+        elif os.path.isdir(file) and archive:
+            f = encrypt_archive(rsa.create_stream, file, keep, public_key=pubkeys)
+            click.echo(click.style(f"👍 Folder encrypted successfully in {f}! [key used: {pubkey}]", fg="green",
+                                   bold=True))
+        elif os.path.isdir(file):
+            encrypt_decrypt_folder(rsa.encrypt_stream, True, folder=file, keep=keep or sync, no_nested=no_nested,
+                                   jobs=jobs, manifest=Manifest(file, checksum) if sync else None, pipelined=pipelined,
+                                   resume=resume, filters=filters, public_key=pubkeys)
             click.echo(click.style(f"👍 Folder encrypted successfully! [key used: {pubkey}]", fg="green", bold=True))
         else:
             # encryption of the file
-            f, done = common.encrypt_file(file=file, func=rsa.encrypt_data, remove=not keep, public_key=pubkey)
+            f, done = common.encrypt_file(file=file, func=rsa.encrypt_stream, remove=not keep, public_key=pubkeys)
             if done:
                 click.echo(
                     click.style(f"👍 File encrypted successfully in {f}! [key used: {pubkey}]", fg="green", bold=True))
@@ -73,77 +266,205 @@ def encrypt(config, file, pubkey, keep, no_nested):
                 click.echo(click.style(f"● Nothing to do, file already encrypted!", fg="white", bold=False))
 
         if config.verbose:
-            click.echo(click.style(f"pubkey used is: {pubkey}", fg="magenta", bold=False))
-            click.echo(click.style(f"config_file loaded: {pycryptex.config_file}", fg="magenta", bold=True))
+            click.echo(click.style(f"pubkey used is: {pubkey}", fg="magenta", bold=False), err=file == "-")
+            click.echo(click.style(f"config_file loaded: {pycryptex.config_file}", fg="magenta", bold=True),
+                       err=file == "-")
     except Exception as e:
-        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True))
+        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True), err=file == "-")
         sys.exit(2)
 
 
 @cli.command()
 @click.argument('file', required=True)
-@click.option('--privkey', default="", help='(optional) specify the RSA private key')
+@click.option('--privkey', default="", help='(optional) specify the private key (RSA or ECC)')
 @click.option('--keep', '-k', is_flag=True, default=False,
               help="(optional, bool=False) if specified, do not remove the original file")
 @click.option('--pager', '-p', is_flag=True,
               help="(optional, bool=False) open the pager to read decrypted file (only if the FILE arg is a file)")
 @click.option('--no-nested', is_flag=True, default=False,
               help="(optional, bool=False) in case FILE is a folder, specify it to avoid decrypting the nested folders")
+@folder_options
+@folder_filters
 @pass_config
-def decrypt(config, file, privkey, keep, pager, no_nested):
+def decrypt(config, file, privkey, keep, pager, no_nested, jobs, pipelined, resume, filters):
     """Decrypt files or folders using RSA/AES algorithms"""
-    # test first for file/folder existence
-    if not utils.is_valid_path(file):
+    from pycryptex.crypto import common, archive, stream
+    # test first for file/folder existence ("-" is the standard input)
+    if file != "-" and not utils.is_valid_path(file):
         return
     try:
         f = ""
         privkey = load_key(privkey, 'private-key', 'pycryptex_key')
-        # check if the private key has a password
-        passphrase = None
-        if RSACryptex.is_privatekey_protected(privkey):
-            passphrase = getpass("Please insert your passphrase: ")
-        rsa: RSACryptex = RSACryptex()
-        if os.path.isdir(file):
-            encrypt_decrypt_folder(rsa.decrypt_data, False, folder=file, keep=keep,
-                                   no_nested=no_nested, passprhase=passphrase, private_key=privkey)
+        key_agent = connect_agent(config)
+        rsa, passphrase = private_key_cryptex(privkey, key_agent, pipe=file == "-")
+        if file == "-":
+            # pipe mode: the standard input is decrypted on the standard output (an archive as tar stream)
+            common.process_stream(*pipe_streams(), rsa.decrypt_stream, "decrypt", passprhase=passphrase,
+                                  private_key=privkey)
+        elif os.path.isdir(file):
+            encrypt_decrypt_folder(rsa.decrypt_stream, False, folder=file, keep=keep, no_nested=no_nested,
+                                   jobs=jobs, pipelined=pipelined, resume=resume, filters=filters,
+                                   passprhase=passphrase, private_key=privkey)
             click.echo(click.style(f"👍 Folder decrypted successfully! [key used: {privkey}]", fg="green", bold=True))
         else:  # single file case
             # open file in a pager
             if pager:
-                # read the file
                 with open(file, 'rb') as byte_reader:
-                    # Read all bytes
-                    enc_bytes = byte_reader.read(-1)
-                # get decrypted data
-                dec_bytes = rsa.decrypt_data(enc_bytes, privkey, passphrase)
-                utils.open_pager(config, dec_bytes)
+                    # the segments are decrypted while the pager reads them, closing the pager stops the decryption
+                    _, dec_reader = rsa.open_stream(byte_reader, privkey, passphrase)
+                    utils.open_pager(config, iter(lambda: dec_reader.read1(stream.DEFAULT_SEGMENT_SIZE), b""))
+            elif file.endswith(".pycpx") and archive.is_archive(file):
+                f = decrypt_archive(rsa.open_stream, file, keep, passprhase=passphrase, private_key=privkey)
+                click.echo(click.style(f"👍 Folder decrypted successfully in {f}! [key used: {privkey}]", fg="green",
+                                       bold=True))
             else:
-                f, done = common.decrypt_file(file=file, func=rsa.decrypt_data, remove=not keep, passprhase=passphrase,
-                                              private_key=privkey)
+                f, done = common.decrypt_file(file=file, func=rsa.decrypt_stream, remove=not keep,
+                                              passprhase=passphrase, private_key=privkey)
                 if done:
                     click.echo(click.style(f"👍 File decrypted successfully in {f}! [key used: {privkey}]", fg="green",
                                            bold=True))
                 else:
                     click.echo(click.style(f"● Nothing to do, file already decrypted!", fg="white", bold=False))
-
+        # the key is added to the agent only when the passphrase has been verified by the decryption
+        if key_agent is not None and rsa.agent is None:
+            add_to_agent(config, key_agent.add_key, privkey, passphrase)
 
     except ValueError as e:
         click.echo(click.style(f"Houston, help: it is possible that you use the wrong key file to decrypt "
                                f"the document or that the passphrase is incorrect. \nTry with the private key "
-                               f"corresponding to the public key used to encrypt the file: {e}", fg="red", bold=True))
+                               f"corresponding to the public key used to encrypt the file: {e}", fg="red", bold=True),
+                   err=file == "-")
         sys.exit(2)
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True), err=file == "-")
+        sys.exit(2)
+
+
+@cli.command()
+@click.argument('file', required=True)
+@click.option('--privkey', default="", help='(optional) specify the private key (for files encrypted with RSA or ECC)')
+@click.option('--offset', '-o', type=click.IntRange(min=0), default=0,
+              help="(optional, int=0) position of the first byte to decrypt")
+@click.option('--length', '-l', type=click.IntRange(min=0), default=None,
+              help="(optional) number of bytes to decrypt, until the end of the file if not specified")
+@pass_config
+def cat(config, file, privkey, offset, length):
+    """
+    Decrypt FILE (or only --length bytes from --offset) on the standard output.
+    Only the segments that cover the range are read and decrypted (compressed files are decrypted from the start).
+    """
+    from pycryptex.crypto import stream
+    from pycryptex.crypto.aes import AESCryptex
+    if not utils.is_valid_path(file):
+        return
+    try:
+        with open(file, 'rb') as reader:
+            header, _ = stream.read_header(reader)
+            reader.seek(0)
+            key_agent = connect_agent(config)
+            if header is not None and header.kind == stream.KIND_AES:
+                utils.read_config()
+                cryptex = AESCryptex()
+                secret = None
+                if key_agent is not None and key_agent.has_password():
+                    cryptex.agent = key_agent
+                else:
+                    secret = getpass("Please insert your passphrase: ")
+                _, dec_reader = cryptex.open_stream(reader, secret)
+            else:
+                privkey = load_key(privkey, 'private-key', 'pycryptex_key')
+                cryptex, secret = private_key_cryptex(privkey, key_agent)
+                _, dec_reader = cryptex.open_stream(reader, privkey, secret)
+            if dec_reader.seekable():
+                dec_reader.seek(offset)
+            else:
+                # compressed content, the bytes before offset are decrypted and skipped
+                while offset > 0:
+                    skipped = len(dec_reader.read1(min(offset, stream.DEFAULT_SEGMENT_SIZE)))
+                    if not skipped:
+                        break
+                    offset -= skipped
+            out = sys.stdout.buffer
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = dec_reader.read1(stream.DEFAULT_SEGMENT_SIZE if remaining is None
+                                         else min(remaining, stream.DEFAULT_SEGMENT_SIZE))
+                if not chunk:
+                    break
+                out.write(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+            out.flush()
+        # the key or the password are added to the agent only when they have been verified by the decryption
+        if key_agent is not None and cryptex.agent is None:
+            if isinstance(cryptex, AESCryptex):
+                add_to_agent(config, key_agent.add_password, secret)
+            else:
+                add_to_agent(config, key_agent.add_key, privkey, secret)
+    except ValueError as e:
+        click.echo(click.style(f"Houston, help: it is possible that the key or the password you used are incorrect "
+                               f"or that the file is damaged: {e}", fg="red", bold=True), err=True)
+        sys.exit(2)
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True), err=True)
+        sys.exit(2)
+
+
+@cli.command()
+@click.argument('path', required=True)
+@click.option('--privkey', default="", help='(optional) specify the private key (RSA or ECC)')
+@click.option('--aes', 'use_password', is_flag=True, default=False,
+              help="(optional, bool=False) verify files encrypted with a password (encrypt-aes), the password is asked")
+@click.option('--no-nested', is_flag=True, default=False,
+              help="(optional, bool=False) in case PATH is a folder, specify it to avoid verifying the nested folders")
+@click.option('--jobs', '-j', type=click.IntRange(min=0), default=0,
+              help="(optional, int=0) in case PATH is a folder, number of processes to use (0 to use all the CPUs)")
+@folder_filters
+@pass_config
+def verify(config, path, privkey, use_password, no_nested, jobs, filters):
+    """Verify that encrypted files or folders decrypt correctly, without writing the decrypted files"""
+    from pycryptex.crypto import common
+    from pycryptex.crypto.aes import AESCryptex
+    # test first for file/folder existence
+    if not utils.is_valid_path(path):
+        return
+    try:
+        key_agent = connect_agent(config)
+        if use_password:
+            cryptex = AESCryptex()
+            if key_agent is not None and key_agent.has_password():
+                cryptex.agent = key_agent
+                kwargs = {"pwd": None}
+            else:
+                kwargs = {"pwd": getpass("Please insert your passphrase: ")}
+        else:
+            privkey = load_key(privkey, 'private-key', 'pycryptex_key')
+            cryptex, passphrase = private_key_cryptex(privkey, key_agent)
+            kwargs = {"private_key": privkey, "passprhase": passphrase}
+        if os.path.isdir(path):
+            verify_folder(cryptex.decrypt_stream, path, no_nested, jobs, filters, **kwargs)
+        else:
+            f, done = common.verify_file(path, cryptex.decrypt_stream, **kwargs)
+            if done:
+                click.echo(click.style(f"👍 File {f} verified successfully!", fg="green", bold=True))
+            else:
+                click.echo(click.style(f"● Nothing to do, {f} is not an encrypted file!", fg="white", bold=False))
     except Exception as e:
         click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True))
         sys.exit(2)
 
 
 @cli.command()
+@click.option('--type', 'key_type', type=click.Choice(("rsa", "ecc"), case_sensitive=False), default="rsa",
+              help="(optional, str=rsa) type of the keys: rsa (RSA-2048) or ecc (NIST P-256, faster to create and "
+                   "to decrypt, with smaller files)")
 @pass_config
-def create_keys(config):
+def create_keys(config, key_type):
     """
-    Create RSA public/private keys pair into the
+    Create RSA or ECC public/private keys pair into the
     '$HOME/.pycryptex' folder.
     """
+    from pycryptex.crypto import keys
     try:
         # does keys exist in the target folder?
         is_created, pycryptex_folder = utils.create_home_folder()
@@ -165,7 +486,7 @@ def create_keys(config):
                 if passphrase != passprhase2:
                     raise Exception('passwords doesn\'t match!')
             # creation of the keys
-            RSACryptex.create_keys(pycryptex_folder, passphrase)
+            keys.KEY_TYPES[key_type.lower()].create_keys(pycryptex_folder, passphrase)
             click.echo(
                 click.style("New keys created successfully! Now you can use the other commands, happy encryption!",
                             fg="green", bold=True))
@@ -214,13 +535,21 @@ def show_config(config):
 @click.option('--no-nested', is_flag=True, default=False,
               help="(optional, bool=False) in case FILE is a folder, specify it to avoid encryption of "
                    "the nested folders")
+@folder_options
+@encryption_options
+@folder_filters
 @pass_config
-def encrypt_aes(config, file, keep, no_nested):
+def encrypt_aes(config, file, keep, no_nested, jobs, archive, sync, checksum, pipelined, cipher, resume,
+                compress, filters):
     """Encrypt files or folders using AES encryption"""
+    from pycryptex.internal.manifest import Manifest
     try:
-        encrypt_decrypt_aes(config, file, keep, no_nested, True)
+        check_archive_options(archive, sync, resume, filters)
+        encrypt_decrypt_aes(config, file, keep, no_nested, True, jobs, archive,
+                            Manifest(file, checksum) if sync and os.path.isdir(file) else None, pipelined, cipher,
+                            resume, filters, compress)
     except Exception as e:
-        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True))
+        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True), err=file == "-")
         sys.exit(2)
 
 
@@ -231,20 +560,270 @@ def encrypt_aes(config, file, keep, no_nested):
 @click.option('--no-nested', is_flag=True, default=False,
               help="(optional, bool=False) in case FILE is a folder, specify it to avoid decryption of "
                    "the nested folders")
+@folder_options
+@folder_filters
 @pass_config
-def decrypt_aes(config, file, keep, no_nested):
+def decrypt_aes(config, file, keep, no_nested, jobs, pipelined, resume, filters):
     """Decrypt files or folders using AES encryption"""
     try:
-        encrypt_decrypt_aes(config, file, keep, no_nested, False)
+        encrypt_decrypt_aes(config, file, keep, no_nested, False, jobs, pipelined=pipelined, resume=resume,
+                            filters=filters)
     except ValueError as e:
         click.echo(click.style(f"Houston, help: it is possible that the password you used is incorrect! [{e}]",
-                               fg="red", bold=True))
+                               fg="red", bold=True), err=file == "-")
+        sys.exit(2)
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True), err=file == "-")
         sys.exit(2)
+
+
+@cli.command()
+@click.option('--output', '-o', default="",
+              help="(optional) file where to save the results as JSON, use '-' to print them on the standard output")
+@click.option('--baseline', '-b', default="", help="(optional) JSON results of a previous run to compare with")
+@click.option('--tolerance', default=10.0, show_default=True,
+              help="(optional) slowdown in percentage over which a benchmark is a regression")
+@click.option('--scale', default=1.0, show_default=True,
+              help="(optional) factor applied to the number and size of the files of the corpus")
+@click.option('--repeat', default=3, show_default=True, help="(optional) number of repetitions of every benchmark")
+@click.option('--only', default="", help="(optional) run only the benchmarks whose name starts with this prefix")
+@pass_config
+def bench(config, output, baseline, tolerance, scale, repeat, only):
+    """
+    Run the benchmarks of the crypto, I/O and deletion paths on a synthetic corpus
+    and print MB/s and files/s of each one.
+    """
+    import json
+    try:
+        from pycryptex import bench as benchmarks
+        results = benchmarks.run(scale, repeat, only,
+                                 progress=lambda name: click.echo(click.style(f"● running {name}...", fg="magenta"),
+                                                                  err=output == "-"))
+        if output == "-":
+            click.echo(json.dumps(results, indent=2))
+        else:
+            for name, result in results['results'].items():
+                if 'mb_s' in result:
+                    click.echo(f"{name:<36} {result['mb_s']:>10.2f} MB/s {result['files_s']:>12.2f} files/s")
+                elif 'files_s' in result:
+                    click.echo(f"{name:<36} {result['seconds'] * 1000:>10.2f} ms   {result['files_s']:>12.2f} files/s")
+                else:
+                    click.echo(f"{name:<36} {result['seconds'] * 1000:>10.2f} ms   "
+                               f"{result['import_seconds'] * 1000:>10.2f} ms of imports")
+            if output:
+                benchmarks.save(results, output)
+                click.echo(click.style(f"👍 Results saved in {output}", fg="green", bold=True))
+        if baseline:
+            regressions = 0
+            for name, base_value, value, change, regression, unit in benchmarks.compare(
+                    results, benchmarks.load(baseline), tolerance):
+                regressions += regression
+                click.echo(click.style(f"{name:<36} {base_value:>10.2f} -> {value:>10.2f} {unit} ({change:+.1f}%)",
+                                       fg="red" if regression else "green", bold=regression), err=output == "-")
+            if regressions:
+                click.echo(click.style(f"● {regressions} benchmarks are slower than the baseline", fg="red",
+                                       bold=True), err=output == "-")
+                sys.exit(2)
     except Exception as e:
         click.echo(click.style(f"● Houston, help: {e}, {type(e)}", fg="red", bold=True))
         sys.exit(2)
 
 
+@cli.group('agent')
+def agent_group():
+    """
+    Manage the pycryptex agent that keeps in memory the unlocked private keys
+    and the AES password, so the passphrase is asked only once per session.
+    """
+
+
+@agent_group.command('start')
+@click.option('--ttl', default=None, type=click.IntRange(min=1),
+              help="(optional, int=3600) seconds the keys and the password are kept in memory")
+@click.option('--socket', 'socket_file', default="",
+              help="(optional) path of the agent socket (default $PYCRYPTEX_AGENT_SOCK or $HOME/.pycryptex/agent.sock)")
+@click.option('--foreground', '-f', is_flag=True, default=False,
+              help="(optional, bool=False) if specified, do not run the agent in background")
+@pass_config
+def agent_start(config, ttl, socket_file, foreground):
+    """
+    Start the agent. The output can be evaluated by the shell to export the socket path:
+    eval $(pycryptex agent start)
+    """
+    from pycryptex.internal import agent
+    try:
+        if not socket_file:
+            utils.create_home_folder()
+        socket_file = os.path.abspath(socket_file or agent.socket_path())
+        server = agent.AgentServer(socket_file, ttl or agent.DEFAULT_TTL)
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}", fg="red", bold=True))
+        sys.exit(2)
+    if not foreground and hasattr(os, 'fork'):
+        pid = os.fork()
+        if pid > 0:
+            # the agent runs in the child process, the socket is closed only in the parent
+            server.socket.close()
+            click.echo(f"{agent.ENV_SOCKET}={socket_file}; export {agent.ENV_SOCKET};")
+            click.echo(f"echo Agent pid {pid};")
+            return
+        os.setsid()
+        with open(os.devnull, 'r+b') as devnull:
+            for fd in (0, 1, 2):
+                os.dup2(devnull.fileno(), fd)
+    else:
+        click.echo(click.style(f"● Agent listening on {socket_file}", fg="green", bold=True))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    if not foreground and hasattr(os, 'fork'):
+        os._exit(0)
+
+
+@agent_group.command('stop')
+@pass_config
+def agent_stop(config):
+    """Stop the agent, forgetting all the keys"""
+    from pycryptex.internal import agent
+    key_agent = agent.connect()
+    if key_agent is None:
+        click.echo(click.style("● Nothing to do, the agent is not running", fg="white", bold=False))
+        return
+    key_agent.request('stop')
+    click.echo(click.style("👍 Agent stopped", fg="green", bold=True))
+
+
+@agent_group.command('status')
+@pass_config
+def agent_status(config):
+    """Show the keys loaded into the agent"""
+    from pycryptex.internal import agent
+    key_agent = agent.connect()
+    if key_agent is None:
+        click.echo(click.style("● The agent is not running", fg="white", bold=False))
+        return
+    status = key_agent.status()
+    click.echo(f"Agent socket: {key_agent.path} (ttl {status['ttl']} secs)")
+    for key in status['keys']:
+        click.echo(f"private key: {key} ({status.get('types', {}).get(key, 'rsa').upper()})")
+    click.echo(f"password: {'saved' if status['password'] else 'not saved'}")
+
+
+@agent_group.command('add')
+@click.option('--privkey', default="", help='(optional) specify the private key (RSA or ECC)')
+@pass_config
+def agent_add(config, privkey):
+    """Unlock a private key and add it to the agent"""
+    from pycryptex.crypto.rsa import RSACryptex
+    try:
+        key_agent = require_agent()
+        privkey = load_key(privkey, 'private-key', 'pycryptex_key')
+        passphrase = None
+        if RSACryptex.is_privatekey_protected(privkey):
+            passphrase = getpass("Please insert your passphrase: ")
+        key_agent.add_key(privkey, passphrase)
+        click.echo(click.style(f"👍 Key {privkey} added to the agent", fg="green", bold=True))
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}", fg="red", bold=True))
+        sys.exit(2)
+
+
+@agent_group.command('add-password')
+@pass_config
+def agent_add_password(config):
+    """Save the password for encrypt-aes and decrypt-aes into the agent"""
+    try:
+        key_agent = require_agent()
+        key_agent.add_password(getpass("Please insert your passphrase: "))
+        click.echo(click.style("👍 Password saved into the agent", fg="green", bold=True))
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}", fg="red", bold=True))
+        sys.exit(2)
+
+
+@agent_group.command('lock')
+@pass_config
+def agent_lock(config):
+    """Remove all the keys and the password from the agent"""
+    try:
+        require_agent().request('lock')
+        click.echo(click.style("👍 Keys and password removed from the agent", fg="green", bold=True))
+    except Exception as e:
+        click.echo(click.style(f"● Houston, help: {e}", fg="red", bold=True))
+        sys.exit(2)
+
+
+def private_key_cryptex(privkey: str, key_agent, pipe: bool = False):
+    """
+    Return the crypto object of the private key (RSACryptex or ECCCryptex, by the type of the key) and the
+    passphrase of the key: None if the key is not protected or it is unlocked into the agent (used by the object).
+    """
+    from pycryptex.crypto import keys
+    from pycryptex.crypto.rsa import RSACryptex
+    # if the private key is unlocked into the agent there is no need to ask for the passphrase
+    if key_agent is not None and key_agent.has_key(privkey):
+        cryptex = keys.new_cryptex(key_agent.key_type(privkey))
+        cryptex.agent = key_agent
+        return cryptex, None
+    passphrase = None
+    # check if the private key has a password
+    if RSACryptex.is_privatekey_protected(privkey):
+        passphrase = ask_secret("Please insert your passphrase: ", pipe=pipe)
+    return keys.private_key_cryptex(privkey, passphrase), passphrase
+
+
+def require_agent():
+    from pycryptex.internal import agent
+    key_agent = agent.connect()
+    if key_agent is None:
+        raise Exception("the agent is not running, start it with: eval $(pycryptex agent start)")
+    return key_agent
+
+
+def connect_agent(config):
+    """
+    Return the client of the agent if it is running, None otherwise.
+    """
+    from pycryptex.internal import agent
+    key_agent = agent.connect()
+    if key_agent is not None and config.verbose:
+        click.echo(click.style(f"using the pycryptex agent on {key_agent.path}", fg="magenta", bold=False), err=True)
+    return key_agent
+
+
+def add_to_agent(config, func, *args):
+    """
+    Add a key or a password to the agent, an error doesn't stop the command
+    (e.g. a wrong passphrase is reported by the decryption).
+    """
+    try:
+        func(*args)
+    except Exception as e:
+        if config.verbose:
+            click.echo(click.style(f"the agent refused the key: {e}", fg="magenta", bold=False), err=True)
+
+
+def cipher_suite(cipher: str = None) -> int:
+    """
+    Return the cipher suite to encrypt: the one passed with --cipher or the one set into the config file.
+    """
+    from pycryptex.crypto import stream
+    if cipher:
+        return stream.suite_from_name(cipher)
+    return stream.suite_from_config(pycryptex.config_file.get('config', {}))
+
+
+def compression_algorithm(compress: str = None) -> int:
+    """
+    Return the compression algorithm to encrypt: the one passed with --compress or the one set into the config file.
+    """
+    from pycryptex.crypto import compression
+    if compress:
+        return compression.compression_from_name(compress)
+    return compression.compression_from_config(pycryptex.config_file.get('config', {}))
+
+
 def load_key(key_path: str, key_config_name: str, key_default: str) -> str:
     """
     PyCryptex try to load the RSA private or public keys
@@ -275,59 +854,236 @@ def load_key(key_path: str, key_config_name: str, key_default: str) -> str:
 
 
 @timer
-def encrypt_decrypt_folder(func, is_encrypt: bool, folder: str, keep: bool, no_nested: bool = False, **kwargs):
+def encrypt_decrypt_folder(func, is_encrypt: bool, folder: str, keep: bool, no_nested: bool = False, jobs: int = 1,
+                           manifest=None, pipelined: bool = False, resume: bool = False, filters: dict = None,
+                           **kwargs):
     """
-    Function to encrypt or decrypt a folder.
+    Function to encrypt or decrypt a folder. An error on a file doesn't stop the others, all the errors
+    are reported at the end.
+    :param func: function that encrypts/decrypts a reader into a writer
     :param is_encrypt:
     :param folder: folder path
-    :param key:
     :param keep:
-    :param passprhase:
-    :return:
+    :param no_nested:
+    :param jobs: number of processes to use (0 to use all the CPUs)
+    :param manifest: (optional) manifest of the --sync mode, only the files changed since the last run are encrypted
+    :param pipelined: True to use the pipelined engine (see pipeline.Pipeline) instead of the pool of processes
+    :param resume: True to skip the files completed by an interrupted run (see journal.Journal)
+    :param filters: (optional) arguments of ignore.Rules selecting the files (see folder_filters)
+    :return: the number of files encrypted/decrypted (the files skipped, e.g. not encrypted, are not counted)
     """
-    click.echo(click.style(f"● Collecting folder files...", fg="magenta", bold=True))
-    total = utils.count_file(folder, no_nested)
+    from tqdm import tqdm
+    from pycryptex.crypto.common import PARTIAL_SUFFIX
+    from pycryptex.internal import parallel, pipeline
+    from pycryptex.internal.journal import Journal, operation
+    from pycryptex.internal.scanner import Scanner
+    # every completed file is recorded, an interrupted run can be continued with --resume (with the same engine
+    # and keys)
+    key_files = kwargs.get('public_key') or kwargs.get('private_key') or ()
+    journal = Journal(folder, operation(func, [key_files] if isinstance(key_files, str) else key_files), resume)
+    if journal.interrupted and not resume:
+        click.echo(click.style("● Found the journal of an interrupted run, starting from scratch (use --resume to "
+                               "skip the files already completed)", fg="white", bold=False))
+    processed = 0
+
+    def record(file: str):
+        nonlocal processed
+        journal.record(file)
+        # the files completed include the ones skipped (e.g. the clear files when decrypting)
+        if file.endswith(".pycpx") != is_encrypt:
+            processed += 1
+
+    # the folder is walked in background, the files are processed while the walk is still running
+    scanner = Scanner(folder, no_nested, rules=folder_rules(folder, filters))
+    try:
+        with tqdm(total=0, desc='encryption state' if is_encrypt else 'decryption state') as pbar:
+            def folder_files():
+                for entry in scanner:
+                    # the total grows as the walk goes on
+                    pbar.total = scanner.count
+                    if journal.ignored(entry.path) or entry.path.endswith(PARTIAL_SUFFIX) or journal.done(entry.path):
+                        pbar.update()
+                        continue
+                    if manifest is not None and (manifest.ignored(entry.path) or not manifest.changed(entry)):
+                        pbar.update()
+                        continue
+                    yield entry.path
+
+            cache_stats = {}
+            if pipelined:
+                if jobs != 1:
+                    raise Exception("--pipeline can't be used with --jobs")
+                utils.read_config()
+                config_file = pycryptex.config_file.get('config', {})
+                cryptex = func.__self__
+                errors = pipeline.process_files(folder_files(), cryptex, is_encrypt, remove=not keep,
+                                                read_ahead=int(config_file.get('pipeline-read-ahead',
+                                                                               pipeline.DEFAULT_READ_AHEAD)),
+                                                write_behind=int(config_file.get('pipeline-write-behind',
+                                                                                 pipeline.DEFAULT_WRITE_BEHIND)),
+                                                threads=int(config_file.get('pipeline-threads', 0)),
+                                                progress=pbar.update, completed=record, **kwargs)
+                cache_stats.update(cryptex.cache_stats())
+            else:
+                errors = parallel.process_files(folder_files(), func, is_encrypt, remove=not keep, jobs=jobs,
+                                                progress=pbar.update, stats=cache_stats,
+                                                completed=record, **kwargs)
+    except BaseException:
+        # the journal is kept, the run can be continued with --resume
+        journal.close(completed=False)
+        raise
+    journal.close(completed=not errors)
+    total = scanner.count
     click.echo(click.style(f"Number of files read in {folder} are: {total}", fg="white", bold=True))
-    with tqdm(total=total, desc='encryption state' if is_encrypt else 'decryption state') as pbar:
-        # in case of no_nested uses the simple read of the first level directory, otherwise walks into all the
-        # nested levels
-        if no_nested:
-            currentDirectory = Path(folder)
-            for currentFile in currentDirectory.iterdir():
-                if currentFile.is_file():
-                    if is_encrypt:
-                        common.encrypt_file(str(currentFile), func, remove=not keep, **kwargs)
-                    else:
-                        common.decrypt_file(str(currentFile), func, remove=not keep, **kwargs)
-                    pbar.update(1)
-        else:
-            for root, dir_names, file_names in os.walk(folder):
-                for f in file_names:
-                    if is_encrypt:
-                        common.encrypt_file(os.path.join(root, f), func, remove=not keep, **kwargs)
-                    else:
-                        common.decrypt_file(os.path.join(root, f), func, remove=not keep, **kwargs)
-                    pbar.update(1)
+    if manifest is not None:
+        click.echo(click.style(f"Number of files changed since the last sync: {len(manifest.pending)}",
+                               fg="white", bold=True))
+        manifest.update(errors)
+        manifest.save()
+    if any(cache_stats.values()) and pycryptex.config_params is not None and pycryptex.config_params.verbose:
+        click.echo(click.style(f"key cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses",
+                               fg="magenta", bold=False))
+    if errors:
+        for f, error in errors:
+            click.echo(click.style(f"✗ {f}: {error}", fg="red", bold=False))
+        raise Exception(f"{len(errors)} of {total} files have not been "
+                        f"{'encrypted' if is_encrypt else 'decrypted'}, run again with --resume to retry only them")
+    return processed
+
+
+def folder_rules(folder: str, filters: dict = None):
+    """
+    Return the ignore.Rules of a folder: the filters of the command, the exclude key of the config file and the
+    .pycryptexignore file of the folder.
+    """
+    from pycryptex.internal.ignore import Rules
+    if len(pycryptex.config_file) == 0:
+        utils.read_config()
+    filters = dict(filters or {})
+    filters['exclude'] = list(pycryptex.config_file.get('config', {}).get('exclude', [])) + \
+        list(filters.get('exclude', ()))
+    return Rules(folder, **filters)
+
+
+@timer
+def verify_folder(func, folder: str, no_nested: bool = False, jobs: int = 0, filters: dict = None, **kwargs):
+    """
+    Verify all the encrypted files of a folder, the failures are reported at the end.
+    :param func: function that decrypts a reader into a writer
+    :param folder: folder path
+    :param no_nested:
+    :param jobs: number of processes to use (0 to use all the CPUs)
+    :param filters: (optional) arguments of ignore.Rules selecting the files (see folder_filters)
+    :return:
+    """
+    from tqdm import tqdm
+    from pycryptex.internal import parallel
+    from pycryptex.internal.scanner import Scanner
+    scanner = Scanner(folder, no_nested, rules=folder_rules(folder, filters))
+    # number of encrypted files found
+    encrypted = 0
+    with tqdm(total=0, desc='verification state') as pbar:
+        def folder_files():
+            nonlocal encrypted
+            for entry in scanner:
+                pbar.total = scanner.count
+                if not entry.path.endswith(".pycpx"):
+                    pbar.update()
+                    continue
+                encrypted += 1
+                yield entry.path
+
+        errors = parallel.process_files(folder_files(), func, False, remove=False, jobs=jobs, progress=pbar.update,
+                                        verify=True, **kwargs)
+    click.echo(click.style(f"Number of encrypted files verified in {folder} are: {encrypted}", fg="white",
+                           bold=True))
+    if errors:
+        for f, error in errors:
+            click.echo(click.style(f"✗ {f}: {error}", fg="red", bold=False))
+        raise Exception(f"{len(errors)} of {encrypted} encrypted files are not valid")
+    click.echo(click.style("👍 All the encrypted files are valid!", fg="green", bold=True))
+
+
+@timer
+def encrypt_archive(func, folder: str, keep: bool, **kwargs) -> str:
+    """
+    Encrypt the folder into a single container, see archive.encrypt_folder.
+    :param func: function that returns a stream encrypting into a writer (e.g. RSACryptex.create_stream)
+    :return: the name of the encrypted file
+    """
+    from pycryptex.crypto import archive
+    return archive.encrypt_folder(folder, func, remove=not keep, **kwargs)
+
+
+@timer
+def decrypt_archive(func, file: str, keep: bool, **kwargs) -> str:
+    """
+    Decrypt a container created with --archive, see archive.decrypt_archive.
+    :param func: function that returns the header and the decrypted stream of a reader (e.g. RSACryptex.open_stream)
+    :return: the folder extracted
+    """
+    from pycryptex.crypto import archive
+    return archive.decrypt_archive(file, func, remove=not keep, **kwargs)
 
 
-def encrypt_decrypt_aes(config, file, keep, no_nested, is_encryption: bool):
+def encrypt_decrypt_aes(config, file, keep, no_nested, is_encryption: bool, jobs: int = 1, is_archive: bool = False,
+                        manifest=None, pipelined: bool = False, cipher: str = None, resume: bool = False,
+                        filters: dict = None, compress: str = None):
     """Encrypt or decrypt a file using AES encryption"""
-    # test first for file/folder existence
-    if not utils.is_valid_path(file):
+    from pycryptex.crypto import common, archive
+    from pycryptex.crypto.aes import AESCryptex, kdf_from_config
+    # test first for file/folder existence ("-" is the standard input)
+    if file != "-" and not utils.is_valid_path(file):
         return
-    passphrase = getpass("Please insert your passphrase: ")
-    aes = AESCryptex()
+    utils.read_config()
+    aes = AESCryptex(kdf=kdf_from_config(pycryptex.config_file.get('config', {})), suite=cipher_suite(cipher),
+                     compression=compression_algorithm(compress) if is_encryption else 0)
+    key_agent = None
+    if is_encryption:
+        # the password is always asked (twice) to encrypt: a mistyped or cached password would lock the new files
+        passphrase = ask_secret("Please insert your passphrase: ", pipe=file == "-")
+        if passphrase != ask_secret("Please confirm your passphrase: ", pipe=file == "-"):
+            raise Exception("passwords doesn't match!")
+    else:
+        # if the password is saved into the agent there is no need to ask for it
+        key_agent = connect_agent(config)
+        if key_agent is not None and key_agent.has_password():
+            passphrase = None
+            aes.agent = key_agent
+            click.echo(click.style("● Using the password saved into the pycryptex agent", fg="white", bold=False),
+                       err=True)
+        else:
+            passphrase = ask_secret("Please insert your passphrase: ", pipe=file == "-")
+    # True when the password has been verified decrypting at least a file
+    verified = False
     # set var for encryption or decryption
-    crypto_func = aes.decrypt_data
+    crypto_func = aes.decrypt_stream
     crypto_term = "decrypted"
     if is_encryption:
         crypto_term = "encrypted"
-        crypto_func = aes.encrypt_data
+        crypto_func = aes.encrypt_stream
 
     # check if the file param is a file or a dir
-    if os.path.isdir(file):
-        encrypt_decrypt_folder(crypto_func, is_encryption, folder=file, keep=keep, no_nested=no_nested,
-                               pwd=passphrase)
+    if file == "-":
+        # pipe mode: the standard input is encrypted/decrypted on the standard output
+        common.process_stream(*pipe_streams(), crypto_func, "encrypt" if is_encryption else "decrypt",
+                              pwd=passphrase)
+        verified = True
+    elif os.path.isdir(file) and is_encryption and is_archive:
+        f = encrypt_archive(aes.create_stream, file, keep, pwd=passphrase)
+        click.echo(click.style(f"👍 Folder {crypto_term} successfully in {f}", fg="green", bold=True))
+    elif not is_encryption and file.endswith(".pycpx") and archive.is_archive(file):
+        f = decrypt_archive(aes.open_stream, file, keep, pwd=passphrase)
+        verified = True
+        click.echo(click.style(f"👍 Folder {crypto_term} successfully in {f}", fg="green", bold=True))
+    elif os.path.isdir(file):
+        processed = encrypt_decrypt_folder(crypto_func, is_encryption, folder=file,
+                                           keep=keep or manifest is not None, no_nested=no_nested, jobs=jobs,
+                                           manifest=manifest, pipelined=pipelined, resume=resume, filters=filters,
+                                           pwd=passphrase)
+        # the files that can't be decrypted are reported as errors (the folder fails), the password is verified
+        # only if at least a file has been authenticated and decrypted
+        verified = processed > 0
         click.echo(click.style(f"👍 Folder {crypto_term} successfully!", fg="green", bold=True))
     else:
         # encryption/decryption of the file
@@ -335,13 +1091,18 @@ def encrypt_decrypt_aes(config, file, keep, no_nested, is_encryption: bool):
             f, done = common.encrypt_file(file, crypto_func, remove=not keep, pwd=passphrase)
         else:
             f, done = common.decrypt_file(file, crypto_func, remove=not keep, pwd=passphrase)
+            verified = done
         if done:
             click.echo(click.style(f"👍 File {crypto_term} successfully in {f}", fg="green", bold=True))
         else:
             click.echo(click.style(f"● Nothing to do, file already {crypto_term}!", fg="white", bold=False))
+    # the password is added to the agent only when a decryption has verified it
+    if key_agent is not None and aes.agent is None and verified:
+        add_to_agent(config, key_agent.add_password, passphrase)
 
     if config.verbose:
-        click.echo(click.style(f"config_file loaded: {pycryptex.config_file}", fg="magenta", bold=True))
+        click.echo(click.style(f"config_file loaded: {pycryptex.config_file}", fg="magenta", bold=True),
+                   err=file == "-")
 
 
 if __name__ == '__main__':
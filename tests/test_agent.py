@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import pytest
+from click.testing import CliRunner
+from pycryptex.main import cli
+from pycryptex.crypto.aes import AESCryptex
+from pycryptex.internal import agent
+
+
+@pytest.fixture
+def agent_server(tmp_path, monkeypatch):
+    path = str(tmp_path / "agent.sock")
+    monkeypatch.setenv(agent.ENV_SOCKET, path)
+    server = agent.AgentServer(path, ttl=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_agent_decrypt(agent_server, tmp_path):
+    """
+    After the first decryption the key is kept by the agent, that decrypts the session keys of the next files.
+    """
+    runner = CliRunner()
+    for i in range(2):
+        (tmp_path / f"file{i}.txt").write_text(f"secret {i}")
+        runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', str(tmp_path / f"file{i}.txt")])
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', str(tmp_path / "file0.txt.pycpx")])
+    assert result.exit_code == 0
+    client = agent.connect()
+    assert client.has_key('encryption_area/id_rsa')
+    result = runner.invoke(cli, ['--verbose', 'decrypt', '--privkey', 'encryption_area/id_rsa',
+                                 str(tmp_path / "file1.txt.pycpx")])
+    assert result.exit_code == 0
+    assert "using the pycryptex agent" in result.output
+    assert (tmp_path / "file1.txt").read_text() == "secret 1"
+    # the key expires after the ttl
+    time.sleep(1.1)
+    assert not client.has_key('encryption_area/id_rsa')
+
+
+def test_agent_password(agent_server):
+    enc_data = AESCryptex().encrypt_data(b"Python test", 'test')
+    client = agent.connect()
+    client.add_password('test')
+    aes = AESCryptex()
+    aes.agent = client
+    assert aes.decrypt_data(enc_data, None) == b"Python test"
+    client.request('lock')
+    with pytest.raises(Exception):
+        client.derive(os.urandom(32), AESCryptex().kdf)
+
+
+def test_agent_not_running(tmp_path, monkeypatch):
+    monkeypatch.setenv(agent.ENV_SOCKET, str(tmp_path / "missing.sock"))
+    assert agent.connect() is None
+
+
+def test_agent_ecc_key(agent_server, tmp_path):
+    from pycryptex.crypto.ecc import ECCCryptex
+    ECCCryptex.create_keys(str(tmp_path), "passphrase")
+    enc_data = ECCCryptex().encrypt_data(b"Python test", str(tmp_path / "pycryptex_key.pub"))
+    client = agent.connect()
+    client.add_key(str(tmp_path / "pycryptex_key"), "passphrase")
+    assert client.key_type(str(tmp_path / "pycryptex_key")) == "ecc"
+    ecc = ECCCryptex()
+    ecc.agent = client
+    assert ecc.decrypt_data(enc_data, str(tmp_path / "pycryptex_key")) == b"Python test"
+
+
+def test_agent_aes_password(agent_server, tmp_path):
+    """
+    encrypt-aes always asks the password (with confirmation), the password is saved into the agent only
+    after a successful decryption.
+    """
+    # the password must not expire during the test
+    agent_server.agent.ttl = 60
+    runner = CliRunner()
+    (tmp_path / "file.txt").write_text("secret")
+    result = runner.invoke(cli, ['encrypt-aes', str(tmp_path / "file.txt")], input="test\nother\n")
+    assert result.exit_code == 2 and "doesn't match" in result.output
+    result = runner.invoke(cli, ['encrypt-aes', str(tmp_path / "file.txt")], input="test\ntest\n")
+    assert result.exit_code == 0
+    client = agent.connect()
+    assert not client.has_password()
+    result = runner.invoke(cli, ['decrypt-aes', '--keep', str(tmp_path / "file.txt.pycpx")], input="wrong\n")
+    assert result.exit_code == 2
+    assert not client.has_password()
+    # a folder without encrypted files doesn't verify the password
+    (tmp_path / "clear").mkdir()
+    (tmp_path / "clear" / "file.txt").write_text("clear")
+    result = runner.invoke(cli, ['decrypt-aes', str(tmp_path / "clear")], input="wrong\n")
+    assert result.exit_code == 0
+    assert not client.has_password()
+    result = runner.invoke(cli, ['decrypt-aes', '--keep', str(tmp_path / "file.txt.pycpx")], input="test\n")
+    assert result.exit_code == 0
+    assert client.has_password()
+    result = runner.invoke(cli, ['decrypt-aes', str(tmp_path / "file.txt.pycpx")])
+    assert result.exit_code == 0
+    assert "Using the password saved into the pycryptex agent" in result.output
@@ -0,0 +1,57 @@
+from pycryptex import bench
+
+
+def test_bench_run_and_compare():
+    results = bench.run(scale=0.001, repeat=1, only="aes.")
+    assert sorted(results["results"]) == ["aes.decrypt_data", "aes.encrypt_data"]
+    assert all(r["mb_s"] > 0 and r["files_s"] > 0 for r in results["results"].values())
+    # a baseline twice as fast flags a regression
+    baseline = {"results": {name: {"mb_s": r["mb_s"] * 2} for name, r in results["results"].items()}}
+    assert all(row[4] for row in bench.compare(results, baseline, tolerance=10))
+    assert not any(row[4] for row in bench.compare(results, results, tolerance=10))
+
+
+def test_bench_startup():
+    results = bench.run(repeat=1, only="startup.version")
+    assert list(results["results"]) == ["startup.version"]
+    result = results["results"]["startup.version"]
+    assert result["seconds"] > 0 and result["import_seconds"] > 0
+    baseline = {"results": {"startup.version": {"seconds": result["seconds"] / 2}}}
+    assert bench.compare(results, baseline, tolerance=10)[0][4:] == (True, "ms")
+
+
+def test_bench_startup_calls():
+    """
+    The startup benchmarks of the commands make a real call, importing the modules the command needs.
+    """
+    results = bench.run(repeat=1, only="startup.")["results"]
+    assert {"startup.encrypt", "startup.decrypt", "startup.cat", "startup.verify"} <= set(results)
+    assert "startup.create-keys.help" in results
+    assert results["startup.encrypt"]["import_seconds"] > results["startup.help"]["import_seconds"]
+
+
+def test_lazy_imports():
+    """
+    Loading the CLI doesn't import the crypto modules, tqdm, toml and subprocess.
+    """
+    import subprocess
+    import sys
+    code = ("import sys; import pycryptex.main; "
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in ('Crypto', 'tqdm', 'toml', 'subprocess')))")
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True).stdout
+    assert output.strip() == b"[]"
+
+
+def test_bench_keys_compare():
+    """
+    The benchmarks without bytes processed (keys.*.create) are compared by seconds.
+    """
+    results = bench.run(scale=0.01, repeat=1, only="keys.")
+    assert {"keys.rsa.create", "keys.ecc.create"} <= set(results["results"])
+    assert "mb_s" not in results["results"]["keys.ecc.create"]
+    rows = {row[0]: row for row in bench.compare(results, results, tolerance=10)}
+    assert rows["keys.ecc.create"][5] == "ms" and rows["keys.ecc.decrypt_tiny"][5] == "MB/s"
+    assert not any(row[4] for row in rows.values())
+    # a zero value in the baseline is not compared
+    baseline = {"results": {name: {"seconds": 0, "mb_s": 0} for name in results["results"]}}
+    assert bench.compare(results, baseline) == []
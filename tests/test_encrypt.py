@@ -1,8 +1,11 @@
 import os
+import pytest
 from click.testing import CliRunner
 from Crypto.Hash import SHA256
 from pycryptex.main import cli
-from pycryptex.crypto.aes import AESCryptex
+from pycryptex.crypto.aes import AESCryptex, kdf_from_config
+from pycryptex.crypto.rsa import RSACryptex
+from pycryptex.crypto import common
 
 
 def test_encrypt():
@@ -54,3 +57,438 @@ def test_aes():
     dec_hash_object = SHA256.new(data=dec_data)
     # compare ori HASH and dec HASH
     assert ori_hash_object.hexdigest() == dec_hash_object.hexdigest()
+
+
+def test_folder_jobs(tmp_path):
+    """
+    Encryption/decryption of a folder using a pool of processes, a broken file doesn't stop the others.
+    """
+    runner = CliRunner()
+    for i in range(10):
+        (tmp_path / f"file{i}.txt").write_bytes(os.urandom(1000 * i))
+    clear_hashes = {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in tmp_path.iterdir()}
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--jobs', '2', str(tmp_path)])
+    assert result.exit_code == 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f"{name}.pycpx" for name in clear_hashes)
+    (tmp_path / "broken.txt.pycpx").write_bytes(b"not encrypted")
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', '--jobs', '2', str(tmp_path)])
+    assert result.exit_code == 2
+    assert "broken.txt.pycpx" in result.output
+    # the journal is kept to retry only the failed files with --resume
+    assert {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in tmp_path.iterdir()
+            if p.name not in ("broken.txt.pycpx", ".pycryptex-journal")} == clear_hashes
+    assert (tmp_path / ".pycryptex-journal").exists()
+
+
+def test_rsa_session_keys_cache(tmp_path):
+    """
+    A folder with files encrypted in different runs is decrypted unwrapping every session key only once.
+    """
+    for i, rsa in enumerate((RSACryptex(), RSACryptex(), RSACryptex())):
+        for j in range(2):
+            (tmp_path / f"file{i}{j}.txt").write_bytes(f"run {i} file {j}".encode())
+            common.encrypt_file(str(tmp_path / f"file{i}{j}.txt"), rsa.encrypt_stream, remove=True,
+                                public_key='encryption_area/id_rsa.pub')
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--verbose', 'decrypt', '--privkey', 'encryption_area/id_rsa', str(tmp_path)])
+    assert result.exit_code == 0
+    assert "key cache: 3 hits, 3 misses" in result.output
+    assert (tmp_path / "file21.txt").read_bytes() == b"run 2 file 1"
+    # the cache is bounded
+    rsa = RSACryptex(cache_size=1)
+    for i in range(3):
+        rsa.decrypt_data(RSACryptex().encrypt_data(b"data", 'encryption_area/id_rsa.pub'), 'encryption_area/id_rsa')
+    assert len(rsa.session_keys) == 1 and rsa.cache_stats() == {"hits": 0, "misses": 3}
+
+
+def test_aes_kdf_cache():
+    """
+    Data encrypted in different runs (different salts) and with different key derivations are decrypted
+    deriving every key only once.
+    """
+    enc_list = [AESCryptex().encrypt_data(b"pbkdf2 run 1", 'test'),
+                AESCryptex().encrypt_data(b"pbkdf2 run 2", 'test'),
+                AESCryptex(kdf=kdf_from_config({'kdf': 'scrypt', 'scrypt-cost': 10})).encrypt_data(b"scrypt", 'test')]
+    aes = AESCryptex()
+    for _ in range(2):
+        assert [aes.decrypt_data(enc, 'test') for enc in enc_list] == [b"pbkdf2 run 1", b"pbkdf2 run 2", b"scrypt"]
+    assert aes.cache_stats() == {"hits": 3, "misses": 3}
+    with pytest.raises(ValueError):
+        kdf_from_config({'kdf': 'md5'})
+
+
+@pytest.mark.parametrize("kdf", [b"\x02\x14\xff\xff", b"\x02\x0a\x08\x11", b"\x02\x14\x10\x01",
+                                 b"\x01\x02\x05\xf5\xe1\x00"])
+def test_aes_kdf_bounds(kdf):
+    """
+    The key derivation parameters read from a file header are bounded: a crafted file can't ask for scrypt
+    with huge r, p or memory, or for too many PBKDF2 iterations.
+    """
+    from pycryptex.crypto import aes
+    with pytest.raises(ValueError, match="unsupported key derivation"):
+        aes.derive_key("test", b"salt", kdf)
+    with pytest.raises(ValueError):
+        aes.scrypt_params(20, r=255, p=255)
+    with pytest.raises(ValueError):
+        aes.pbkdf2_params(100000000)
+
+
+def test_archive(tmp_path):
+    """
+    A folder encrypted with --archive becomes a single file, decrypting it restores paths, permissions and mtimes.
+    """
+    folder = tmp_path / "conf"
+    (folder / "nested").mkdir(parents=True)
+    for i in range(50):
+        (folder / "nested" / f"file{i}.conf").write_bytes(os.urandom(i * 10))
+    (folder / "run.sh").write_bytes(b"#!/bin/sh\n")
+    os.chmod(folder / "run.sh", 0o750)
+    os.utime(folder / "run.sh", (1000000000, 1000000000))
+    os.symlink("run.sh", folder / "link")
+    clear_hashes = {p.relative_to(folder): SHA256.new(p.read_bytes()).hexdigest() for p in folder.rglob("*")
+                    if p.is_file()}
+    runner = CliRunner()
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--archive', str(folder)])
+    assert result.exit_code == 0
+    assert os.listdir(tmp_path) == ["conf.pycpx"]
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', str(tmp_path / "conf.pycpx")])
+    assert result.exit_code == 0
+    assert os.listdir(tmp_path) == ["conf"]
+    assert {p.relative_to(folder): SHA256.new(p.read_bytes()).hexdigest() for p in folder.rglob("*")
+            if p.is_file()} == clear_hashes
+    assert os.stat(folder / "run.sh").st_mode & 0o777 == 0o750
+    assert os.stat(folder / "run.sh").st_mtime == 1000000000
+    assert os.readlink(folder / "link") == "run.sh"
+
+
+def test_archive_outside_paths(tmp_path):
+    """
+    An archive with paths outside the destination folder is refused.
+    """
+    import io
+    import tarfile
+    from pycryptex.crypto import archive, stream
+    rsa = RSACryptex()
+    with open(tmp_path / "evil.pycpx", "wb") as writer:
+        with rsa.create_stream(writer, 'encryption_area/id_rsa.pub', flags=stream.FLAG_ARCHIVE) as enc_writer:
+            with tarfile.open(fileobj=enc_writer, mode="w|") as tar:
+                info = tarfile.TarInfo("../evil.txt")
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"evil"))
+    with pytest.raises(ValueError):
+        archive.decrypt_archive(str(tmp_path / "evil.pycpx"), RSACryptex().open_stream,
+                                private_key='encryption_area/id_rsa')
+    assert not (tmp_path.parent / "evil.txt").exists()
+
+
+def test_sync(tmp_path):
+    """
+    With --sync only the files new or changed since the last run are encrypted.
+    """
+    runner = CliRunner()
+    for i in range(5):
+        (tmp_path / f"file{i}.txt").write_bytes(f"file {i}".encode())
+    args = ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--sync', '--checksum', str(tmp_path)]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    assert "changed since the last sync: 5" in result.output
+    assert (tmp_path / "file0.txt").exists() and (tmp_path / "file0.txt.pycpx").exists()
+    result = runner.invoke(cli, args)
+    assert "changed since the last sync: 0" in result.output
+    # file1 is changed, file2 is only touched, file3.txt.pycpx is removed and file5 is new
+    (tmp_path / "file1.txt").write_bytes(b"file 1 changed")
+    os.utime(tmp_path / "file2.txt", (1000000000, 1000000000))
+    os.remove(tmp_path / "file3.txt.pycpx")
+    (tmp_path / "file5.txt").write_bytes(b"file 5")
+    result = runner.invoke(cli, args)
+    assert "changed since the last sync: 3" in result.output
+    assert RSACryptex().decrypt_data((tmp_path / "file1.txt.pycpx").read_bytes(),
+                                     'encryption_area/id_rsa') == b"file 1 changed"
+    assert not (tmp_path / ".pycryptex-manifest.json.pycpx").exists()
+    # a normal run doesn't encrypt the manifest, the next --sync still finds it
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--keep', str(tmp_path)])
+    assert result.exit_code == 0
+    assert (tmp_path / ".pycryptex-manifest.json").exists()
+    assert not (tmp_path / ".pycryptex-manifest.json.pycpx").exists()
+
+
+def test_cat(tmp_path):
+    """
+    cat decrypts a range of the file on the standard output.
+    """
+    data = os.urandom(300000)
+    (tmp_path / "big.csv.pycpx").write_bytes(RSACryptex().encrypt_data(data, 'encryption_area/id_rsa.pub'))
+    runner = CliRunner()
+    result = runner.invoke(cli, ['cat', '--privkey', 'encryption_area/id_rsa', '--offset', '131000', '--length', '5000',
+                                 str(tmp_path / "big.csv.pycpx")])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == data[131000:136000]
+    result = runner.invoke(cli, ['cat', '--privkey', 'encryption_area/id_rsa', '--offset', '299990',
+                                 str(tmp_path / "big.csv.pycpx")])
+    assert result.stdout_bytes == data[299990:]
+
+
+def test_stats_and_profile(tmp_path):
+    """
+    --stats reports the phases and the files also from the --jobs workers, --profile writes the cProfile data.
+    """
+    import json
+    import pstats
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    for i in range(4):
+        (folder / f"file{i}.txt").write_bytes(os.urandom(100000))
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--stats', str(tmp_path / "stats.json"), '--profile', str(tmp_path / "prof"),
+                                 'encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--jobs', '2', str(folder)])
+    assert result.exit_code == 0
+    report = json.loads((tmp_path / "stats.json").read_text())
+    assert report["command"] == "encrypt"
+    assert report["files"]["count"] == 4
+    assert {"walk", "read", "encrypt", "write", "delete", "rsa-wrap"} <= set(report["phases"])
+    assert report["phases"]["read"]["bytes"] == 400000
+    assert pstats.Stats(str(tmp_path / "prof")).total_calls > 0
+
+
+def test_exclusive_phases(tmp_path):
+    """
+    The time of the nested phases (kdf) is not counted again into the encrypt phase.
+    """
+    from pycryptex.internal import metrics
+    (tmp_path / "file.txt").write_bytes(os.urandom(1024))
+    metrics.reset()
+    metrics.enable()
+    try:
+        common.encrypt_file(str(tmp_path / "file.txt"), AESCryptex().encrypt_stream, pwd='test')
+        phases = metrics.report()["phases"]
+    finally:
+        metrics.enable(False)
+        metrics.reset()
+    assert phases["encrypt"]["bytes"] == 1024
+    assert phases["encrypt"]["seconds"] < phases["kdf"]["seconds"]
+
+
+def test_stats_mapped_files(tmp_path, monkeypatch):
+    """
+    With --stats the files are still mapped in memory, mapping them is measured into the phase "read".
+    """
+    from pycryptex.crypto import stream
+    from pycryptex.internal import metrics
+    monkeypatch.setattr(stream, "MMAP_MIN_SIZE", 1)
+    windows = []
+    iter_mapped = stream._iter_mapped
+    monkeypatch.setattr(stream, "_iter_mapped", lambda *args: windows.append(args) or iter_mapped(*args))
+    (tmp_path / "file.txt").write_bytes(os.urandom(100000))
+    metrics.reset()
+    metrics.enable()
+    try:
+        common.encrypt_file(str(tmp_path / "file.txt"), AESCryptex().encrypt_stream, pwd='test')
+        phases = metrics.report()["phases"]
+    finally:
+        metrics.enable(False)
+        metrics.reset()
+    assert len(windows) == 1
+    assert phases["read"]["bytes"] == 100000
+
+
+def test_multiple_recipients(tmp_path):
+    """
+    A folder encrypted for two public keys is decrypted by each of the private keys, not by the others.
+    """
+    keys = tmp_path / "keys"
+    other_keys = tmp_path / "other_keys"
+    for folder in (keys, other_keys):
+        folder.mkdir()
+        RSACryptex.create_keys(str(folder))
+    data = tmp_path / "data"
+    data.mkdir()
+    for i in range(3):
+        (data / f"file{i}.txt").write_bytes(os.urandom(100000))
+    clear_hashes = {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in data.iterdir()}
+    runner = CliRunner()
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub',
+                                 '--pubkey', str(keys / "pycryptex_key.pub"), str(data)])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ['decrypt', '--privkey', str(other_keys / "pycryptex_key"), '--keep', str(data)])
+    assert result.exit_code == 2
+    assert "not one of the recipients" in result.output
+    for private_key in ('encryption_area/id_rsa', str(keys / "pycryptex_key")):
+        result = runner.invoke(cli, ['decrypt', '--privkey', private_key, str(data)])
+        assert result.exit_code == 0
+        assert {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in data.iterdir()} == clear_hashes
+        # the encrypted files are restored to decrypt them with the other key
+        for p in list(data.iterdir()):
+            common.encrypt_file(str(p), RSACryptex().encrypt_stream, remove=True,
+                                public_key=['encryption_area/id_rsa.pub', str(keys / "pycryptex_key.pub")])
+
+
+def test_verify(tmp_path):
+    """
+    verify reports the files not authentic without writing the decrypted files.
+    """
+    runner = CliRunner()
+    for i in range(4):
+        (tmp_path / f"file{i}.txt").write_bytes(os.urandom(100000))
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', str(tmp_path)])
+    assert result.exit_code == 0
+    (tmp_path / "clear.txt").write_bytes(b"not encrypted")
+    result = runner.invoke(cli, ['verify', '--privkey', 'encryption_area/id_rsa', '--jobs', '2', str(tmp_path)])
+    assert result.exit_code == 0
+    assert "verified in" in result.output and ": 4" in result.output
+    tampered = bytearray((tmp_path / "file2.txt.pycpx").read_bytes())
+    tampered[-1000] ^= 1
+    (tmp_path / "file2.txt.pycpx").write_bytes(bytes(tampered))
+    names = sorted(p.name for p in tmp_path.iterdir())
+    result = runner.invoke(cli, ['verify', '--privkey', 'encryption_area/id_rsa', '--jobs', '1', str(tmp_path)])
+    assert result.exit_code == 2
+    assert "file2.txt.pycpx" in result.output and "1 of 4" in result.output
+    result = runner.invoke(cli, ['verify', '--privkey', 'encryption_area/id_rsa', str(tmp_path / "file1.txt.pycpx")])
+    assert result.exit_code == 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == names
+
+
+def test_resume(tmp_path):
+    """
+    --resume skips the files completed by the interrupted run, the outputs are written with a temporary name.
+    """
+    from pycryptex.internal.journal import Journal, JOURNAL_NAME, operation
+    runner = CliRunner()
+    for i in range(4):
+        (tmp_path / f"file{i}.txt").write_bytes(os.urandom(1000))
+    # interrupted run: file0 and file1 completed, file2 being written and the last record truncated
+    journal = Journal(str(tmp_path), operation(RSACryptex().encrypt_stream, ['encryption_area/id_rsa.pub']))
+    journal.record(str(tmp_path / "file0.txt"))
+    journal.record(str(tmp_path / "file1.txt"))
+    journal.close(completed=False)
+    with open(tmp_path / JOURNAL_NAME, 'a') as f:
+        f.write('"file2.t')
+    (tmp_path / ("file2.txt.pycpx" + common.PARTIAL_SUFFIX)).write_bytes(b"partial")
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--keep', '--resume',
+                                 str(tmp_path)])
+    assert result.exit_code == 0
+    assert not (tmp_path / "file0.txt.pycpx").exists() and not (tmp_path / "file1.txt.pycpx").exists()
+    assert (tmp_path / "file2.txt.pycpx").exists() and (tmp_path / "file3.txt.pycpx").exists()
+    assert not (tmp_path / ("file2.txt.pycpx" + common.PARTIAL_SUFFIX)).exists()
+    # completed without errors, the journal has been removed
+    assert not (tmp_path / JOURNAL_NAME).exists()
+    # a journal written by a different engine can't be resumed
+    from pycryptex.crypto.ecc import ECCCryptex
+    Journal(str(tmp_path), operation(ECCCryptex().encrypt_stream, ['encryption_area/id_rsa.pub'])).close(
+        completed=False)
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--keep', '--resume',
+                                 str(tmp_path)])
+    assert result.exit_code == 2 and "different operation" in result.output
+    # without --resume the run starts from scratch
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--keep', str(tmp_path)])
+    assert result.exit_code == 0 and "interrupted run" in result.output
+    assert all((tmp_path / f"file{i}.txt.pycpx").exists() for i in range(4))
+    assert not (tmp_path / JOURNAL_NAME).exists()
+
+
+def test_atomic_output(tmp_path):
+    """
+    A failed encryption doesn't leave partial files.
+    """
+    clear = tmp_path / "file.txt"
+    clear.write_bytes(b"data")
+
+    def fail(reader, writer):
+        writer.write(b"partial")
+        raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        common.encrypt_file(str(clear), fail)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["file.txt"]
+
+
+def test_durable_output(tmp_path, monkeypatch):
+    """
+    The new file and its folder are flushed on disk before the original file is removed.
+    """
+    events = []
+    fsync, remove = os.fsync, os.remove
+    monkeypatch.setattr(os, "fsync", lambda fd: events.append("fsync") or fsync(fd))
+    monkeypatch.setattr(os, "remove", lambda path: events.append("remove") or remove(path))
+    clear = tmp_path / "file.txt"
+    clear.write_bytes(b"data")
+    common.encrypt_file(str(clear), RSACryptex().encrypt_stream, remove=True, public_key='encryption_area/id_rsa.pub')
+    assert events == ["fsync", "fsync", "remove"]
+
+
+def test_pipe():
+    """
+    With FILE - the standard input is encrypted/decrypted into the standard output, the messages go to stderr.
+    """
+    runner = CliRunner()
+    data = os.urandom(300000) + b"pycryptex " * 20000
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--compress', 'zlib', '-'],
+                           input=data)
+    assert result.exit_code == 0
+    encrypted = result.stdout_bytes
+    assert encrypted[:5] != data[:5]
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', '-'], input=encrypted)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == data
+    # a truncated stream is not authentic
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', '-'], input=encrypted[:-10])
+    assert result.exit_code == 2
+    assert "Houston" in result.stderr
+
+
+def test_ecc_keys(tmp_path):
+    """
+    Files encrypted with ECC keys: encrypt and decrypt select the engine by the type of the keys.
+    """
+    from pycryptex.crypto import keys, stream
+    from pycryptex.crypto.ecc import ECCCryptex, SLOT_SIZE
+    ecc_keys = tmp_path / "keys"
+    ecc_keys.mkdir()
+    ECCCryptex.create_keys(str(ecc_keys), "passphrase")
+    assert keys.key_type(str(ecc_keys / "pycryptex_key.pub")) == "ecc"
+    assert keys.key_type(str(ecc_keys / "pycryptex_key"), "passphrase") == "ecc"
+    assert keys.key_type('encryption_area/id_rsa') == "rsa"
+    data = tmp_path / "data"
+    data.mkdir()
+    for i in range(3):
+        (data / f"file{i}.txt").write_bytes(os.urandom(100000))
+    clear_hashes = {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in data.iterdir()}
+    runner = CliRunner()
+    result = runner.invoke(cli, ['encrypt', '--pubkey', str(ecc_keys / "pycryptex_key.pub"), '--jobs', '2', str(data)])
+    assert result.exit_code == 0
+    with open(data / "file0.txt.pycpx", 'rb') as f:
+        header, _ = stream.read_header(f)
+    assert header.kind == stream.KIND_ECC and len(header.slots[0]) == SLOT_SIZE
+    # a RSA key can't decrypt them
+    result = runner.invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', '--keep', str(data)])
+    assert result.exit_code == 2
+    result = runner.invoke(cli, ['decrypt', '--privkey', str(ecc_keys / "pycryptex_key"), str(data)],
+                           input="passphrase\n")
+    assert result.exit_code == 0
+    assert {p.name: SHA256.new(p.read_bytes()).hexdigest() for p in data.iterdir()} == clear_hashes
+    # the keys of a file must be of the same type
+    result = runner.invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub',
+                                 '--pubkey', str(ecc_keys / "pycryptex_key.pub"), str(data)])
+    assert result.exit_code == 2
+    assert "same type" in result.output
+
+
+@pytest.mark.parametrize("key_type", ["rsa", "ecc"])
+def test_protected_key_imported_once(tmp_path, monkeypatch, key_type):
+    """
+    Decrypting with a protected private key runs the KDF of the passphrase only once (type selection included).
+    """
+    import Crypto.IO._PBES
+    from pycryptex.crypto import keys
+    keys.KEY_TYPES[key_type].create_keys(str(tmp_path), "passphrase")
+    (tmp_path / "data.txt").write_bytes(os.urandom(1000))
+    runner = CliRunner()
+    result = runner.invoke(cli, ['encrypt', '--pubkey', str(tmp_path / "pycryptex_key.pub"), str(tmp_path / "data.txt")])
+    assert result.exit_code == 0
+    calls = []
+    scrypt = Crypto.IO._PBES.scrypt
+    monkeypatch.setattr(Crypto.IO._PBES, "scrypt", lambda *args, **kwargs: calls.append(1) or scrypt(*args, **kwargs))
+    result = runner.invoke(cli, ['decrypt', '--privkey', str(tmp_path / "pycryptex_key"),
+                                 str(tmp_path / "data.txt.pycpx")], input="passphrase\n")
+    assert result.exit_code == 0
+    assert (tmp_path / "data.txt").exists()
+    assert len(calls) == 1
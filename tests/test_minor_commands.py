@@ -20,3 +20,40 @@ def test_create_config():
         read_config()
     except Exception as e:
         pytest.fail(f"read_config raises an Exception, test FAILED {e}")
+
+
+def test_pager_stops(monkeypatch):
+    """
+    The chunks are written into the pager while they are produced, closing the pager stops the iteration.
+    """
+    import pycryptex
+    from pycryptex.internal import utils
+    monkeypatch.setattr(utils, "read_config", lambda: None)
+    monkeypatch.setattr(pycryptex, "config_file", {"config": {"pager": "head -c 10"}})
+    produced = []
+
+    def chunks():
+        for i in range(10000):
+            produced.append(i)
+            yield b"x" * 65536
+
+    utils.open_pager(pycryptex.Config(), chunks())
+    assert len(produced) < 10000
+
+
+def test_shared_options():
+    """
+    encrypt, decrypt, encrypt-aes and decrypt-aes share the same folder options, the encryption commands the same
+    encryption options.
+    """
+    def options(name):
+        return {param.name: (param.opts, param.help) for param in cli.commands[name].params}
+
+    folder = {"jobs", "pipelined", "resume", "include", "exclude", "min_size", "max_size"}
+    encryption = {"archive", "sync", "checksum", "cipher", "compress"}
+    for name in ("encrypt", "decrypt", "encrypt-aes", "decrypt-aes"):
+        assert folder <= set(options(name))
+    assert {k: v for k, v in options("encrypt").items() if k in folder | encryption} == \
+        {k: v for k, v in options("encrypt-aes").items() if k in folder | encryption}
+    assert {k: v for k, v in options("decrypt").items() if k in folder} == \
+        {k: v for k, v in options("decrypt-aes").items() if k in folder}
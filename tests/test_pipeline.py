@@ -0,0 +1,42 @@
+import os
+from Crypto.Hash import SHA256
+from pycryptex.crypto import common, stream
+from pycryptex.crypto.aes import AESCryptex, kdf_from_config
+from pycryptex.crypto.rsa import RSACryptex
+from pycryptex.internal import pipeline
+
+
+def make_files(folder):
+    sizes = [0, 1, stream.DEFAULT_SEGMENT_SIZE, stream.DEFAULT_SEGMENT_SIZE * 3 + 7] + [100] * 20
+    files = []
+    for i, size in enumerate(sizes):
+        file = folder / f"file{i}.bin"
+        file.write_bytes(os.urandom(size))
+        files.append(str(file))
+    return files, {f: SHA256.new(open(f, 'rb').read()).hexdigest() for f in files}
+
+
+def test_pipeline_rsa(tmp_path):
+    files, hashes = make_files(tmp_path)
+    errors = pipeline.process_files(files, RSACryptex(), True, remove=True, read_ahead=2, write_behind=2, threads=3,
+                                    public_key='encryption_area/id_rsa.pub')
+    assert errors == []
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(f) + ".pycpx" for f in files)
+    # the files are compatible with the sequential engine
+    common.decrypt_file(files[3] + ".pycpx", RSACryptex().decrypt_stream, remove=True,
+                        private_key='encryption_area/id_rsa')
+    (tmp_path / "broken.bin.pycpx").write_bytes(b"not encrypted")
+    completed = []
+    errors = pipeline.process_files([str(p) for p in tmp_path.iterdir()], RSACryptex(), False, remove=True,
+                                    progress=completed.append, private_key='encryption_area/id_rsa')
+    assert [os.path.basename(f) for f, _ in errors] == ["broken.bin.pycpx"]
+    assert len(completed) == len(files)
+    assert {f: SHA256.new(open(f, 'rb').read()).hexdigest() for f in files} == hashes
+
+
+def test_pipeline_aes(tmp_path):
+    files, hashes = make_files(tmp_path)
+    aes = AESCryptex(kdf=kdf_from_config({'pbkdf2-iterations': 1000}))
+    assert pipeline.process_files(files, aes, True, remove=True, pwd='test') == []
+    assert pipeline.process_files([f + ".pycpx" for f in files], AESCryptex(), False, remove=True, pwd='test') == []
+    assert {f: SHA256.new(open(f, 'rb').read()).hexdigest() for f in files} == hashes
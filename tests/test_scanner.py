@@ -0,0 +1,86 @@
+import os
+from pycryptex.internal.scanner import scan, Scanner
+
+
+def make_tree(root):
+    (root / "a" / "b").mkdir(parents=True)
+    for name in ("one.txt", "a/two.txt", "a/b/three.txt", "a/b/four.txt"):
+        (root / name).write_text(name)
+    os.symlink(root / "a", root / "link_to_a")
+
+
+def test_scan(tmp_path):
+    make_tree(tmp_path)
+    found = sorted(os.path.relpath(e.path, tmp_path) for e in scan(str(tmp_path)))
+    assert found == sorted(["one.txt", "a/two.txt", "a/b/three.txt", "a/b/four.txt"])
+    found = [os.path.relpath(e.path, tmp_path) for e in scan(str(tmp_path), no_nested=True)]
+    assert found == ["one.txt"]
+    # the files of pycryptex at the root are never returned
+    (tmp_path / ".pycryptex-manifest.json").write_text("{}")
+    (tmp_path / ".pycryptex-journal").write_text("")
+    (tmp_path / "a" / ".pycryptex-journal").write_text("")
+    found = sorted(os.path.relpath(e.path, tmp_path) for e in scan(str(tmp_path)))
+    assert found == sorted(["one.txt", "a/two.txt", "a/b/three.txt", "a/b/four.txt", "a/.pycryptex-journal"])
+
+
+def test_scanner(tmp_path):
+    make_tree(tmp_path)
+    scanner = Scanner(str(tmp_path))
+    sizes = {os.path.basename(e.path): e.stat().st_size for e in scanner}
+    assert scanner.count == 4
+    assert sizes["three.txt"] == len("a/b/three.txt")
+
+
+def test_scanner_walk_time(tmp_path):
+    """
+    The time waiting for a slow consumer (full queue) is not counted into the phase "walk".
+    """
+    import time
+    from pycryptex.internal import metrics
+    make_tree(tmp_path)
+    metrics.reset()
+    metrics.enable()
+    try:
+        for _ in Scanner(str(tmp_path), maxsize=1):
+            time.sleep(0.1)
+        phases = metrics.report()["phases"]
+    finally:
+        metrics.enable(False)
+        metrics.reset()
+    assert phases["walk"]["calls"] == 4
+    assert phases["walk"]["seconds"] < 0.1
+
+
+def test_rules(tmp_path, monkeypatch):
+    """
+    The excluded folders are pruned without listing them, the files are selected by globs and size.
+    """
+    from pycryptex.internal import scanner
+    from pycryptex.internal.ignore import Rules, parse_size, IGNORE_NAME
+    make_tree(tmp_path)
+    (tmp_path / ".git" / "objects").mkdir(parents=True)
+    (tmp_path / ".git" / "objects" / "pack").write_text("pack")
+    (tmp_path / "a" / "big.log").write_text("x" * 5000)
+    (tmp_path / "a" / "b" / "three.txt.pycpx").write_text("encrypted")
+    (tmp_path / IGNORE_NAME).write_text("# comment\n.git/\n*.log\n")
+    listed = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(scanner.os, "scandir", lambda path: listed.append(path) or real_scandir(path))
+
+    def found(**kwargs):
+        listed.clear()
+        return sorted(os.path.relpath(e.path, tmp_path) for e in scan(str(tmp_path), rules=Rules(str(tmp_path),
+                                                                                                    **kwargs)))
+
+    assert found() == sorted(["one.txt", "a/two.txt", "a/b/three.txt", "a/b/four.txt", "a/b/three.txt.pycpx"])
+    assert str(tmp_path / ".git") not in listed
+    assert found(exclude=["b/"]) == ["a/two.txt", "one.txt"]
+    assert str(tmp_path / "a" / "b") not in listed
+    # the encrypted files are matched with the name of the clear file
+    assert found(include=["three.*"]) == ["a/b/three.txt", "a/b/three.txt.pycpx"]
+    assert found(exclude=["a/b/f*"], max_size=7) == ["one.txt"]
+    # "*" doesn't match "/", "**" matches any number of folders and the globs with "/" start from the root
+    assert found(exclude=["a/*.txt"]) == sorted(["one.txt", "a/b/three.txt", "a/b/four.txt", "a/b/three.txt.pycpx"])
+    assert found(include=["a/**/t*"]) == sorted(["a/two.txt", "a/b/three.txt", "a/b/three.txt.pycpx"])
+    assert found(include=["b/*"]) == []
+    assert parse_size("4K") == 4096 and parse_size("1.5M") == 1572864 and parse_size(None) is None
@@ -0,0 +1,36 @@
+import os
+import pytest
+import pycryptex
+from pycryptex.internal import shred
+from pycryptex.internal.utils import secure_delete
+
+
+def test_strategy_passes():
+    assert shred.strategy_passes("zero") == [shred.ZERO]
+    assert shred.strategy_passes("Random") == [shred.RANDOM]
+    assert shred.strategy_passes(2) == [shred.RANDOM, shred.RANDOM, shred.ZERO]
+    assert shred.strategy_passes("0") == [shred.ZERO]
+    with pytest.raises(ValueError):
+        shred.strategy_passes("fast")
+    with pytest.raises(ValueError):
+        shred.strategy_passes(-1)
+
+
+def test_overwrite(tmp_path):
+    file = tmp_path / "secret.txt"
+    content = b"secret" * 100000
+    file.write_bytes(content)
+    assert shred.overwrite(str(file), [shred.RANDOM], buffer_size=4096) == len(content)
+    random_content = file.read_bytes()
+    assert len(random_content) == len(content) and random_content != content
+    assert shred.overwrite(str(file), [shred.RANDOM, shred.ZERO], buffer_size=4096) == 2 * len(content)
+    assert file.read_bytes() == bytes(len(content))
+
+
+def test_secure_delete(tmp_path):
+    pycryptex.config_params = pycryptex.Config()
+    pycryptex.config_params.verbose = True
+    file = tmp_path / "secret.txt"
+    file.write_bytes(os.urandom(5000))
+    secure_delete(str(file), "random")
+    assert not file.exists()
@@ -0,0 +1,291 @@
+import io
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Random import get_random_bytes
+from pycryptex.crypto import stream
+from pycryptex.crypto.aes import AESCryptex
+from pycryptex.crypto.rsa import RSACryptex
+
+
+def encrypt_segments(data: bytes, segment_size: int) -> bytes:
+    key = b"k" * 32
+    enc = io.BytesIO()
+    header = stream.Header(stream.KIND_AES, [b"salt"], segment_size=segment_size)
+    stream.encrypt(key, header, io.BytesIO(data), enc)
+    return enc.getvalue()
+
+
+def decrypt_segments(enc_data: bytes) -> bytes:
+    reader = io.BytesIO(enc_data)
+    header, _ = stream.read_header(reader)
+    out = io.BytesIO()
+    stream.decrypt(b"k" * 32, header, reader, out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 64, 1000])
+def test_segments_round_trip(size):
+    """
+    Data shorter, equal or multiple of the segment size are encrypted and decrypted correctly.
+    """
+    data = get_random_bytes(size)
+    enc_data = encrypt_segments(data, 16)
+    assert decrypt_segments(enc_data) == data
+
+
+def test_segments_tampering():
+    """
+    Truncated, reordered or modified files are refused.
+    """
+    enc_data = encrypt_segments(b"a" * 64, 16)
+    header_len = len(enc_data) - 4 * (16 + stream.TAG_SIZE)
+    segments = [enc_data[header_len + i * 32:header_len + (i + 1) * 32] for i in range(4)]
+    # drop the last segment
+    with pytest.raises(ValueError):
+        decrypt_segments(enc_data[:header_len] + b"".join(segments[:3]))
+    # swap two segments
+    with pytest.raises(ValueError):
+        decrypt_segments(enc_data[:header_len] + b"".join((segments[1], segments[0], segments[2], segments[3])))
+    # flip a bit in the flags of the header
+    tampered = bytearray(enc_data)
+    tampered[len(stream.MAGIC) + 3] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_segments(bytes(tampered))
+
+
+def test_aes_legacy_format():
+    """
+    Files written by the older versions of pycryptex (salt + nonce + tag + ciphertext) can be decrypted.
+    """
+    salt = get_random_bytes(32)
+    cipher = AES.new(PBKDF2('test', salt, dkLen=32), AES.MODE_EAX)
+    ciphertext, tag = cipher.encrypt_and_digest(b"legacy data")
+    enc_data = salt + cipher.nonce + tag + ciphertext
+    assert AESCryptex().decrypt_data(enc_data, 'test') == b"legacy data"
+    out = io.BytesIO()
+    AESCryptex().decrypt_stream(io.BytesIO(enc_data), out, 'test')
+    assert out.getvalue() == b"legacy data"
+
+
+def test_rsa_stream():
+    """
+    Files encrypted with RSA are written in the chunked format and can be decrypted.
+    """
+    rsa = RSACryptex()
+    enc_data = rsa.encrypt_data(b"rsa data" * 10000, 'encryption_area/id_rsa.pub')
+    assert stream.is_stream(enc_data)
+    assert RSACryptex().decrypt_data(enc_data, 'encryption_area/id_rsa') == b"rsa data" * 10000
+
+
+def test_random_access(monkeypatch):
+    """
+    Reading a range decrypts only the segments covering it.
+    """
+    data = get_random_bytes(1000)
+    enc_data = encrypt_segments(data, 64)
+    opened = []
+    open_segment = stream.open_segment
+    monkeypatch.setattr(stream, "open_segment", lambda key, header, index, *args: opened.append(index) or
+                        open_segment(key, header, index, *args))
+    reader = io.BytesIO(enc_data)
+    header, _ = stream.read_header(reader)
+    clear = stream.SegmentReader(b"k" * 32, header, reader)
+    assert clear.seekable() and clear.size() == 1000
+    clear.seek(130)
+    buffer = bytearray(60)
+    assert clear.readinto(buffer) == 60 and buffer == data[130:190]
+    assert opened == [2]
+    clear.seek(-10, io.SEEK_END)
+    assert io.BufferedReader(clear).read() == data[990:]
+    assert opened == [2, 15]
+    # the last segment is authenticated as last, a file truncated on a segment boundary is refused
+    truncated = io.BytesIO(enc_data[:len(header) + 3 * (64 + stream.TAG_SIZE)])
+    stream.read_header(truncated)
+    clear = stream.SegmentReader(b"k" * 32, header, truncated)
+    clear.seek(150)
+    with pytest.raises(ValueError):
+        clear.read(10)
+
+
+class _Pipe(io.RawIOBase):
+    """
+    Non seekable stream returning few bytes for every read, as a socket.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self.data.read(min(len(buffer), 1000))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_file_objects(tmp_path):
+    """
+    EncryptingWriter/DecryptingReader write and read the same format of the CLI.
+    """
+    from click.testing import CliRunner
+    from pycryptex.crypto import EncryptingWriter, DecryptingReader
+    from pycryptex.main import cli
+    data = get_random_bytes(300000)
+    with open(tmp_path / "data.bin.pycpx", "wb") as f, EncryptingWriter(f, public_key='encryption_area/id_rsa.pub') as enc:
+        for i in range(0, len(data), 7000):
+            enc.write(data[i:i + 7000])
+    result = CliRunner().invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', str(tmp_path / "data.bin.pycpx")])
+    assert result.exit_code == 0
+    assert (tmp_path / "data.bin").read_bytes() == data
+    # password based, read from a non seekable stream
+    enc_data = io.BytesIO()
+    with EncryptingWriter(enc_data, password="pwd") as enc:
+        enc.write(data)
+    assert not enc_data.closed
+    with DecryptingReader(_Pipe(enc_data.getvalue()), password="pwd") as dec:
+        assert not dec.seekable()
+        buffer = bytearray(1000)
+        assert dec.readinto(buffer) == 1000 and buffer == data[:1000]
+        assert dec.read() == data[1000:]
+    with DecryptingReader(io.BytesIO(enc_data.getvalue()), password="pwd") as dec:
+        dec.seek(-100, io.SEEK_END)
+        assert dec.read() == data[-100:]
+    with pytest.raises(ValueError):
+        DecryptingReader(io.BytesIO(enc_data.getvalue()), password="wrong").read()
+    with pytest.raises(ValueError):
+        EncryptingWriter(io.BytesIO(), password="pwd", public_key='encryption_area/id_rsa.pub')
+
+
+def test_lazy_file_objects():
+    """
+    Importing pycryptex.crypto.stream doesn't import the file objects and the crypto objects.
+    """
+    import subprocess
+    import sys
+    code = ("import sys; import pycryptex.crypto.stream; "
+            "print(sorted(m for m in sys.modules if m.split('.')[-1] in ('fileobj', 'aes', 'rsa', 'ecc', 'keys')))")
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True).stdout
+    assert output.strip() == b"[]"
+    import pycryptex.crypto
+    with pytest.raises(AttributeError):
+        pycryptex.crypto.Unknown
+
+
+class _ReadOnly:
+    """
+    Object with only the read method (e.g. the body of a HTTP response).
+    """
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.data.read(size)
+
+
+def test_read_only_streams():
+    """
+    The objects without seekable() are read sequentially, both to encrypt (with the compression sample) and decrypt.
+    """
+    from pycryptex.crypto import DecryptingReader
+    from pycryptex.crypto.compression import COMPRESSION_ZLIB
+    data = get_random_bytes(200000)
+    enc_data = io.BytesIO()
+    AESCryptex(compression=COMPRESSION_ZLIB).encrypt_stream(_ReadOnly(data), enc_data, "pwd")
+    with DecryptingReader(_ReadOnly(enc_data.getvalue()), password="pwd") as dec:
+        assert not dec.seekable()
+        assert dec.read() == data
+
+
+@pytest.mark.parametrize("size", [0, 1, 64, 640, 1000])
+def test_mapped_files(tmp_path, monkeypatch, size):
+    """
+    Files mapped in memory and data written in pieces of any size are encrypted in the same format.
+    """
+    monkeypatch.setattr(stream, "MMAP_MIN_SIZE", 1)
+    monkeypatch.setattr(stream, "MMAP_WINDOW_SIZE", 200)
+    data = get_random_bytes(size)
+    (tmp_path / "clear").write_bytes(data)
+    header = stream.Header(stream.KIND_AES, [b"salt"], segment_size=64, salt=b"s" * 16)
+    with open(tmp_path / "clear", "rb") as reader, open(tmp_path / "enc", "wb") as writer:
+        assert stream.encrypt(b"k" * 32, header, reader, writer) == size
+        assert reader.read() == b""
+    enc_data = (tmp_path / "enc").read_bytes()
+    assert decrypt_segments(enc_data) == data
+    for piece in (1, 63, 64, 65, 1000):
+        enc = io.BytesIO()
+        with stream.SegmentWriter(b"k" * 32, header, enc) as writer:
+            for i in range(0, size, piece):
+                writer.write(data[i:i + piece])
+        assert enc.getvalue() == enc_data
+    with open(tmp_path / "enc", "rb") as reader, open(tmp_path / "dec", "wb") as writer:
+        stream.read_header(reader)
+        assert stream.decrypt(b"k" * 32, header, reader, writer) == size
+    assert (tmp_path / "dec").read_bytes() == data
+
+
+@pytest.mark.parametrize("cipher", sorted(stream.SUITES))
+def test_cipher_suites(tmp_path, cipher):
+    """
+    The suite is saved into the header, decrypt picks it up and a tampered segment is refused.
+    """
+    from click.testing import CliRunner
+    from pycryptex.main import cli
+    data = get_random_bytes(200000)
+    (tmp_path / "data.bin").write_bytes(data)
+    result = CliRunner().invoke(cli, ['encrypt', '--pubkey', 'encryption_area/id_rsa.pub', '--cipher', cipher,
+                                      str(tmp_path / "data.bin")])
+    assert result.exit_code == 0
+    enc_data = (tmp_path / "data.bin.pycpx").read_bytes()
+    header, _ = stream.read_header(io.BytesIO(enc_data))
+    assert header.suite == stream.SUITES[cipher]
+    tampered = bytearray(enc_data)
+    tampered[-100] ^= 1
+    with pytest.raises(ValueError):
+        RSACryptex().decrypt_data(bytes(tampered), 'encryption_area/id_rsa')
+    result = CliRunner().invoke(cli, ['decrypt', '--privkey', 'encryption_area/id_rsa', str(tmp_path / "data.bin.pycpx")])
+    assert result.exit_code == 0
+    assert (tmp_path / "data.bin").read_bytes() == data
+
+
+@pytest.mark.parametrize("name", ["zlib", "lzma", "zstd"])
+def test_compression(tmp_path, name):
+    """
+    Text is compressed before encryption, data already compressed (hawk.jpg) are not.
+    """
+    from pycryptex.crypto import compression
+    from pycryptex.crypto.fileobj import EncryptingWriter, DecryptingReader
+    from pycryptex.internal import pipeline
+    if name == "zstd":
+        pytest.importorskip("zstandard")
+    algorithm = compression.COMPRESSIONS[name]
+    cryptex = RSACryptex(compression=algorithm)
+    text = b"".join(b'{"line": %d, "level": "info", "message": "request served"}\n' % i for i in range(20000))
+    jpg = open("encryption_area/hawk.jpg", "rb").read()
+    for data, compressed in ((text, True), (jpg, False), (b"", False)):
+        enc = io.BytesIO()
+        assert cryptex.encrypt_stream(io.BytesIO(data), enc, 'encryption_area/id_rsa.pub') == len(data)
+        header, _ = stream.read_header(io.BytesIO(enc.getvalue()))
+        assert header.compression == (algorithm if compressed else compression.COMPRESSION_NONE)
+        if compressed:
+            assert len(enc.getvalue()) < len(data) / 5
+        assert RSACryptex().decrypt_data(enc.getvalue(), 'encryption_area/id_rsa') == data
+    # streams are compressed without sampling, the decrypted stream is not seekable
+    enc = io.BytesIO()
+    with EncryptingWriter(enc, public_key='encryption_area/id_rsa.pub', compression=name) as writer:
+        writer.write(text[:1000])
+        writer.write(text[1000:])
+    with DecryptingReader(io.BytesIO(enc.getvalue()), private_key='encryption_area/id_rsa') as reader:
+        assert reader.header.compression == algorithm and not reader.seekable()
+        assert reader.read() == text
+    # pipelined engine
+    (tmp_path / "log.json").write_bytes(text)
+    (tmp_path / "hawk.jpg").write_bytes(jpg)
+    files = [str(tmp_path / "log.json"), str(tmp_path / "hawk.jpg")]
+    assert not pipeline.process_files(files, cryptex, True, True, public_key='encryption_area/id_rsa.pub')
+    assert (tmp_path / "log.json.pycpx").stat().st_size < len(text) / 5
+    assert not pipeline.process_files([f + ".pycpx" for f in files], RSACryptex(), False, True,
+                                      private_key='encryption_area/id_rsa')
+    assert (tmp_path / "log.json").read_bytes() == text and (tmp_path / "hawk.jpg").read_bytes() == jpg